@@ -15,10 +15,37 @@ import time
 import sys
 import logging
 import os
-import requests
 
-# AWS Boto library
-from boto import ec2, route53, exception
+# Local modules
+import cutover as cutover_backends
+import drain
+import health_check
+import history
+import inventory
+import journal
+import lazy
+import load_test
+import logs
+import metrics
+import placement
+import preflight
+import propagation
+import reaper
+import route53_cache
+import snapshot
+import throttle
+import traffic_shift
+import waiters
+import warm_pool
+import warm_up
+
+# AWS Boto library and requests (imported on first use, --help or plan never need them)
+ec2 = lazy.load('boto.ec2')
+elb = lazy.load('boto.ec2.elb')
+exception = lazy.load('boto.exception')
+route53 = lazy.load('boto.route53')
+vpc = lazy.load('boto.vpc')
+requests = lazy.load('requests')
 
 #####################################################################
 #      Static data and configuration
@@ -27,8 +54,14 @@ from boto import ec2, route53, exception
 # Static AWS Rest service for getting instance details
 AWS_METADATA = 'http://169.254.169.254/latest/meta-data/instance-id'
 
-log_path = '/var/log/'
-file_name = 'blue-green-deploy'
+# TTL of records we write. Clients could keep old answer that long after the change.
+DNS_TTL = 300
+
+# Set by daemon. Connections are reused between runs when it is set.
+CONNECTION_POOL = None
+
+log_path = logs.LOG_PATH
+file_name = logs.FILE_NAME
 
 #####################################################################
 #      Functions
@@ -77,19 +110,27 @@ def read_config_file(logger):
 
 
 def set_up_logging(path, file):
-    # Log file. Always in /var/log!! It will log into the file and console
-    logging.basicConfig(level=logging.WARN)
-    log_formatter = logging.Formatter("%(asctime)s [%(levelname)-5.5s]  %(message)s")
-    root_logger = logging.getLogger()
+    # Log file. Always in /var/log!! It will log into the file (JSON lines) and console. Nothing is opened until the
+    # first record is logged, see logs module.
+    return logs.install(path, file)
 
-    file_handler = logging.FileHandler("{0}/{1}.log".format(path, file))
-    file_handler.setFormatter(log_formatter)
-    root_logger.addHandler(file_handler)
 
-    return root_logger
+def connect_to_aws(region, aws_access_key, aws_secret_key):
+    """
+    :description: Returns connections from the pool (daemon mode) or opens new ones.
+    :param:
+        region: AWS region
+        aws_access_key: AWS Access Key
+        aws_secret_key: AWS Secret Key
+    :return: map of aws services and connection handles for them.
+    """
+    if CONNECTION_POOL is not None:
+        return CONNECTION_POOL.get(region, aws_access_key, aws_secret_key, open_connections)
 
+    return open_connections(region, aws_access_key, aws_secret_key)
 
-def connect_to_aws(region, aws_access_key, aws_secret_key):
+
+def open_connections(region, aws_access_key, aws_secret_key):
     """
     :param:
         region: AWS region
@@ -116,140 +157,260 @@ def connect_to_aws(region, aws_access_key, aws_secret_key):
     else:
         logging.info('Connected to AWS Route53')
 
-    return {'ec2': ec2_conn, 'route53': route53_conn}
+    # Subnets are described by VPC API (same endpoint and limits as EC2).
+    vpc_conn = vpc.connect_to_region(region_name=region,
+                                     aws_access_key_id=aws_access_key,
+                                     aws_secret_access_key=aws_secret_key)
 
+    # Classic load balancers (for elb cutover).
+    elb_conn = elb.connect_to_region(region,
+                                     aws_access_key_id=aws_access_key,
+                                     aws_secret_access_key=aws_secret_key)
+
+    # Every call is rate limited and retried when throttled (see throttle module), counted and timed (see metrics).
+    # Limits are per account, so buckets are too.
+    return {'ec2': metrics.instrument(throttle.wrap(ec2_conn, 'ec2', region, aws_access_key), 'ec2'),
+            'vpc': metrics.instrument(throttle.wrap(vpc_conn, 'ec2', region, aws_access_key), 'ec2'),
+            'elb': metrics.instrument(throttle.wrap(elb_conn, 'elb', region, aws_access_key), 'elb'),
+            'route53': metrics.instrument(throttle.wrap(route53_conn, 'route53', 'global', aws_access_key),
+                                          'route53')}
 
-def get_specific_instances(ec2_conn, tag_key, tag_value, instance_state):
+
+def get_specific_instances(ec2_conn, tag_key, tag_value, instance_state, app=None):
     """
-    :description: Returns requested instance - uses filters to get it.
+    :description: Returns requested instance - uses inventory snapshot (or filters for other tags) to get it.
     :param
         ec2_conn: Connections to AWS EC2.
         tag_key: Name of the tag.
         tag_value: Value of the tag.
         instance_state: One of three states - "running" / "pending" / "stopped".
+        app: Application (App tag, see inventory.app_name) or None for instances of all applications.
     :return: boolean result.
     """
+    if tag_key == inventory.TAG_KEY:
+        # Environment tag is indexed so no need to ask AWS again.
+        return inventory.for_connection(ec2_conn).find(tag_value, instance_state, app)
+
     # Filters instances with specific tag and in specific state.
-    instances = ec2_conn.get_only_instances(filters={"tag:{0}".format(tag_key): tag_value,
-                                                     "instance-state-name": instance_state})
+    filters = {"tag:{0}".format(tag_key): tag_value, "instance-state-name": instance_state}
+    if app is not None:
+        filters["tag:{0}".format(inventory.APP_TAG_KEY)] = app
+    instances = ec2_conn.get_only_instances(filters=filters)
 
     return instances
 
 
 def create_new_instance(ec2_conn, image_id, ssh_key, sec_group, subnet_id, env, instance_name, user_data=None,
-                        instance_size='t2.micro', shutdown='stop', dry_run=False):
+                        instance_size='t2.micro', shutdown='stop', dry_run=False, count=1, use_warm_pool=False,
+                        hedge_delay=placement.HEDGE_DELAY, latency_file=None, app=None):
     """
     :param
         ec2_conn: connection to AWS EC2 service
         image_id: Amazon Machine Image ID with all your software
         ssh_key: AWS key pair name
         sec_group: Security group ID that should be allocated
-        subnet_id: Subnet ID in which your instance should be created
+        subnet_id: Subnet ID in which your instance should be created or list of them (primary first). With more
+                   subnets, backup launches are started in the next ones (see placement module).
         env: Environment (blue / green / old_app)
         instance_name: Name tag value
         user_data: Cloud-Init script that will run once
         instance_size: String with instance size
         shutdown_behaviour: stop or termination
         dry-run: True or False. If True, it will not make any changes.
-    :return: instance ID if created or None
+        count: Number of instances in the fleet. All of them are launched with one request.
+        use_warm_pool: True or False. If True, stopped instances from warm pool are started first and only the
+                       rest is launched.
+        hedge_delay: Seconds after which backup launch is started in the next subnet.
+        latency_file: File to which launch latency of every tried subnet is appended (None to skip it).
+        app: Application (App tag, see inventory.app_name) or None
+    :return: list of created instances or None
     """
+    subnets = placement.subnet_list(subnet_id)
+
     # Checks (by filtering instances currently running) if there is no other instance running with the same tags.
-    instances = get_specific_instances(ec2_conn, "Environment", env, ["running", "pending"])
+    instances = get_specific_instances(ec2_conn, "Environment", env, ["running", "pending"], app)
 
     if not instances:
+        taken = []
+        if use_warm_pool and not dry_run:
+            taken = warm_pool.take(ec2_conn, count, image_id, instance_size, subnets, app)
+
+        if len(taken) == count:
+            tag_new_instances(ec2_conn, taken, instance_name, env, app)
+            return taken
+
+        def launch(launch_subnet_id, launch_count):
+            reservation = ec2_conn.run_instances(image_id,
+                                                 key_name=ssh_key,
+                                                 user_data=user_data,
+                                                 instance_type=instance_size,
+                                                 subnet_id=launch_subnet_id,
+                                                 security_group_ids=sec_group,
+                                                 instance_initiated_shutdown_behavior=shutdown,
+                                                 min_count=launch_count,
+                                                 max_count=launch_count,
+                                                 dry_run=dry_run)
+            inventory.invalidate(ec2_conn)
+
+            # Backup launches are tagged straight away too, so they are never left behind unnoticed.
+            if reservation is not None and len(subnets) > 1:
+                tag_new_instances(ec2_conn, reservation.instances, instance_name, env, app)
+
+            return reservation
+
+        if len(subnets) > 1 and not dry_run:
+            launched, launches = placement.hedged_launch(
+                ec2_conn, subnets, count - len(taken),
+                lambda launch_subnet_id, launch_count: launch(launch_subnet_id, launch_count).instances, hedge_delay)
+
+            for record in launches:
+                LOGGER.info('Launch in %s: %s' % (record.subnet_id, record.error or '%.1fs' % record.seconds))
+            if latency_file:
+                placement.save_latencies(latency_file, placement.region_name(ec2_conn), instance_size, image_id,
+                                         launches)
+
+            if not launched:
+                LOGGER.error('No new instance is running in any of %s.' % subnets)
+                sys.exit(1)
+
+            if taken:
+                tag_new_instances(ec2_conn, taken, instance_name, env, app)
+            return taken + launched
+
         # If list is not empty. Creates new instance.
         try:
-            reservations = ec2_conn.run_instances(image_id,
-                                                  key_name=ssh_key,
-                                                  user_data=user_data,
-                                                  instance_type=instance_size,
-                                                  subnet_id=subnet_id,
-                                                  security_group_ids=sec_group,
-                                                  instance_initiated_shutdown_behavior=shutdown,
-                                                  dry_run=dry_run)
+            reservations = launch(subnets[0], count - len(taken))
 
             if reservations is not None and not dry_run:
-                # When instance was created, we have to assign tags.
-                tag_new_instance(reservations.instances[0], instance_name, env)
+                # When instances were created, we have to assign tags.
+                tag_new_instances(ec2_conn, taken + reservations.instances, instance_name, env, app)
             else:
                 LOGGER.error('Something went wrong when creating new instance.')
                 sys.exit(1)
         except exception.EC2ResponseError:
             if dry_run:
-                LOGGER.warn('New instance would be created and this tags should be assigned')
+                LOGGER.warn('%s new instance(s) would be created and this tags should be assigned' % count)
                 LOGGER.warn('Name: %s' % instance_name)
                 LOGGER.warn('Environment: %s' % env)
+                LOGGER.warn('App: %s' % app)
                 LOGGER.warn('Deployment Date: %s' % time.strftime("%d-%m-%Y"))
                 return 'OK'
             else:
+                # Throttled and not yet visible instances were already retried by the call layer.
                 LOGGER.error('Something went wrong when creating new instance.')
-
-                try:
-                    # Last chance - waiting 1 minute to tag instance.
-                    time.sleep(60)
-                    tag_new_instance(reservations.instances[0], instance_name, env)
-                except exception.EC2ResponseError:
-                    sys.exit(1)
+                sys.exit(1)
     else:
         # Looks like there was another instance running with the same tags.
         LOGGER.warn('There is another instance running with %s environment tag (id: %s).' % (env, instances[0]))
         return None
 
-    return reservations.instances
+    return taken + reservations.instances
+
+
+def get_journaled_instances(ec2_conn, instance_ids, states):
+    """
+    :description: Returns instances remembered in journal if all of them still exist in one of given states.
+    :param
+        ec2_conn: Connection to AWS EC2 service.
+        instance_ids: IDs of instances from journal.
+        states: List of states in which instances are still valid.
+    :return: list of instances or None
+    """
+    try:
+        instances = ec2_conn.get_only_instances(instance_ids=instance_ids)
+    except exception.EC2ResponseError as ex:
+        LOGGER.warning('Instances %s from journal are gone: %s' % (instance_ids, ex))
+        return None
+
+    if len(instances) != len(instance_ids) or any(instance.state not in states for instance in instances):
+        LOGGER.warning('Instances %s from journal are not %s any more.' % (instance_ids, ' / '.join(states)))
+        return None
+
+    return instances
 
 
-def tag_instance(instance, tag_name, tag_key):
+def get_change_id(result):
     """
-    :description: Removes old tag and creates new one with updated value.
+    :description: Returns ID of Route53 change from AWS respond.
     :param
-        instance: Instance that should be tagged.
+        result: Result of the change (AWS respond).
+    :return: change ID or None
+    """
+    try:
+        return result['ChangeResourceRecordSetsResponse']['ChangeInfo']['Id']
+    except (KeyError, TypeError):
+        return None
+
+
+def tag_instances(ec2_conn, instances, tag_name, tag_key, app=None):
+    """
+    :description: Sets tag on all given instances with one call. Existing value is overwritten by AWS.
+    :param
+        ec2_conn: Connection to AWS EC2 service.
+        instances: Instances that should be tagged.
         tag_name: Name of the tag.
         tag_key: Value of the tag.
+        app: Application (App tag) set with the same call, or None to leave App tag as it is.
     :return: None
     """
-    instance.remove_tag('{0}'.format(tag_name))
-    instance.add_tag('{0}'.format(tag_name), '{0}'.format(tag_key))
+    tags = {'{0}'.format(tag_name): '{0}'.format(tag_key)}
+    if app is not None:
+        tags[inventory.APP_TAG_KEY] = app
+
+    ec2_conn.create_tags([instance.id for instance in instances], tags)
+    inventory.invalidate(ec2_conn)
 
 
-def tag_new_instance(instance, instance_name, environment):
+def tag_new_instances(ec2_conn, instances, instance_name, environment, app=None):
     """
-    :description: Tags new instance.
+    :description: Tags new instances. Whole fleet is tagged with one bulk call.
     :param
-        instance: Instance that should be tagged.
-        instance_name: Name of the instance.
+        ec2_conn: Connection to AWS EC2 service.
+        instances: Instances that should be tagged.
+        instance_name: Name of the instances.
         environment: blue org green.
+        app: Application (App tag) or None.
     :return: None
     """
-    instance.add_tag('Name', instance_name)
-    instance.add_tag('Environment', environment)
-    instance.add_tag('Deployment Date', time.strftime("%d-%m-%Y"))
+    tags = {'Name': instance_name,
+            'Environment': environment,
+            'Deployment Date': time.strftime("%d-%m-%Y")}
+    if app is not None:
+        tags[inventory.APP_TAG_KEY] = app
 
+    ec2_conn.create_tags([instance.id for instance in instances], tags)
+    inventory.invalidate(ec2_conn)
 
-def stop_instance(aws_connection, env, domain, live_alias, tag, dry_run=False):
+
+def stop_instance(aws_connection, env, domain, live_alias, tag, dry_run=False, cutover=None):
     """
-    :description: Stops past live instance.
+    :description: Stops past live instances (whole fleet with given environment tag).
     :param
         aws_connection: Connections to AWS Route53 service and EC2.
         env: Blue or green depends which instance you want to stop (cross check).
         domain: Your Domain.
         live_alias: Your external DNS record pointing to live web server.
         dry-run: True or False. If True, it will not make any changes.
+        cutover: cutover.Cutover or None when traffic is moved by DNS.
     :return: boolean result.
     """
     result = False
 
     tag = ''.join(tag.values())
+    app = inventory.app_name(domain)
 
     # Gets past live instance.
-    instances = get_specific_instances(aws_connection.get('ec2'), "Environment", env, "running")
+    instances = get_specific_instances(aws_connection.get('ec2'), "Environment", env, "running", app)
 
-    if check_which_is_live(aws_connection.get('route53'), domain, live_alias) != (env + "." + domain) and instances:
-        # Instance is not live
+    if find_live(aws_connection, domain, live_alias, cutover) != (env + "." + domain) and instances:
+        # Instances are not live
+        instance_ids = [instance.id for instance in instances]
         try:
-            aws_connection.get('ec2').stop_instances(instance_ids=[instances[0].id], dry_run=dry_run)
-            tag_instance(instances[0], 'Environment', tag)
+            aws_connection.get('ec2').stop_instances(instance_ids=instance_ids, dry_run=dry_run)
+            inventory.invalidate(aws_connection.get('ec2'))
+            tag_instances(aws_connection.get('ec2'), instances, 'Environment', tag, app)
         except exception.EC2ResponseError:
-            LOGGER.warn('Instance %s would be stopped and tagged with Environment:%s' % (instances[0].id, tag))
+            LOGGER.warn('Instances %s would be stopped and tagged with Environment:%s' % (instance_ids, tag))
 
         result = True
     else:
@@ -271,11 +432,51 @@ def check_which_is_live(route53_conn, domain, live_alias):
         live_alias: Your external DNS record pointing to live web server.
     :return: fqdn of live sub alias (blue or green)
     """
-    live_fqdn = route53_conn.get_zone(domain).get_a(live_alias).alias_dns_name
+    records = route53_cache.for_zone(route53_conn, domain).find(live_alias, 'A')
+
+    # During progressive cutover there are weighted records. Live is the one with the biggest weight.
+    live_fqdn = max(records, key=lambda record: int(record.weight or 0)).alias_dns_name
 
     return live_fqdn
 
 
+def find_live(aws_connection, domain, live_alias, cutover=None):
+    """
+    :description: Checks which alias is live. With cutover backend it is the color which gets the traffic.
+    :param
+        aws_connection: Connections to AWS services
+        domain: Your Domain
+        live_alias: Your external DNS record pointing to live web server.
+        cutover: cutover.Cutover or None when traffic is moved by DNS.
+    :return: fqdn of live sub alias (blue or green) or None
+    """
+    if cutover is None:
+        return check_which_is_live(aws_connection.get('route53'), domain, live_alias)
+
+    env = cutover.live_env(aws_connection)
+
+    return env + "." + domain if env else None
+
+
+def cached_ttl(route53_conn, domain, name):
+    """
+    :description: Returns how long clients could cache answer for name. Alias record has TTL of its target.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+        name: DNS name (e.g. live alias)
+    :return: seconds (DNS_TTL when record is unknown)
+    """
+    ttls = []
+    for record in route53_cache.for_zone(route53_conn, domain).find(name, 'A'):
+        if record.alias_dns_name and route53_cache.normalize(record.alias_dns_name) != route53_cache.normalize(name):
+            ttls.append(cached_ttl(route53_conn, domain, record.alias_dns_name))
+        elif record.ttl is not None:
+            ttls.append(int(record.ttl))
+
+    return max(ttls) if ttls else DNS_TTL
+
+
 def get_env(fqdn, domain):
     """
     :description: Give you environment from given fqdn by removing domain from fqdn.
@@ -289,26 +490,41 @@ def get_env(fqdn, domain):
     return env
 
 
+def add_dns_change(live_alias, future_value, alias_dns_name, zone, records):
+    """
+    :description: Adds UPSERT of the record to change batch. Nothing is sent to AWS until batch is committed.
+    :param
+        live_alias: DNS record which should be changed.
+        future_value: blue.<domain> or green.<domain> depends which is going to be live. Could be list of IPs.
+        alias_dns_name: Alias target or None for plain A record.
+        zone: handle to zone that hosts dns records.
+        records: change batch of the zone.
+    :return: None
+    """
+    change = records.add_change(action='UPSERT',
+                                name=live_alias,
+                                ttl=DNS_TTL,
+                                type='A',
+                                alias_dns_name=alias_dns_name,
+                                alias_hosted_zone_id=zone.id,
+                                alias_evaluate_target_health=False)
+    for value in (future_value if isinstance(future_value, list) else [future_value]):
+        change.add_value(value)
+
+
 def swap_dns(live_alias, future_value, alias_dns_name, zone, records):
     """
     :description: Changes alias (blue.<domain> or green.<domain>) that is behind live url.
     :param
         live_alias: Your external DNS record pointing to live web server.
-        future_alias: blue.<domain> or green.<domain> depends which is going to be live.
+        future_value: blue.<domain> or green.<domain> depends which is going to be live. Could be list of IPs.
         zone: handle to zone that hosts dns records.
         records: sets of dns records from the zone..
     :return: Result of the change (AWS respond).
     """
     try:
-        change = records.add_change(action='UPSERT',
-                                    name=live_alias,
-                                    ttl=300,
-                                    type='A',
-                                    alias_dns_name=alias_dns_name,
-                                    alias_hosted_zone_id=zone.id,
-                                    alias_evaluate_target_health=False)
-        change.add_value(future_value)
-        result = records.commit()
+        add_dns_change(live_alias, future_value, alias_dns_name, zone, records)
+        result = route53_cache.commit(records.connection, zone.name, records)
     except Exception as ex:
         LOGGER.error('Could not swap dns entry for %s. Exception: %s' % (live_alias, ex))
         sys.exit(1)
@@ -316,49 +532,119 @@ def swap_dns(live_alias, future_value, alias_dns_name, zone, records):
     return result
 
 
-def swap_live_with_staging(aws_connection, domain, current_live, live_alias, blue_alias, green_alias, dry_run=False):
+def swap_live_with_staging(aws_connection, domain, current_live, live_alias, blue_alias, green_alias, dry_run=False,
+                           check_health=True, health_options=None, shift_steps=None,
+                           shift_wait=traffic_shift.STEP_WAIT, load_options=None, history_key=None,
+                           warm_up_options=None):
     """
-    :description: Changes alias (blue.<domain> or green.<domain>) that is behind live url.
+    :description: Changes alias (blue.<domain> or green.<domain>) that is behind live url. Staging has to pass
+                  health check first. With shift_steps traffic is moved progressively with weighted records.
     :param
         aws_connection: Connections to AWS Route53 service and EC2
         domain: Your Domain
         current_live: blue.<domain> or green.<domain> depends which is live
         live_alias: Your external DNS record pointing to live web server.
         dry-run: True or False. If True, it will not make any changes.
+        check_health: True or False. If False, traffic is switched without health check.
+        health_options: Dictionary with health check settings (see health_check.probe_nodes).
+        shift_steps: List of percents of traffic moved to staging step by step (e.g. [1, 10, 50, 100]).
+        shift_wait: Seconds of traffic between step and its health check.
+        load_options: Dictionary with load test gate settings (see check_load) or None.
+        history_key: History key of staging fleet (see fleet_key) or None.
+        warm_up_options: Dictionary with warm-up settings (see check_warm) or None.
     :return: Result of the change (AWS respond).
     """
     route53_conn = aws_connection.get('route53')
 
-    zone = route53_conn.get_zone(domain)
+    zone = route53_cache.get_zone(route53_conn, domain)
+
+    records = route53_cache.new_change_batch(route53_conn, domain)
 
-    records = route53.record.ResourceRecordSets(connection=route53_conn, hosted_zone_id=zone.id)
+    # Blue was live so now time for Green. Or this time Green was live. Blue, are you ready?
+    future_live = green_alias if current_live == blue_alias else blue_alias
 
     if dry_run:
         # Dry run
-        LOGGER.warn('DNS record %s would be updated with %s' %
-                    (live_alias, green_alias if current_live == blue_alias else blue_alias))
+        LOGGER.warn('DNS record %s would be updated with %s' % (live_alias, future_live))
 
         result = 'OK'
+    elif check_health and not check_staging(route53_conn, domain, future_live, health_options,
+                                            history_key=history_key):
+        LOGGER.error('Staging is not healthy.')
+        sys.exit(1)
+    elif warm_up_options and not check_warm(route53_conn, domain, future_live, warm_up_options):
+        LOGGER.error('Staging did not warm up.')
+        sys.exit(1)
+    elif load_options and not check_load(route53_conn, domain, current_live, future_live, load_options):
+        LOGGER.error('Staging did not pass load test.')
+        sys.exit(1)
+    elif shift_steps:
+        def gate(percent):
+            report = staging_report(route53_conn, domain, future_live, health_options)
+            return report.passed, report.reason
+
+        result = traffic_shift.shift_traffic(route53_conn, domain, live_alias, current_live, future_live,
+                                             get_env(current_live, domain), get_env(future_live, domain), gate,
+                                             shift_steps, shift_wait)
+        if not result:
+            LOGGER.error('Progressive cutover failed. %s is still live.' % current_live)
+            sys.exit(1)
     else:
-        if current_live == blue_alias:
-            # Blue was live so now time for Green.
-            #if simple_check(green_alias):
-                result = swap_dns(live_alias, green_alias, green_alias, zone, records)
-            #else:
-            #    LOGGER.error('Staging is not running.')
-            #    sys.exit(1)
-
-        else:
-            # This time Green was live. Blue, are you ready?
-            #if simple_check(blue_alias):
-                result = swap_dns(live_alias, blue_alias, blue_alias, zone, records)
-            #else:
-            #    LOGGER.error('Staging is not running.')
-            #    sys.exit(1)
+        result = swap_dns(live_alias, future_live, future_live, zone, records)
 
     return result
 
 
+def cut_over(aws_connection, domain, current_live, blue_alias, green_alias, cutover, dry_run=False,
+             check_health=True, health_options=None, load_options=None, region=None, warm_up_options=None):
+    """
+    :description: Moves traffic to staging with cutover backend (Elastic IP or load balancer) instead of DNS.
+    :param
+        aws_connection: Connections to AWS services
+        domain: Your Domain
+        current_live: blue.<domain> or green.<domain> depends which is live
+        cutover: cutover.Cutover
+        dry-run: True or False. If True, it will not make any changes.
+        check_health: True or False. If False, traffic is switched without health check.
+        health_options: Dictionary with health check settings (see health_check.probe_nodes).
+        load_options: Dictionary with load test gate settings (see check_load) or None.
+        region: AWS region (health check timings are recorded to history when set)
+        warm_up_options: Dictionary with warm-up settings (see check_warm) or None.
+    :return: boolean status
+    """
+    future_live = green_alias if current_live == blue_alias else blue_alias
+    ec2_conn = aws_connection.get('ec2')
+    app = inventory.app_name(domain)
+
+    new_instances = get_specific_instances(ec2_conn, 'Environment', get_env(future_live, domain), 'running', app)
+    old_instances = get_specific_instances(ec2_conn, 'Environment', get_env(current_live, domain), 'running', app) \
+        if current_live else []
+
+    if not new_instances:
+        LOGGER.error('No running instance of %s.' % future_live)
+        sys.exit(1)
+
+    if dry_run:
+        LOGGER.warn('%s would be moved to %s' % (cutover, [instance.id for instance in new_instances]))
+        return 'OK'
+    elif check_health and not check_staging(aws_connection.get('route53'), domain, future_live, health_options,
+                                            history_key=fleet_key(region, new_instances) if region else None):
+        LOGGER.error('Staging is not healthy.')
+        sys.exit(1)
+    elif warm_up_options and not check_warm(aws_connection.get('route53'), domain, future_live, warm_up_options):
+        LOGGER.error('Staging did not warm up.')
+        sys.exit(1)
+    elif load_options and not check_load(aws_connection.get('route53'), domain, current_live, future_live,
+                                         load_options):
+        LOGGER.error('Staging did not pass load test.')
+        sys.exit(1)
+    elif not cutover.switch(aws_connection, old_instances, new_instances):
+        LOGGER.error('Cutover with %s failed. %s is still live.' % (cutover, current_live))
+        sys.exit(1)
+
+    return True
+
+
 def assign_to_staging(route53_conn, domain, current_live, instance_public_ip, live_alias, blue_alias, green_alias,
                       dry_run=False):
     """
@@ -367,61 +653,66 @@ def assign_to_staging(route53_conn, domain, current_live, instance_public_ip, li
         route53_conn: Connection to AWS Route53 service
         domain: Your Domain
         current_live: blue.<domain> or green.<domain> depends which one was behind your live url.
-        instance_public_ip: Public IP of newly created instance that would be assigned to staging url.
+        instance_public_ip: Public IP (or list of IPs for the fleet) that would be assigned to staging url.
         dry-run: True or False. If True, it will not make any changes.
     :return: Result of the change (AWS respond).
     """
-    zone = route53_conn.get_zone(domain)
+    zone = route53_cache.get_zone(route53_conn, domain)
 
-    records = route53.record.ResourceRecordSets(connection=route53_conn, hosted_zone_id=zone.id)
+    records = route53_cache.new_change_batch(route53_conn, domain)
 
     if dry_run:
         LOGGER.warn('Public IP %s would be assigned to %s' % (instance_public_ip, live_alias))
 
         result = 'OK'
     else:
-        result = swap_dns(blue_alias if current_live == green_alias else green_alias, instance_public_ip, None, zone,
+        # Same pick as deployment_stage: green only when blue is live (blue when nothing is live yet).
+        result = swap_dns(green_alias if current_live == blue_alias else blue_alias, instance_public_ip, None, zone,
                           records)
 
     return result
 
 
-def delete_old_instance(ec2_conn, tag, dry_run=False):
+def delete_old_instance(ec2_conn, tag, dry_run=False, count=1, app=None):
     """
-    :description: Deletes instance for given tag only if it is stopped
+    :description: Deletes old fleet for given tag only if it is stopped
     :param
         ec2_conn: Connection to AWS EC2 service
         old_tag: Dictionary with <tag_name> <tag_value> pair
         dry-run: True or False. If True, it will not make any changes.
+        count: Expected size of the old fleet.
+        app: Application (App tag) or None
     :return: boolean status
     """
     result = False
 
     # Filters instances with tag Environment = old-app and only in stopped state.
-    instances = get_specific_instances(ec2_conn, ''.join(tag.keys()), ''.join(tag.values()), "stopped")
+    instances = get_specific_instances(ec2_conn, ''.join(tag.keys()), ''.join(tag.values()), "stopped", app)
 
-    if len(instances) is 1:
-        # If there is only 1 instance in that state.
-        old = instances[0]
+    if len(instances) == count:
+        # If there is exactly one old fleet in that state.
+        old_ids = [old.id for old in instances]
 
-        LOGGER.debug("I am going to delete %s" % old.id)
+        LOGGER.debug("I am going to delete %s" % old_ids)
         try:
-            deleted_old = ec2_conn.terminate_instances(instance_ids=[old.id], dry_run=dry_run)
+            deleted_old = ec2_conn.terminate_instances(instance_ids=old_ids, dry_run=dry_run)
+            inventory.invalidate(ec2_conn)
 
-            # Previous line should return instance that was deleted. Worth to check if it was the one we want to delete.
-            if deleted_old[0].id == old.id:
-                LOGGER.info('Deleted %s' % deleted_old[0].id)
+            # Previous line should return instances that were deleted. Worth to check if these are the ones we want.
+            if sorted(deleted.id for deleted in deleted_old) == sorted(old_ids):
+                LOGGER.info('Deleted %s' % old_ids)
                 result = True
         except exception.EC2ResponseError as ex:
             if dry_run:
-                LOGGER.error('Instance %s would be deleted.' % old.id)
+                LOGGER.error('Instances %s would be deleted.' % old_ids)
             else:
-                LOGGER.error('Something went wrong when deleting old instance.')
+                LOGGER.error('Something went wrong when deleting old instances.')
 
             LOGGER.error(ex)
     else:
-        # It could be none or multiple instance in that state. Better notify before someone starts complaining.
-        LOGGER.warn('No old instance or more than 1 instance was found. I hope you are aware of that. Continue.')
+        # It could be none or different number of instances in that state. Better notify before someone complains.
+        LOGGER.warn('Found %s old instances but expected %s. I hope you are aware of that. Continue.'
+                    % (len(instances), count))
         result = True  # I am returning true because it shouldn't be a big issue
 
     return result
@@ -429,32 +720,49 @@ def delete_old_instance(ec2_conn, tag, dry_run=False):
 
 def wait_for_public_ip(ec2_conn, instance_id):
     """
-    :description: Gets instance's Public IP. Retries every 5 seconds for 30 seconds.
+    :description: Gets instance's Public IP. Retries with backoff for 4 minutes.
     :param
         ec2_conn: Connection to AWS EC2 service
         instance_id: ID of instance :)
     :return: Public IP or exits the script
     """
-    counter = 0
+    return wait_for_public_ips(ec2_conn, [instance_id])[0]
 
-    while counter < 24:
-        # We are going to check every 10 seconds for 2 minutes.
-        stg_instance = ec2_conn.get_only_instances(instance_ids=[instance_id])
 
-        if stg_instance[0].ip_address is None:
-            # Still not available so wait 5 seconds.
-            time.sleep(10)
-        else:
-            # We got it!
-            public_ip = stg_instance[0].ip_address
-            return str(public_ip)
-
-        counter += 1
+def wait_for_public_ips(ec2_conn, instance_ids, timeout=waiters.TIMEOUT, expected=None, seen=None):
+    """
+    :description: Gets Public IPs of the whole fleet. All instances are checked with one call per tick and ticks are
+                  spread with jittered exponential backoff (dense inside expected window).
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        instance_ids: IDs of instances
+        timeout: How long (in seconds) we wait for all Public IPs.
+        expected: Tuple with start and end (seconds from now) when IPs are expected (see history.wait_plan) or None
+        seen: Dictionary which gets time when every instance was first seen running and with Public IP, keys are
+              (instance_id, 'running') and (instance_id, 'ip')
+    :return: list of Public IPs (in the same order as instance_ids) or exits the script
+    """
+    seen = {} if seen is None else seen
+
+    def has_public_ip(instance):
+        if waiters.is_running(instance):
+            seen.setdefault((instance.id, 'running'), time.time())
+        if waiters.has_public_ip(instance):
+            seen.setdefault((instance.id, 'running'), time.time())
+            seen.setdefault((instance.id, 'ip'), time.time())
+            return True
+        return False
+
+    result = waiters.wait_for_instances(ec2_conn, instance_ids, has_public_ip, timeout, expected=expected,
+                                        on_ready=lambda instance: LOGGER.info('Instance %s got Public IP %s' %
+                                                                              (instance.id, instance.ip_address)))
+
+    if result.timed_out:
+        # Unfortunately we couldn't get Public IP so logging and exiting.
+        LOGGER.error('Cannot get Public IP from instances %s' % result.timed_out)
+        sys.exit(1)
 
-    # Unfortunately we couldn't get Public IP so logging and exiting.
-    stg_instance = ec2_conn.get_only_instances(instance_ids=[instance_id])
-    LOGGER.error('Cannot get Public IP from instance %s' % stg_instance[0].id)
-    sys.exit(1)
+    return [str(result.ready[instance_id].ip_address) for instance_id in instance_ids]
 
 
 def simple_check(url):
@@ -481,88 +789,444 @@ def simple_check(url):
     return False
 
 
-def write_to_file(to_write):
-    f = open('parameters.properties', 'w')
-    f.write(to_write)
+def wait_for_dns(route53_conn, domain, name, target, change_id=None, timeout=propagation.TIMEOUT):
+    """
+    :description: Waits until Route53 change is INSYNC and all authoritative nameservers resolve name to IPs of target.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+        name: DNS record which was changed (e.g. live alias)
+        target: blue.<domain> or green.<domain> which name points to now
+        change_id: ID of the change or None
+        timeout: How long (in seconds) we wait
+    :return: PropagationResult or None if target has no IPs to compare with
+    """
+    target_record = route53_cache.get_a(route53_conn, domain, target)
+
+    if target_record is None or not target_record.resource_records:
+        LOGGER.warning('%s has no IPs. Cannot verify propagation of %s.' % (target, name))
+        return None
+
+    return propagation.wait_for_propagation(route53_conn, route53_cache.get_nameservers(route53_conn, domain),
+                                            change_id, name, target_record.resource_records, timeout)
+
+
+def check_staging(route53_conn, domain, staging_alias, health_options=None, nodes=None, history_key=None):
+    """
+    :description: Checks all nodes behind staging alias concurrently (status codes and latency percentiles).
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+        staging_alias: blue.<domain> or green.<domain> which is going to be live.
+        health_options: Dictionary with health check settings (see health_check.probe_nodes).
+        nodes: IPs of staging nodes. By default they are taken from staging record.
+        history_key: Tuple with region, instance type and AMI of staging (see fleet_key). If set, timeout could be
+                     raised by history (unless health_options set it) and time until healthy is recorded.
+    :return: Boolean
+    """
+    return staging_report(route53_conn, domain, staging_alias, health_options, nodes, history_key).passed
+
+
+def staging_report(route53_conn, domain, staging_alias, health_options=None, nodes=None, history_key=None):
+    """
+    :description: Same as check_staging but returns full health report.
+    :return: health_check.HealthReport
+    """
+    if nodes is None:
+        record = route53_cache.get_a(route53_conn, domain, staging_alias)
+        nodes = [] if record is None else list(record.resource_records)
+
+    options = {'host_header': staging_alias.rstrip('.')}
+    if history_key is not None:
+        # Health check runs long after staging booted, so recorded times are short and tell nothing about slow
+        # starting fleets. History could only make the timeout longer, never shorter than the default.
+        options['timeout'] = max(history.timeout('healthy', *history_key, default=health_check.TIMEOUT),
+                                 health_check.TIMEOUT)
+    options.update(health_options or {})
+
+    started = time.time()
+    report = health_check.check_nodes(nodes, **options)
+    if not report.passed:
+        LOGGER.error('Health check of %s failed: %s' % (staging_alias, report.reason))
+    elif history_key is not None:
+        history.record('healthy', *history_key, seconds=time.time() - started)
+
+    return report
+
+
+def fleet_key(region, instances):
+    """
+    :description: History key of a fleet.
+    :param
+        region: AWS region
+        instances: Instances of the fleet
+    :return: tuple with region, instance type and AMI ID (None when there is no instance)
+    """
+    if not instances:
+        return region, None, None
+
+    return region, instances[0].instance_type, instances[0].image_id
+
+
+def record_boot(region, instance_size, image_id, launched_at, instance_ids, seen):
+    """
+    :description: Records launch to running and running to Public IP of every instance to history.
+    :param
+        region: AWS region
+        instance_size: String with instance size
+        image_id: Amazon Machine Image ID
+        launched_at: Time when instances were launched
+        instance_ids: IDs of instances
+        seen: Dictionary filled by wait_for_public_ips
+    :return: None
+    """
+    history.record('running', region, instance_size, image_id,
+                   [seen[(instance_id, 'running')] - launched_at for instance_id in instance_ids
+                    if (instance_id, 'running') in seen])
+    history.record('ip', region, instance_size, image_id,
+                   [seen[(instance_id, 'ip')] - seen[(instance_id, 'running')] for instance_id in instance_ids
+                    if (instance_id, 'ip') in seen])
 
 
-def switch(region, access_key, secret_key, tag, domain, live_url, blue_alias, green_alias, dry_run=False):
+def check_load(route53_conn, domain, current_live, future_live, load_options):
     """
-    :description: Rolls back deployment by starting instance with old-app tag and swapping dns entry.
+    :description: Load test gate. Staging nodes are loaded (live nodes at the same time with compare_live) and
+                  staging is compared with live or with the last saved result. Results are saved.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+        current_live: blue.<domain> or green.<domain> which is live
+        future_live: blue.<domain> or green.<domain> which is going to be live
+        load_options: Dictionary with load_test.run_load options, thresholds of load_test.evaluate, compare_live and
+                      results_file.
+    :return: Boolean
+    """
+    options = dict(load_options)
+    compare_live = options.pop('compare_live', False)
+    results_file = options.pop('results_file', None) or load_test.RESULTS_FILE
+    thresholds = dict((name, options.pop(name)) for name in ('max_rps_drop', 'max_p99_increase', 'max_error_rate')
+                      if name in options)
+
+    def nodes(alias):
+        record = route53_cache.get_a(route53_conn, domain, alias)
+        return [] if record is None else list(record.resource_records)
+
+    targets = [('staging', (nodes(future_live), future_live.rstrip('.')))]
+    if compare_live and current_live:
+        targets.append(('live', (nodes(current_live), current_live.rstrip('.'))))
+
+    if not targets[0][1][0]:
+        LOGGER.error('No staging nodes behind %s to load.' % future_live)
+        return False
+
+    results = dict((result.target, result) for result in load_test.load_test(targets, **options))
+    baseline = results.get('live') or load_test.last_result(results_file, domain)
+    passed, reason = load_test.evaluate(results['staging'], baseline, **thresholds)
+
+    if 'live' in results:
+        load_test.save_result(results_file, domain, 'live', results['live'])
+    load_test.save_result(results_file, domain, 'staging', results['staging'], passed, reason)
+
+    if passed:
+        LOGGER.info('Load test of %s passed: %s' % (future_live, reason))
+    else:
+        LOGGER.error('Load test of %s failed: %s' % (future_live, reason))
+
+    return passed
+
+
+def check_warm(route53_conn, domain, staging_alias, warm_up_options):
+    """
+    :description: Warm-up stage. Sample of access log is replayed against all staging nodes until their latency
+                  levels off.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+        staging_alias: blue.<domain> or green.<domain> which is going to be live
+        warm_up_options: Dictionary with access_log, sample_size, methods and warm_up.warm_up options.
+    :return: Boolean
+    """
+    options = dict(warm_up_options)
+    access_log = options.pop('access_log')
+    sample_size = options.pop('sample_size', None) or warm_up.SAMPLE_SIZE
+    methods = options.pop('methods', None) or warm_up.METHODS
+
+    record = route53_cache.get_a(route53_conn, domain, staging_alias)
+    nodes = [] if record is None else list(record.resource_records)
+    if not nodes:
+        LOGGER.error('No staging nodes behind %s to warm up.' % staging_alias)
+        return False
+
+    try:
+        mix = warm_up.read_access_log(access_log, sample_size, methods)
+    except OSError as ex:
+        LOGGER.error('Cannot read access log %s: %s' % (access_log, ex))
+        return False
+    if not mix:
+        LOGGER.error('No %s request in access log %s to replay.' % (' / '.join(methods), access_log))
+        return False
+
+    result = warm_up.warm_up(nodes, staging_alias.rstrip('.'), mix, **options)
+    if result.warm:
+        LOGGER.warning('%s is warm: %s' % (staging_alias, result.reason))
+    else:
+        LOGGER.error('Warm-up of %s failed: %s\n%s' % (staging_alias, result.reason,
+                                                       warm_up.format_latencies(result.latencies)))
+
+    return result.warm
+
+
+def parameters_path(region, domain):
+    """
+    :description: Returns path of parameters file of given region and application, so parallel deploys don't
+                  overwrite each other's file.
+    :param
+        region: AWS region
+        domain: Your Domain
+    :return: path
+    """
+    return 'parameters-%s-%s.properties' % (region, inventory.app_name(domain))
+
+
+def write_to_file(to_write, path):
+    with open(path, 'w') as f:
+        f.write(to_write)
+
+
+@metrics.instrumented('switch')
+def switch(region, access_key, secret_key, tag, domain, live_url, blue_alias, green_alias, dry_run=False,
+           check_health=True, health_options=None, drain_provider=None, drain_timeout=drain.TIMEOUT, shift_steps=None,
+           shift_wait=traffic_shift.STEP_WAIT, verify_propagation=True, propagation_timeout=None, cutover=None,
+           load_options=None, warm_up_options=None, drain_min_wait=None, adopt_untagged=True):
+    """
+    :description: Switches live alias to staging. Old color is drained and stopped when the change propagated.
     :param
         ec2_conn: Connection to AWS EC2 service
         old_tag: Dictionary with <tag_name> <tag_value> pair
         dry-run: True or False. If True, it will not make any changes.
+        check_health: True or False. If False, traffic is switched without health check.
+        health_options: Dictionary with health check settings (see health_check.probe_nodes).
+        drain_provider: drain.MetricsProvider reporting activity of old instances. Without it we wait drain_timeout.
+        drain_timeout: Upper bound (in seconds) of waiting for old instances to drain.
+        shift_steps: List of percents of traffic moved step by step with weighted records (e.g. [1, 10, 50, 100]).
+        shift_wait: Seconds of traffic between step and its health check.
+        verify_propagation: True or False. If True, we wait until change is INSYNC and nameservers answer with it.
+        propagation_timeout: Upper bound (in seconds) of waiting for propagation. By default it comes from history
+                             (propagation.TIMEOUT without enough samples).
+        cutover: cutover.Cutover moving Elastic IPs / load balancer registration instead of DNS, or None.
+        load_options: Dictionary with load test gate settings (see check_load) or None.
+        warm_up_options: Dictionary with warm-up settings (see check_warm) or None. Staging is warmed up after
+                         health check and before load test.
+        drain_min_wait: Seconds old instances are kept running even when drained. By default TTL of live alias
+                        (clients could still resolve it to old color), 0 with cutover backend.
+        adopt_untagged: True or False. If True, instances without App tag (launched before it existed) are treated
+                        as instances of this application (see inventory.adopt_untagged).
     :return: boolean status
     """
     result = True
 
     # 1. Connects to AWS
-    aws_conn = connect_to_aws(region, access_key, secret_key)
-
-    # 2. Check which is live at the moment and which should be stopped.
-    live = check_which_is_live(aws_conn.get('route53'), domain, live_url)
+    with metrics.span('connect'):
+        aws_conn = connect_to_aws(region, access_key, secret_key)
 
-    # 3. Swap DNS
-    result = swap_live_with_staging(aws_conn, domain, live, live_url, blue_alias, green_alias, dry_run)
+    if adopt_untagged:
+        inventory.adopt_untagged(aws_conn.get('ec2'), inventory.app_name(domain))
 
-    # 4. Stop and tag old one. We will do it after 5 minutes to give chance to safely close all connections.
-    time.sleep(300)
-    stop_instance(aws_conn, get_env(live, domain), domain, live_url, tag, dry_run)
+    # 2. Check which is live at the moment and which should be stopped.
+    with metrics.span('check_live'):
+        live = find_live(aws_conn, domain, live_url, cutover)
+
+        if drain_min_wait is None:
+            drain_min_wait = 0 if cutover is not None else cached_ttl(aws_conn.get('route53'), domain, live_url)
+
+    # 3. Swap DNS (or move traffic with cutover backend)
+    with metrics.span('swap'):
+        if cutover is not None:
+            if shift_steps:
+                LOGGER.warning('Progressive cutover works with DNS only. %s moves all traffic at once.' % cutover)
+            result = cut_over(aws_conn, domain, live, blue_alias, green_alias, cutover, dry_run, check_health,
+                              health_options, load_options, region, warm_up_options)
+        else:
+            future_live = green_alias if live == blue_alias else blue_alias
+            staging = get_specific_instances(aws_conn.get('ec2'), 'Environment', get_env(future_live, domain),
+                                             'running', inventory.app_name(domain))
+            result = swap_live_with_staging(aws_conn, domain, live, live_url, blue_alias, green_alias, dry_run,
+                                            check_health, health_options, shift_steps, shift_wait, load_options,
+                                            fleet_key(region, staging), warm_up_options)
+
+    # 4. Old color keeps getting traffic until nameservers know about the change.
+    if cutover is None and verify_propagation and not dry_run:
+        if propagation_timeout is None:
+            propagation_timeout = history.timeout('propagation', region, default=propagation.TIMEOUT)
+
+        with metrics.span('propagation'):
+            future_live = green_alias if live == blue_alias else blue_alias
+            propagated = wait_for_dns(aws_conn.get('route53'), domain, live_url, future_live, get_change_id(result),
+                                      propagation_timeout)
+        if propagated is not None and propagated.propagated:
+            history.record('propagation', region, None, None, propagated.seconds)
+        elif propagated is not None:
+            LOGGER.warning('%s did not propagate in %s seconds. Continuing with drain.' %
+                           (live_url, propagation_timeout))
+
+    # First cutover (no color held the traffic), so there is no old color to drain and stop.
+    if live is None:
+        LOGGER.warning('No color got traffic from %s before. Nothing to drain and stop.' % cutover)
+        return result
+
+    # 5. Stop and tag old one. We will do it when all connections are closed (after 5 minutes at most).
+    with metrics.span('drain'):
+        old_instances = get_specific_instances(aws_conn.get('ec2'), 'Environment', get_env(live, domain), 'running',
+                                               inventory.app_name(domain))
+        drain.drain(old_instances, drain_provider, drain_timeout, min_wait=drain_min_wait)
+
+    with metrics.span('stop'):
+        stop_instance(aws_conn, get_env(live, domain), domain, live_url, tag, dry_run, cutover)
 
     return result
 
 
-def roll_back(region, access_key, secret_key, tag, domain, live_alias, blue_alias, green_alias, dry_run=False):
+@metrics.instrumented('roll')
+def roll_back(region, access_key, secret_key, tag, domain, live_alias, blue_alias, green_alias, dry_run=False,
+              check_health=True, health_options=None, resume=False, cutover=None, adopt_untagged=True):
     """
-    :description: Rolls back deployment by starting instance with old-app tag and swapping dns entry.
+    :description: Rolls back deployment by starting instances with old-app tag and swapping dns entry.
     :param
         ec2_conn: Connection to AWS EC2 service
         old_tag: Dictionary with <tag_name> <tag_value> pair
         dry-run: True or False. If True, it will not make any changes.
+        check_health: True or False. If False, traffic is switched without health check.
+        health_options: Dictionary with health check settings (see health_check.probe_nodes).
+        resume: True or False. If True, steps done by previous unfinished run (see journal) are skipped.
+        cutover: cutover.Cutover moving Elastic IPs / load balancer registration instead of DNS, or None.
+        adopt_untagged: True or False. If True, instances without App tag (launched before it existed) are treated
+                        as instances of this application (see inventory.adopt_untagged).
     :return: boolean status
     """
     result = True
 
     # 1. Connects to AWS
-    aws_conn = connect_to_aws(region, access_key, secret_key)
+    with metrics.span('connect'):
+        aws_conn = connect_to_aws(region, access_key, secret_key)
+
+    app = inventory.app_name(domain)
+    if adopt_untagged:
+        inventory.adopt_untagged(aws_conn.get('ec2'), app)
 
-    # 2. Get instance ID of old instance. Check which environment is live.
-    old_instance = get_specific_instances(aws_conn.get('ec2'), ''.join(tag.keys()), ''.join(tag.values()),
-                                          ['stopped', 'running'])
-    current_live = check_which_is_live(aws_conn.get('route53'), domain, live_alias)
-    env = get_env(current_live, domain)
+    run_journal = journal.open_run('roll', region, resume, not dry_run, app=app, live_alias=live_alias)
+
+    # 2. Get old fleet. Check which environment is live.
+    with metrics.span('check_live'):
+        checked = run_journal.get('check_live')
+        old_instances = None
+
+        if checked is not None:
+            # Old fleet is already retagged (and maybe live) when we resume, so we use what we found last time.
+            old_instances = get_journaled_instances(aws_conn.get('ec2'), checked['instance_ids'],
+                                                    ['stopping', 'stopped', 'pending', 'running'])
+            current_live = checked['current_live']
+
+        if old_instances is None:
+            for step in ('check_live', 'launch', 'swap'):
+                run_journal.discard(step)
+
+            old_instances = get_specific_instances(aws_conn.get('ec2'), ''.join(tag.keys()), ''.join(tag.values()),
+                                                   ['stopped', 'running'], app)
+            current_live = find_live(aws_conn, domain, live_alias, cutover)
+
+            if old_instances:
+                run_journal.record('check_live', current_live=current_live,
+                                   instance_ids=[instance.id for instance in old_instances])
+
+        # With cutover backend nothing could be live yet, then there is no live color to stop.
+        env = get_env(current_live, domain) if current_live else None
 
     # 3. Do the Magic ;)
-    if not old_instance:
+    if not old_instances:
         LOGGER.error('No instance with tag %s was found. No chance to roll back Sir!' % ''.join(tag.values()))
     else:
+        old_ids = [instance.id for instance in old_instances]
         try:
-            if dry_run:
-                LOGGER.warning('Instance %s would be started and tagged with %s' % (old_instance, env))
+            if run_journal.get('launch') is not None:
+                LOGGER.info('Instances %s were started by previous run.' % old_ids)
             else:
-                # Start old instance
-                old_instance[0].start()
-                tag_instance(old_instance[0], 'Environment', 'blue' if env == 'green' else 'green')
-
-            # Refresh its public IP as it could change.
-            instance_public_ip = wait_for_public_ip(aws_conn.get('ec2'), old_instance[0].id)
-
-            assign_to_staging(aws_conn.get('route53'), domain, current_live, instance_public_ip, live_alias,
-                              blue_alias, green_alias, dry_run=False)
-            swap_live_with_staging(aws_conn, domain, current_live, live_alias, blue_alias, green_alias, dry_run)
-            stop_instance(aws_conn, env, domain, live_alias, tag, dry_run)
+                with metrics.span('launch'):
+                    if dry_run:
+                        LOGGER.warning('Instances %s would be started and tagged with %s' % (old_ids, env))
+                    else:
+                        # Start old fleet
+                        aws_conn.get('ec2').start_instances(instance_ids=old_ids)
+                        inventory.invalidate(aws_conn.get('ec2'))
+                        tag_instances(aws_conn.get('ec2'), old_instances, 'Environment',
+                                      'blue' if env == 'green' else 'green', app)
+                        run_journal.record('launch', instance_ids=old_ids)
+
+            # Refresh their public IPs as they could change.
+            with metrics.span('wait_for_ip'):
+                seen = {}
+                instance_public_ips = wait_for_public_ips(aws_conn.get('ec2'), old_ids, seen=seen)
+                run_journal.record('wait_for_ip', ips=instance_public_ips)
+
+            # Started (not launched) instances, so only running to Public IP is comparable with deploy.
+            if not dry_run:
+                history.record('ip', *fleet_key(region, old_instances),
+                               seconds=[seen[(old_id, 'ip')] - seen[(old_id, 'running')] for old_id in old_ids
+                                        if (old_id, 'ip') in seen])
+
+            # Staging record and live alias are changed with one atomic batch, so they never disagree.
+            route53_conn = aws_conn.get('route53')
+            staging_alias = blue_alias if current_live == green_alias else green_alias
+
+            swapped = run_journal.get('swap')
+            if swapped is not None and swapped['ips'] == instance_public_ips and \
+                    find_live(aws_conn, domain, live_alias, cutover) == staging_alias:
+                LOGGER.info('%s was switched to %s by previous run.' % (live_alias, staging_alias))
+            else:
+                with metrics.span('swap'):
+                    if dry_run:
+                        LOGGER.warning('Public IPs %s would be assigned to %s and %s would become live' %
+                                       (instance_public_ips, staging_alias, live_alias))
+                    elif check_health and not check_staging(route53_conn, domain, staging_alias, health_options,
+                                                            instance_public_ips, fleet_key(region, old_instances)):
+                        LOGGER.error('Old instances are not healthy.')
+                        sys.exit(1)
+                    else:
+                        zone = route53_cache.get_zone(route53_conn, domain)
+                        records = route53_cache.new_change_batch(route53_conn, domain)
+
+                        add_dns_change(staging_alias, instance_public_ips, None, zone, records)
+                        if cutover is None:
+                            add_dns_change(live_alias, staging_alias, staging_alias, zone, records)
+                        change = route53_cache.commit(route53_conn, domain, records)
+
+                        if cutover is not None:
+                            # Traffic goes to started old fleet right after its staging record is updated.
+                            live_instances = get_specific_instances(aws_conn.get('ec2'), 'Environment', env,
+                                                                    'running', app) if env else []
+                            if not cutover.switch(aws_conn, live_instances, old_instances):
+                                LOGGER.error('Cutover with %s failed. %s is still live.' % (cutover, current_live))
+                                sys.exit(1)
+                        run_journal.record('swap', ips=instance_public_ips, change_id=get_change_id(change))
+
+            if env is not None:
+                with metrics.span('stop'):
+                    stop_instance(aws_conn, env, domain, live_alias, tag, dry_run, cutover)
+
+            run_journal.finish()
         except exception.EC2ResponseError:
-            LOGGER.error('Could not start %s instance.' % old_instance)
+            LOGGER.error('Could not start %s instances.' % old_ids)
             result = False
 
     return result
 
 
+@metrics.instrumented('deploy')
 def deployment_stage(region, access_key, secret_key, srv_name, domain, live_url, blue_alias, green_alias, tag, image_id,
-                     ssh_key, sec_group, subnet_id, instance_size, shutdown, dry_run=False):
+                     ssh_key, sec_group, subnet_id, instance_size, shutdown, dry_run=False, count=1, warm_pool_size=0,
+                     resume=False, check_preflight=True, cutover=None, hedge_delay=placement.HEDGE_DELAY,
+                     subnet_order='given', latency_file=placement.LATENCY_FILE, adopt_untagged=True):
     """
-    :description: Delivers new instance with staging dns (blue / green).
+    :description: Delivers new fleet with staging dns (blue / green).
     :param
         region: region to which you want to deploy your instance
         access_key: AWS Access Key
@@ -576,61 +1240,210 @@ def deployment_stage(region, access_key, secret_key, srv_name, domain, live_url,
         image_id: Amazon Machine Image ID with all your software
         ssh_key: AWS key pair name
         sec_group: Security group ID that should be allocated
-        subnet_id: Subnet ID in which your instance should be created
+        subnet_id: Subnet ID in which your instance should be created or list of them (hedged launch)
         instance_size: String with instance size
         shutdown_behaviour: stop or termination
         dry-run: True or False. If True, it will not make any changes.
-    :return: string with url and ip address to staging server
+        count: Number of instances per color.
+        warm_pool_size: Number of stopped instances kept in warm pool. If not 0, new fleet is taken from the pool
+                        and the pool is refilled in the background.
+        resume: True or False. If True, steps done by previous unfinished run (see journal) are skipped.
+        check_preflight: True or False. If True, parameters are validated before anything is changed.
+        cutover: cutover.Cutover or None. With backend live color is the one which gets traffic from it.
+        hedge_delay: Seconds after which backup launch is started in the next subnet.
+        subnet_order: given or fastest (subnets with the lowest recent launch latency first).
+        latency_file: File with launch latencies of subnets.
+        adopt_untagged: True or False. If True, instances without App tag (launched before it existed) are treated
+                        as instances of this application (see inventory.adopt_untagged).
+    :return: string with url and ip addresses to staging servers
     """
+    staging_instances = None
+    launched_at = None
+    subnet_id = placement.order_subnets(placement.subnet_list(subnet_id), region, instance_size, latency_file,
+                                        subnet_order)
+
     # 1. Connects to AWS
-    aws_connections = connect_to_aws(region, access_key, secret_key)
+    with metrics.span('connect'):
+        aws_connections = connect_to_aws(region, access_key, secret_key)
+
+    # AMI, key pair, subnet, security groups and DNS are validated before old fleet is terminated.
+    if check_preflight:
+        with metrics.span('preflight'):
+            problems = preflight.run_checks(aws_connections, domain, live_url, blue_alias, green_alias, image_id,
+                                            ssh_key, sec_group, subnet_id, cutover=cutover)
+        if problems:
+            for problem in problems:
+                LOGGER.error('Pre-flight: %s' % problem)
+            sys.exit(1)
+
+    app = inventory.app_name(domain)
+    if adopt_untagged:
+        inventory.adopt_untagged(aws_connections.get('ec2'), app)
+
+    run_journal = journal.open_run('deploy', region, resume, not dry_run, app=app, image_id=image_id, count=count)
 
-    # 2. Delete old instance which should be stopped
-    deleted = delete_old_instance(aws_connections.get('ec2'), tag, dry_run)
+    # 2. Delete old fleet which should be stopped
+    if run_journal.get('delete_old') is not None:
+        deleted = True
+    else:
+        with metrics.span('delete_old'):
+            deleted = delete_old_instance(aws_connections.get('ec2'), tag, dry_run, count, app)
+        if deleted:
+            run_journal.record('delete_old')
 
     # 3. Check which environment (blue/green) is live
-    live = check_which_is_live(aws_connections.get('route53'), domain, live_url)
+    with metrics.span('check_live'):
+        live = find_live(aws_connections, domain, live_url, cutover)
     if live == blue_alias:
         env = 'green'
     else:
         env = 'blue'
 
-    # 4. If deleted then we can create new instance
+    # 4. If deleted then we can create new fleet
     if dry_run:
         # Dry Run
         create_new_instance(aws_connections.get('ec2'), image_id, ssh_key, sec_group, subnet_id, env, srv_name, None,
-                            instance_size, shutdown, dry_run)
+                            instance_size, shutdown, dry_run, count, app=app)
         assign_to_staging(aws_connections.get('route53'), domain, live, "127.0.0.1", live_url, blue_alias,
                           green_alias, dry_run)
 
         sys.exit(0)
     elif deleted:
-        staging_instance = create_new_instance(aws_connections.get('ec2'), image_id, ssh_key, sec_group, subnet_id, env,
-                                               srv_name, None, instance_size, shutdown, dry_run)
-
-    # 5. Assign right dns alias only if we managed to create instance in previous step
-    if staging_instance is None:
-        # There were some problems with creating new instance
-        LOGGER.error('Could not create new instance.')
+        launched = run_journal.get('launch')
+        if launched is not None and launched['env'] == env and launched['image_id'] == image_id:
+            # Fleet launched by previous run is reused as long as it is still there.
+            staging_instances = get_journaled_instances(aws_connections.get('ec2'), launched['instance_ids'],
+                                                        ['pending', 'running'])
+
+        if staging_instances is None:
+            # Instances from warm pool were launched long ago, only fresh launches go to history.
+            launched_at = time.time() if warm_pool_size == 0 else None
+            with metrics.span('launch'):
+                staging_instances = create_new_instance(aws_connections.get('ec2'), image_id, ssh_key, sec_group,
+                                                        subnet_id, env, srv_name, None, instance_size, shutdown,
+                                                        dry_run, count, warm_pool_size > 0, hedge_delay, latency_file,
+                                                        app)
+            if staging_instances is not None:
+                run_journal.record('launch', env=env, image_id=image_id,
+                                   instance_ids=[instance.id for instance in staging_instances])
+
+    # 5. Assign right dns alias only if we managed to create instances in previous step
+    if staging_instances is None:
+        # There were some problems with creating new instances
+        LOGGER.error('Could not create new instances.')
         sys.exit(1)
     else:
-        # Everything was all right. Waiting for Public IP
-        if staging_instance[0].ip_address is None:
-            # Unfortunately Public IP is not available straight away so we have to wait for it.
-            public_ip = wait_for_public_ip(aws_connections.get('ec2'), staging_instance[0].id)
-
-            if public_ip is None:
-                LOGGER.error('Cannot get Public IP from instance %s' % staging_instance[0].id)
-                sys.exit(1)
+        # Everything was all right. Waiting for Public IPs
+        with metrics.span('wait_for_ip'):
+            if any(instance.ip_address is None for instance in staging_instances):
+                # Unfortunately Public IP is not available straight away so we have to wait for it.
+                staging_ids = [instance.id for instance in staging_instances]
+                wait_timeout, expected = waiters.TIMEOUT, None
+                if launched_at is not None:
+                    # Polls are dense when IPs usually come and we give up at the tail of what we have seen.
+                    wait_timeout, expected = history.wait_plan(['running', 'ip'], region, instance_size, image_id,
+                                                               waiters.TIMEOUT, time.time() - launched_at)
+                seen = {}
+                public_ips = wait_for_public_ips(aws_connections.get('ec2'), staging_ids, wait_timeout, expected,
+                                                 seen)
+                if launched_at is not None:
+                    record_boot(region, instance_size, image_id, launched_at, staging_ids, seen)
+            else:
+                # Or maybe it is? :)
+                public_ips = [str(instance.ip_address) for instance in staging_instances]
+            run_journal.record('wait_for_ip', ips=public_ips)
+
+        assigned = run_journal.get('assign_dns')
+        staging_record = route53_cache.get_a(aws_connections.get('route53'), domain, env + "." + domain)
+        if assigned is not None and assigned['ips'] == public_ips and staging_record is not None and \
+                sorted(staging_record.resource_records) == sorted(public_ips):
+            LOGGER.info('%s was assigned to %s by previous run.' % (public_ips, env + "." + domain))
         else:
-            # Or maybe it is? :)
-            public_ip = staging_instance[0].ip_address
+            with metrics.span('assign_dns'):
+                change = assign_to_staging(aws_connections.get('route53'), domain, live, public_ips, live_url,
+                                           blue_alias, green_alias, dry_run)
+            run_journal.record('assign_dns', ips=public_ips, change_id=get_change_id(change))
+
+        write_to_file("staging-server = " + ','.join(public_ips), parameters_path(region, domain))
+
+        if warm_pool_size > 0:
+            warm_pool.refill_in_background(aws_connections.get('ec2'), warm_pool_size, image_id, ssh_key, sec_group,
+                                           subnet_id, srv_name, instance_size, app, region)
 
-        assign_to_staging(aws_connections.get('route53'), domain, live, public_ip, live_url, blue_alias, green_alias,
-                          dry_run)
+        run_journal.finish()
 
-        write_to_file("staging-server = " + public_ip)
+    return str(env + "." + domain + ": " + ', '.join(public_ips))
+
+
+@metrics.instrumented('refresh')
+def refresh_snapshot(region, access_key, secret_key, domain, directory=None):
+    """
+    :description: Saves instances with Environment tag and record sets of the zone for plan (see snapshot module).
+    :param
+        region: AWS region
+        access_key: AWS Access Key
+        secret_key: AWS Secret Key
+        domain: Your Domain
+        directory: Directory with snapshots (snapshot.SNAPSHOT_DIR by default)
+    :return: summary string
+    """
+    with metrics.span('connect'):
+        aws_conn = connect_to_aws(region, access_key, secret_key)
+
+    # One describe call and one list of record sets.
+    with metrics.span('refresh'):
+        zone = route53_cache.for_zone(aws_conn.get('route53'), domain)
+        zone.invalidate()
+        inventory.invalidate(aws_conn.get('ec2'))
+
+        instances = inventory.for_connection(aws_conn.get('ec2')).all()
+        records = zone.all()
+
+        path = snapshot.snapshot_path(region, domain, directory)
+        snapshot.save(path, region, domain, zone.zone.id, instances, records)
+
+    return '%s: %s instances and %s records saved to %s' % (domain, len(instances), len(records), path)
+
+
+@metrics.instrumented('reap')
+def reap(region, access_key, secret_key, tag, domain, live_alias, keep=reaper.KEEP, orphans=False, dry_run=False,
+         cutover=None, adopt_untagged=True):
+    """
+    :description: Terminates stale stopped instances (see reaper module). Newest old fleet is kept for roll back.
+    :param
+        region: AWS region
+        access_key: AWS Access Key
+        secret_key: AWS Secret Key
+        tag: Dictionary with <tag_name> <tag_value> pair of old fleet
+        domain: Your Domain
+        live_alias: Your external DNS record pointing to live web server.
+        keep: How many of the newest old instances are kept
+        orphans: True or False. If True, stopped instances of staging color are terminated too.
+        dry_run: True or False. If True, it will not make any changes.
+        cutover: cutover.Cutover or None when traffic is moved by DNS.
+        adopt_untagged: True or False. If True, instances without App tag (launched before it existed) are treated
+                        as instances of this application (see inventory.adopt_untagged).
+    :return: summary string
+    """
+    with metrics.span('connect'):
+        aws_conn = connect_to_aws(region, access_key, secret_key)
+
+    if adopt_untagged:
+        inventory.adopt_untagged(aws_conn.get('ec2'), inventory.app_name(domain))
+
+    live_env = None
+    if orphans:
+        live = find_live(aws_conn, domain, live_alias, cutover)
+        live_env = get_env(live, domain) if live else None
+
+    with metrics.span('reap'):
+        reaped = reaper.reap(aws_conn.get('ec2'), ''.join(tag.values()), keep, orphans, live_env, dry_run,
+                             inventory.app_name(domain))
+
+    if reaped.failed:
+        LOGGER.error('Could not terminate %s.' % [instance.id for instance in reaped.failed])
+        sys.exit(1)
 
-    return str(env + "." + domain + ": " + public_ip)
+    return '%s: %s' % (domain, reaper.report(reaped, dry_run))
 
 LOGGER = set_up_logging(log_path, file_name)
@@ -0,0 +1,193 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Offline benchmark of deployment_stage, switch and roll_back against local stand-in of EC2 and Route53.
+
+For every fleet size it runs deploy -> switch -> roll on fresh fake account and reports simulated wall-clock time
+(API latency, boot time and sleeps on virtual clock), time spent sleeping, API calls per service and real CPU time.
+Results are written as JSON so runs from different commits can be compared:
+
+    python benchmarks/bench_deployment.py --fleet-sizes 1 10 50 --output after.json --compare before.json
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_aws
+import fake_dns
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+REGION = 'eu-west-1'
+DOMAIN = 'example.com.'
+LIVE_ALIAS = 'www.' + DOMAIN
+BLUE_ALIAS = 'blue.' + DOMAIN
+GREEN_ALIAS = 'green.' + DOMAIN
+OLD_TAG = {'Environment': 'old-app'}
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def new_world(clock, fleet_size, options):
+    """
+    :description: Fresh fake account with blue fleet live behind www alias.
+    """
+    world = fake_aws.World(clock, options.ec2_latency, options.route53_latency, options.boot_seconds,
+                           options.ip_seconds, options.insync_seconds)
+    world.add_zone(DOMAIN)
+
+    blue = world.add_instances(REGION, fleet_size, {'Name': 'Web Server', 'Environment': 'blue', 'App': 'example.com'})
+    world.add_record(DOMAIN, BLUE_ALIAS, values=[instance.ip_address or '10.255.0.1' for instance in blue])
+    world.add_record(DOMAIN, LIVE_ALIAS, alias=BLUE_ALIAS)
+
+    return world
+
+
+def measure(world, clock, name, function, *args, **kwargs):
+    """
+    :description: Runs single entry point and returns its measurements.
+    """
+    world.calls.clear()
+    start, slept, real_start = clock.time(), clock.slept, clock.real_time()
+    status = 'ok'
+
+    try:
+        function(*args, **kwargs)
+    except SystemExit as ex:
+        status = 'ok' if not ex.code else 'exit %s' % ex.code
+
+    return {'entry': name,
+            'status': status,
+            'seconds': round(clock.time() - start, 3),
+            'sleep_seconds': round(clock.slept - slept, 3),
+            'real_seconds': round(clock.real_time() - real_start, 4),
+            'calls': dict((service, dict(counter)) for service, counter in world.calls.items()),
+            'total_calls': sum(sum(counter.values()) for counter in world.calls.values())}
+
+
+def run_scenario(aws_lib, fleet_size, options):
+    """
+    :description: deploy -> switch -> roll for one fleet size.
+    :return: list of measurements
+    """
+    clock = fake_aws.VirtualClock()
+    world = new_world(clock, fleet_size, options)
+    fake_aws.use(world)
+    credentials = (REGION, 'AKIABENCHMARK', 'secret')
+
+    # Propagation check asks local nameserver which answers from fake zone.
+    nameserver = fake_dns.start(world.resolve)
+    world.nameservers = ['127.0.0.1:%s' % nameserver.port]
+
+    clock.patch()
+    try:
+        return [
+            measure(world, clock, 'deploy', aws_lib.deployment_stage, *credentials, srv_name='Web Server',
+                    domain=DOMAIN, live_url=LIVE_ALIAS, blue_alias=BLUE_ALIAS, green_alias=GREEN_ALIAS, tag=OLD_TAG,
+                    image_id='ami-00000001', ssh_key='benchmark', sec_group=['sg-00000000'],
+                    subnet_id='subnet-00000000', instance_size='t2.micro', shutdown='stop', count=fleet_size),
+            measure(world, clock, 'switch', aws_lib.switch, *credentials, tag=OLD_TAG, domain=DOMAIN,
+                    live_url=LIVE_ALIAS, blue_alias=BLUE_ALIAS, green_alias=GREEN_ALIAS),
+            measure(world, clock, 'roll', aws_lib.roll_back, *credentials, tag=OLD_TAG, domain=DOMAIN,
+                    live_alias=LIVE_ALIAS, blue_alias=BLUE_ALIAS, green_alias=GREEN_ALIAS),
+        ]
+    finally:
+        clock.unpatch()
+        nameserver.shutdown()
+
+
+def compare(results, baseline):
+    """
+    :description: Prints difference against results from previous run.
+    """
+    previous = dict(((row['fleet_size'], row['entry']), row) for row in baseline['results'])
+
+    print('\nCompared with %s:' % (baseline.get('commit') or 'baseline'))
+    for row in results:
+        old = previous.get((row['fleet_size'], row['entry']))
+        if old is None:
+            continue
+        print('%6s %-7s seconds %9.1f -> %9.1f   calls %5s -> %5s' %
+              (row['fleet_size'], row['entry'], old['seconds'], row['seconds'], old['total_calls'],
+               row['total_calls']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of blue-green deployment.')
+    parser.add_argument('--fleet-sizes', dest='fleet_sizes', nargs='+', type=int, default=[1, 10, 50])
+    parser.add_argument('--ec2-latency', dest='ec2_latency', type=float, default=0.15, metavar='SECONDS')
+    parser.add_argument('--route53-latency', dest='route53_latency', type=float, default=0.3, metavar='SECONDS')
+    parser.add_argument('--boot-seconds', dest='boot_seconds', type=float, default=40)
+    parser.add_argument('--ip-seconds', dest='ip_seconds', type=float, default=5)
+    parser.add_argument('--insync-seconds', dest='insync_seconds', type=float, default=30)
+    parser.add_argument('--output', dest='output', default=None, metavar='results.json')
+    parser.add_argument('--compare', dest='compare', default=None, metavar='baseline.json')
+    options = parser.parse_args(argv)
+    output = options.output and os.path.abspath(options.output)
+    baseline_path = options.compare and os.path.abspath(options.compare)
+
+    fake_aws.install()
+
+    # aws_lib writes parameters files to current directory.
+    os.chdir(tempfile.mkdtemp(prefix='blue-green-bench-'))
+
+    import aws_lib
+    import health_check
+
+    # Fake instances have no web server. Staging is always healthy.
+    health_check.check_nodes = lambda nodes, **kwargs: health_check.HealthReport(True, 'benchmark', {200: 1},
+                                                                                 0.0, 0.0, 0.0, {})
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    results = []
+    for fleet_size in options.fleet_sizes:
+        for row in run_scenario(aws_lib, fleet_size, options):
+            row['fleet_size'] = fleet_size
+            results.append(row)
+            print('%6s %-7s %-6s %9.1fs (sleeping %7.1fs) %5s calls %s' %
+                  (fleet_size, row['entry'], row['status'], row['seconds'], row['sleep_seconds'],
+                   row['total_calls'], row['calls']))
+
+    report = {'commit': git_commit(), 'timestamp': int(time.time()), 'options': vars(options), 'results': results}
+
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+
+    if baseline_path:
+        with open(baseline_path) as baseline:
+            compare(results, json.load(baseline))
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,579 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Local stand-in of AWS EC2 and Route53 for benchmarks. It mimics the small part of boto API used by aws_lib,
+counts every API call per service and simulates API latency and instance boot time on a virtual clock, so whole
+deployment runs in a fraction of second without touching AWS.
+
+install() has to be called before aws_lib is imported. It registers fake boto modules in sys.modules which talk
+to the World set with use().
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import itertools
+import sys
+import threading
+import time
+import types
+
+#####################################################################
+#      Virtual clock
+#####################################################################
+
+
+class VirtualClock(object):
+    """
+    Replaces time.time and time.sleep. Sleeping and API calls move the clock forward instead of blocking.
+    """
+
+    def __init__(self, start=1000000000.0):
+        self.now = start
+        self.slept = 0.0
+        self.lock = threading.Lock()
+        self.real_time = time.time
+        self.real_sleep = time.sleep
+
+    def time(self):
+        with self.lock:
+            return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += max(0, seconds)
+            self.slept += max(0, seconds)
+
+    def advance(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+    def patch(self):
+        time.time = self.time
+        time.sleep = self.sleep
+
+    def unpatch(self):
+        time.time = self.real_time
+        time.sleep = self.real_sleep
+
+
+#####################################################################
+#      Fake boto
+#####################################################################
+
+
+class BotoServerError(Exception):
+    def __init__(self, status, reason, body=None, error_code=None):
+        Exception.__init__(self, status, reason, body)
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.error_code = error_code or reason
+
+
+class EC2ResponseError(BotoServerError):
+    pass
+
+
+class DNSServerError(BotoServerError):
+    pass
+
+
+class World(object):
+    """
+    State of fake AWS account shared by all connections: instances per region, record sets per zone, call counters.
+    """
+
+    def __init__(self, clock, ec2_latency=0.1, route53_latency=0.2, boot_seconds=40, ip_seconds=5,
+                 insync_seconds=30):
+        self.clock = clock
+        self.latency = {'ec2': ec2_latency, 'route53': route53_latency}
+        self.boot_seconds = boot_seconds
+        self.ip_seconds = ip_seconds
+        self.insync_seconds = insync_seconds
+        self.instances = collections.defaultdict(collections.OrderedDict)
+        self.zones = {}
+        self.changes = {}
+        self.calls = collections.defaultdict(collections.Counter)
+        self.ids = itertools.count(1)
+        self.lock = threading.RLock()
+        self.nameservers = ['ns-1.awsdns-00.com.', 'ns-2.awsdns-00.net.']
+        # IDs of AMIs, key pairs, subnets and security groups which don't exist (everything else does).
+        self.missing = set()
+        self.addresses = {}
+        self.load_balancers = {}
+        # Boot time of instances in slow subnets and subnets without capacity for new instances.
+        self.subnet_boot_seconds = {}
+        self.no_capacity = set()
+        # Reservations by client token (RunInstances is idempotent with it) and number of RunInstances responses which
+        # are lost after instances were launched.
+        self.client_tokens = {}
+        self.lost_run_responses = 0
+
+    def call(self, service, operation):
+        with self.lock:
+            self.calls[service][operation] += 1
+        self.clock.advance(self.latency[service])
+
+    def add_zone(self, domain, zone_id='Z0000000000000'):
+        self.zones[domain] = {'id': zone_id, 'records': []}
+
+        return zone_id
+
+    def add_record(self, domain, name, values=None, alias=None):
+        zone = self.zones[domain]
+        zone['records'].append(Record(name, 'A', 300, list(values or []), zone['id'] if alias else None, alias))
+
+    def resolve(self, name):
+        """
+        :description: What authoritative nameserver would answer for A query (aliases are followed).
+        :return: list of IPs or None if there is no such record
+        """
+        for zone in self.zones.values():
+            for record in zone['records']:
+                if record.name == name and record.type == 'A':
+                    return self.resolve(record.alias_dns_name) if record.alias_dns_name else \
+                        list(record.resource_records)
+        return None
+
+    def add_address(self, public_ip, instance_id=None):
+        allocation_id = 'eipalloc-%08x' % next(self.ids)
+        self.addresses[public_ip] = types.SimpleNamespace(public_ip=public_ip, allocation_id=allocation_id,
+                                                          instance_id=instance_id)
+
+        return allocation_id
+
+    def add_load_balancer(self, name, instance_ids=()):
+        self.load_balancers[name] = list(instance_ids)
+
+    def add_instances(self, region, count, tags, state='running', image_id='ami-00000000'):
+        instances = []
+        for _ in range(count):
+            instance = Instance(self, region, image_id, 'subnet-00000000', 't2.micro')
+            instance.tags.update(tags)
+            instance.set_state(state)
+            self.instances[region][instance.id] = instance
+            instances.append(instance)
+
+        return instances
+
+
+class Instance(object):
+    def __init__(self, world, region, image_id, subnet_id, instance_type):
+        self.world = world
+        self.connection = None
+        self.region = region
+        self.id = 'i-%08x' % next(world.ids)
+        self.image_id = image_id
+        self.subnet_id = subnet_id
+        self.instance_type = instance_type
+        self.tags = {}
+        self.launch_time = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(world.clock.time()))
+        self.placement = region + 'a'
+        self.private_ip_address = None
+        self.set_state('pending')
+
+    def set_state(self, state):
+        self._state = state
+        self.changed = self.world.clock.time()
+
+    @property
+    def boot_seconds(self):
+        return self.world.subnet_boot_seconds.get(self.subnet_id, self.world.boot_seconds)
+
+    @property
+    def state(self):
+        if self._state == 'pending' and self.world.clock.time() - self.changed >= self.boot_seconds:
+            self._state = 'running'
+        elif self._state == 'stopping':
+            self._state = 'stopped'
+        elif self._state == 'shutting-down':
+            self._state = 'terminated'
+        return self._state
+
+    @property
+    def ip_address(self):
+        for address in self.world.addresses.values():
+            if address.instance_id == self.id:
+                return address.public_ip
+        if self.state == 'running' and self.world.clock.time() - self.changed >= self.boot_seconds + \
+                self.world.ip_seconds:
+            number = int(self.id[2:], 16)
+            return '10.%d.%d.%d' % (number // 65536 % 256, number // 256 % 256, number % 256)
+        return None
+
+    def add_tag(self, key, value=''):
+        self.world.call('ec2', 'CreateTags')
+        self.tags[key] = value
+
+    def remove_tag(self, key, value=None):
+        self.world.call('ec2', 'DeleteTags')
+        self.tags.pop(key, None)
+
+    def start(self, dry_run=False):
+        self.connection.start_instances([self.id], dry_run)
+
+    def __repr__(self):
+        return 'Instance:%s' % self.id
+
+
+class Reservation(object):
+    def __init__(self, instances):
+        self.instances = instances
+
+
+class EC2Connection(object):
+    def __init__(self, world, region):
+        self.world = world
+        self.region = region
+
+    def _instances(self):
+        return self.world.instances[self.region]
+
+    def _visible(self):
+        return [instance for instance in self._instances().values() if instance.state != 'terminated']
+
+    def _check_dry_run(self, dry_run):
+        if dry_run:
+            raise EC2ResponseError(412, 'Precondition Failed', error_code='DryRunOperation')
+
+    def _get(self, instance_ids):
+        missing = [instance_id for instance_id in instance_ids if instance_id not in self._instances()]
+        if missing:
+            raise EC2ResponseError(400, 'Bad Request', error_code='InvalidInstanceID.NotFound')
+        return [self._instances()[instance_id] for instance_id in instance_ids]
+
+    def get_only_instances(self, instance_ids=None, filters=None, dry_run=False, max_results=None):
+        self.world.call('ec2', 'DescribeInstances')
+        instances = self._get(instance_ids) if instance_ids else self._visible()
+
+        for name, value in (filters or {}).items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            if name == 'instance-state-name':
+                instances = [instance for instance in instances if instance.state in values]
+            elif name == 'tag-key':
+                instances = [instance for instance in instances if any(key in instance.tags for key in values)]
+            elif name.startswith('tag:'):
+                instances = [instance for instance in instances if instance.tags.get(name[4:]) in values]
+            elif name == 'image-id':
+                instances = [instance for instance in instances if instance.image_id in values]
+
+        for instance in instances:
+            instance.connection = self
+
+        return instances
+
+    def get_all_instances(self, instance_ids=None, filters=None, dry_run=False, max_results=None):
+        return [Reservation([instance]) for instance in self.get_only_instances(instance_ids, filters)]
+
+    def run_instances(self, image_id, min_count=1, max_count=1, key_name=None, security_group_ids=None,
+                      user_data=None, instance_type='m1.small', subnet_id=None, dry_run=False, client_token=None,
+                      **kwargs):
+        self.world.call('ec2', 'RunInstances')
+        self._check_dry_run(dry_run)
+        if subnet_id in self.world.no_capacity:
+            raise EC2ResponseError(500, 'Server Error', error_code='InsufficientInstanceCapacity')
+
+        with self.world.lock:
+            if client_token and client_token in self.world.client_tokens:
+                return self.world.client_tokens[client_token]
+
+            instances = []
+            for _ in range(max_count):
+                instance = Instance(self.world, self.region, image_id, subnet_id, instance_type)
+                instance.connection = self
+                self._instances()[instance.id] = instance
+                instances.append(instance)
+
+            reservation = Reservation(instances)
+            if client_token:
+                self.world.client_tokens[client_token] = reservation
+
+            if self.world.lost_run_responses:
+                self.world.lost_run_responses -= 1
+                raise EC2ResponseError(503, 'Service Unavailable', error_code='ServiceUnavailable')
+
+        return reservation
+
+    def create_tags(self, resource_ids, tags, dry_run=False):
+        self.world.call('ec2', 'CreateTags')
+        self._check_dry_run(dry_run)
+        for instance in self._get(resource_ids):
+            instance.tags.update(tags)
+        return True
+
+    def _transition(self, operation, instance_ids, state, dry_run):
+        self.world.call('ec2', operation)
+        self._check_dry_run(dry_run)
+        instances = self._get(instance_ids)
+        for instance in instances:
+            instance.set_state(state)
+        return instances
+
+    def start_instances(self, instance_ids=None, dry_run=False):
+        return self._transition('StartInstances', instance_ids, 'pending', dry_run)
+
+    def stop_instances(self, instance_ids=None, force=False, dry_run=False):
+        return self._transition('StopInstances', instance_ids, 'stopping', dry_run)
+
+    def terminate_instances(self, instance_ids=None, dry_run=False):
+        return self._transition('TerminateInstances', instance_ids, 'shutting-down', dry_run)
+
+    def _describe(self, operation, ids, error_code):
+        self.world.call('ec2', operation)
+        if any(resource_id in self.world.missing for resource_id in ids or []):
+            raise EC2ResponseError(400, 'Bad Request', error_code=error_code)
+
+    def get_all_images(self, image_ids=None, owners=None, filters=None, dry_run=False, **kwargs):
+        self._describe('DescribeImages', image_ids, 'InvalidAMIID.NotFound')
+        return [types.SimpleNamespace(id=image_id, state='available') for image_id in (image_ids or [])]
+
+    def get_all_key_pairs(self, keynames=None, filters=None, dry_run=False):
+        self._describe('DescribeKeyPairs', keynames, 'InvalidKeyPair.NotFound')
+        return [types.SimpleNamespace(name=name) for name in (keynames or [])]
+
+    def get_all_security_groups(self, groupnames=None, group_ids=None, filters=None, dry_run=False):
+        self._describe('DescribeSecurityGroups', group_ids, 'InvalidGroup.NotFound')
+        return [types.SimpleNamespace(id=group_id, vpc_id='vpc-00000000') for group_id in (group_ids or [])]
+
+
+    def get_all_volumes(self, volume_ids=None, filters=None, dry_run=False):
+        # Every instance has one 8 GiB root volume deleted on termination.
+        self.world.call('ec2', 'DescribeVolumes')
+        instance_ids = (filters or {}).get('attachment.instance-id') or list(self.world.instances[self.region])
+        return [types.SimpleNamespace(id='vol-' + instance_id[2:], size=8,
+                                      attach_data=types.SimpleNamespace(instance_id=instance_id))
+                for instance_id in instance_ids if instance_id in self.world.instances[self.region]]
+
+    def get_all_addresses(self, addresses=None, filters=None, allocation_ids=None, dry_run=False):
+        self.world.call('ec2', 'DescribeAddresses')
+        found = [address for address in self.world.addresses.values()
+                 if (addresses and address.public_ip in addresses) or
+                 (allocation_ids and address.allocation_id in allocation_ids) or not (addresses or allocation_ids)]
+        if len(found) < len(addresses or []) + len(allocation_ids or []):
+            raise EC2ResponseError(400, 'Bad Request', error_code='InvalidAddress.NotFound')
+        return [types.SimpleNamespace(**vars(address)) for address in found]
+
+    def associate_address(self, instance_id=None, public_ip=None, allocation_id=None, allow_reassociation=False,
+                          dry_run=False, **kwargs):
+        self.world.call('ec2', 'AssociateAddress')
+        self._check_dry_run(dry_run)
+        self._get([instance_id])
+        for address in self.world.addresses.values():
+            if address.public_ip == public_ip or address.allocation_id == allocation_id:
+                if address.instance_id and not allow_reassociation:
+                    raise EC2ResponseError(400, 'Bad Request', error_code='Resource.AlreadyAssociated')
+                address.instance_id = instance_id
+                return True
+        raise EC2ResponseError(400, 'Bad Request', error_code='InvalidAddress.NotFound')
+
+
+class ELBConnection(object):
+    def __init__(self, world, region):
+        self.world = world
+        self.region = region
+
+    def _registered(self, name):
+        if name not in self.world.load_balancers:
+            raise BotoServerError(400, 'Bad Request', error_code='LoadBalancerNotFound')
+        return self.world.load_balancers[name]
+
+    def get_all_load_balancers(self, load_balancer_names=None):
+        self.world.call('ec2', 'DescribeLoadBalancers')
+        return [types.SimpleNamespace(name=name) for name in load_balancer_names or self.world.load_balancers
+                if self._registered(name) is not None]
+
+    def describe_instance_health(self, load_balancer_name, instances=None):
+        self.world.call('ec2', 'DescribeInstanceHealth')
+        # Instance is InService when it is running (load balancer health check is not simulated).
+        instances = self.world.instances[self.region]
+        return [types.SimpleNamespace(instance_id=instance_id,
+                                      state='InService' if instances[instance_id].state == 'running' else
+                                      'OutOfService')
+                for instance_id in self._registered(load_balancer_name)]
+
+    def register_instances(self, load_balancer_name, instances):
+        self.world.call('ec2', 'RegisterInstancesWithLoadBalancer')
+        registered = self._registered(load_balancer_name)
+        registered.extend(instance_id for instance_id in instances if instance_id not in registered)
+        return list(registered)
+
+    def deregister_instances(self, load_balancer_name, instances):
+        self.world.call('ec2', 'DeregisterInstancesFromLoadBalancer')
+        registered = self._registered(load_balancer_name)
+        registered[:] = [instance_id for instance_id in registered if instance_id not in instances]
+        return list(registered)
+
+
+class VPCConnection(EC2Connection):
+    def get_all_subnets(self, subnet_ids=None, filters=None, dry_run=False):
+        self._describe('DescribeSubnets', subnet_ids, 'InvalidSubnetID.NotFound')
+        return [types.SimpleNamespace(id=subnet_id, state='available', vpc_id='vpc-00000000')
+                for subnet_id in (subnet_ids or [])]
+
+
+class Record(object):
+    def __init__(self, name=None, type=None, ttl=600, resource_records=None, alias_hosted_zone_id=None,
+                 alias_dns_name=None, identifier=None, weight=None, region=None, alias_evaluate_target_health=None,
+                 health_check=None, failover=None):
+        self.name = name if name.endswith('.') else name + '.'
+        self.type = type
+        self.ttl = ttl
+        self.resource_records = resource_records if resource_records is not None else []
+        self.alias_hosted_zone_id = alias_hosted_zone_id
+        self.alias_dns_name = alias_dns_name
+        self.identifier = identifier
+        self.weight = weight
+        self.alias_evaluate_target_health = alias_evaluate_target_health
+
+    def add_value(self, value):
+        self.resource_records.append(value)
+
+    def __repr__(self):
+        return '<Record:%s:%s:%s>' % (self.name, self.type, self.alias_dns_name or self.resource_records)
+
+
+class ResourceRecordSets(list):
+    def __init__(self, connection=None, hosted_zone_id=None, comment=None):
+        list.__init__(self)
+        self.connection = connection
+        self.hosted_zone_id = hosted_zone_id
+        self.changes = []
+
+    def add_change(self, action, name, type, ttl=600, alias_hosted_zone_id=None, alias_dns_name=None,
+                   identifier=None, weight=None, region=None, alias_evaluate_target_health=None, health_check=None,
+                   failover=None):
+        change = Record(name, type, ttl, None, alias_hosted_zone_id, alias_dns_name, identifier, weight,
+                        alias_evaluate_target_health=alias_evaluate_target_health)
+        self.changes.append([action, change])
+        return change
+
+    def commit(self):
+        return self.connection.change_rrsets(self.hosted_zone_id, self.changes)
+
+
+class Zone(object):
+    def __init__(self, route53connection, zone_id, name):
+        self.route53connection = route53connection
+        self.id = zone_id
+        self.name = name
+
+    def get_a(self, name, all=False):
+        records = [record for record in self.route53connection.get_all_rrsets(self.id)
+                   if record.name == (name if name.endswith('.') else name + '.') and record.type == 'A']
+        if all:
+            return records
+        return records[0] if records else None
+
+
+class Route53Connection(object):
+    def __init__(self, world, **kwargs):
+        self.world = world
+
+    def _zone(self, zone_id):
+        for domain, zone in self.world.zones.items():
+            if zone['id'] == zone_id:
+                return domain, zone
+        raise DNSServerError(404, 'Not Found', error_code='NoSuchHostedZone')
+
+    def get_zone(self, name):
+        self.world.call('route53', 'ListHostedZones')
+        if name not in self.world.zones:
+            return None
+        return Zone(self, self.world.zones[name]['id'], name)
+
+    def get_all_rrsets(self, hosted_zone_id, type=None, name=None, identifier=None, maxitems=None):
+        self.world.call('route53', 'ListResourceRecordSets')
+        domain, zone = self._zone(hosted_zone_id)
+        return [Record(domain, 'NS', 172800, list(self.world.nameservers))] + list(zone['records'])
+
+    def change_rrsets(self, hosted_zone_id, changes):
+        self.world.call('route53', 'ChangeResourceRecordSets')
+        records = self._zone(hosted_zone_id)[1]['records']
+        updated = list(records)
+
+        for action, change in changes:
+            same = [record for record in updated if (record.name, record.type, record.identifier) ==
+                    (change.name, change.type, change.identifier)]
+            if action == 'DELETE' and not same:
+                raise DNSServerError(400, 'Bad Request', error_code='InvalidChangeBatch')
+            if action == 'CREATE' and same:
+                raise DNSServerError(400, 'Bad Request', error_code='InvalidChangeBatch')
+            for record in same:
+                updated.remove(record)
+            if action != 'DELETE':
+                updated.append(change)
+
+        # Change batch is atomic.
+        records[:] = updated
+
+        change_id = '/change/C%08d' % next(self.world.ids)
+        self.world.changes[change_id] = self.world.clock.time()
+        return {'ChangeResourceRecordSetsResponse': {'ChangeInfo': {'Id': change_id, 'Status': 'PENDING'}}}
+
+    def get_change(self, change_id):
+        self.world.call('route53', 'GetChange')
+        if not change_id.startswith('/change/'):
+            change_id = '/change/' + change_id
+        in_sync = self.world.clock.time() - self.world.changes[change_id] >= self.world.insync_seconds
+        return {'GetChangeResponse': {'ChangeInfo': {'Id': change_id,
+                                                     'Status': 'INSYNC' if in_sync else 'PENDING'}}}
+
+
+_WORLD = [None]
+
+
+def use(world):
+    """
+    :description: Sets world which is used by all connections created from now on.
+    :param
+        world: World
+    :return: None
+    """
+    _WORLD[0] = world
+
+
+def install():
+    """
+    :description: Registers fake boto modules. Call it before aws_lib is imported.
+    :return: None
+    """
+    boto = types.ModuleType('boto')
+    exception = types.ModuleType('boto.exception')
+    ec2 = types.ModuleType('boto.ec2')
+    vpc = types.ModuleType('boto.vpc')
+    elb = types.ModuleType('boto.ec2.elb')
+    route53 = types.ModuleType('boto.route53')
+    record = types.ModuleType('boto.route53.record')
+
+    exception.BotoServerError = BotoServerError
+    exception.EC2ResponseError = EC2ResponseError
+    exception.DNSServerError = DNSServerError
+
+    ec2.connect_to_region = lambda region_name, **kwargs: EC2Connection(_WORLD[0], region_name)
+    ec2.EC2Connection = EC2Connection
+
+    vpc.connect_to_region = lambda region_name, **kwargs: VPCConnection(_WORLD[0], region_name)
+    vpc.VPCConnection = VPCConnection
+
+    elb.connect_to_region = lambda region_name, **kwargs: ELBConnection(_WORLD[0], region_name)
+    elb.ELBConnection = ELBConnection
+    ec2.elb = elb
+
+    record.ResourceRecordSets = ResourceRecordSets
+    record.Record = Record
+    route53.record = record
+    route53.Route53Connection = lambda **kwargs: Route53Connection(_WORLD[0], **kwargs)
+
+    boto.exception = exception
+    boto.ec2 = ec2
+    boto.vpc = vpc
+    boto.route53 = route53
+
+    sys.modules.update({'boto': boto, 'boto.exception': exception, 'boto.ec2': ec2, 'boto.ec2.elb': elb,
+                        'boto.vpc': vpc, 'boto.route53': route53, 'boto.route53.record': record})
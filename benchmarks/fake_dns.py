@@ -0,0 +1,99 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Local stand-in of authoritative nameserver. Answers A queries over UDP with whatever resolver function returns, so
+propagation checks can run without Route53:
+
+    server = fake_dns.start(lambda name: ['10.0.0.1'])
+    propagation.check_nameservers(['127.0.0.1:%s' % server.port], 'www.example.com.', ['10.0.0.1'])
+    server.shutdown()
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import socket
+import socketserver
+import struct
+import threading
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+TYPE_A = 1
+CLASS_IN = 1
+TTL = 60
+
+#####################################################################
+#      Classes and functions
+#####################################################################
+
+
+def build_response(query, resolve):
+    """
+    :description: Builds authoritative answer to A query.
+    :param
+        query: DNS query message
+        resolve: Function which gets name and returns list of IPs (or None for NXDOMAIN)
+    :return: bytes
+    """
+    query_id = struct.unpack('>H', query[:2])[0]
+
+    # Question is copied as it is. Only single question (what propagation module sends) is supported.
+    labels, offset = [], 12
+    while query[offset]:
+        labels.append(query[offset + 1:offset + 1 + query[offset]].decode('ascii'))
+        offset += 1 + query[offset]
+    question = query[12:offset + 5]
+    record_type = struct.unpack('>H', query[offset + 1:offset + 3])[0]
+
+    ips = resolve('.'.join(labels).lower() + '.')
+    answers = ips if ips is not None and record_type == TYPE_A else []
+    flags = 0x8400 | (3 if ips is None else 0)  # response, authoritative, NXDOMAIN when unknown
+
+    message = struct.pack('>HHHHHH', query_id, flags, 1, len(answers), 0, 0) + question
+    for ip in answers:
+        # Name is a pointer to the question.
+        message += struct.pack('>HHHIH', 0xC00C, TYPE_A, CLASS_IN, TTL, 4) + socket.inet_aton(ip)
+
+    return message
+
+
+class DnsServer(socketserver.ThreadingUDPServer):
+    daemon_threads = True
+
+    def __init__(self, resolve, address='127.0.0.1', port=0):
+        socketserver.ThreadingUDPServer.__init__(self, (address, port), DnsHandler)
+        self.resolve = resolve
+        self.port = self.server_address[1]
+        self.queries = 0
+
+
+class DnsHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        self.server.queries += 1
+        sock.sendto(build_response(data, self.server.resolve), self.client_address)
+
+
+def start(resolve, address='127.0.0.1', port=0):
+    """
+    :description: Starts nameserver in background thread.
+    :param
+        resolve: Function which gets name and returns list of IPs (or None for NXDOMAIN)
+        address: Listen address
+        port: UDP port (random free port by default)
+    :return: DnsServer (call shutdown() to stop it)
+    """
+    server = DnsServer(resolve, address, port)
+
+    thread = threading.Thread(target=server.serve_forever, name='fake-dns')
+    thread.daemon = True
+    thread.start()
+
+    return server
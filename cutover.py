@@ -0,0 +1,260 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Cutover backends. By default traffic is moved by Route53 alias swap (see aws_lib.swap_live_with_staging), which is
+applied only when clients' DNS caches expire. Backends here move the traffic in AWS itself, so switch and roll back
+are almost instant:
+
+    ElasticIpCutover      Elastic IP(s) are reassociated from old color's instances to new ones.
+    LoadBalancerCutover   New color is registered to classic ELB, old one is deregistered once new one is InService.
+
+With backend, live color is the one which gets the traffic (holds Elastic IPs / is InService), not the one live
+alias points to. Before the first cutover no color gets the traffic, so switch has no old color to drain and stop.
+
+Staging records (blue.<domain> / green.<domain>) keep public IPs instances got at launch. With Elastic IP cutover
+they are outdated as soon as the address is reassociated (instance gets the Elastic IP as its public IP), so live
+traffic should be checked through the Elastic IPs, not through staging records.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import logging
+import time
+
+# Local modules
+import inventory
+import lazy
+import waiters
+
+# AWS Boto library (imported on first use)
+exception = lazy.load('boto.exception')
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+KINDS = ('dns', 'eip', 'elb')
+
+# How long (in seconds) we wait for new instances to be InService behind load balancer.
+REGISTER_TIMEOUT = 300
+BASE_DELAY = 2
+MAX_DELAY = 15
+
+#####################################################################
+#      Classes and functions
+#####################################################################
+
+
+def env_of(ec2_conn, instance_ids):
+    """
+    :description: Returns Environment tag value which most of given instances have.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        instance_ids: IDs of instances
+    :return: blue, green or None
+    """
+    envs = collections.Counter(instance.tags.get(inventory.TAG_KEY)
+                               for instance in inventory.for_connection(ec2_conn).all()
+                               if instance.id in instance_ids and instance.tags.get(inventory.TAG_KEY) in
+                               ('blue', 'green'))
+
+    return envs.most_common(1)[0][0] if envs else None
+
+
+class Cutover(object):
+    """
+    Moves traffic between colors without DNS change. Subclass it and implement all methods.
+    """
+
+    def live_env(self, aws_connection):
+        """
+        :description: Returns color which gets the traffic now.
+        :param
+            aws_connection: Map of AWS connections
+        :return: blue, green or None
+        """
+        raise NotImplementedError()
+
+    def check(self, aws_connection):
+        """
+        :description: Pre-flight check of backend settings.
+        :param
+            aws_connection: Map of AWS connections
+        :return: list of problems
+        """
+        raise NotImplementedError()
+
+    def switch(self, aws_connection, old_instances, new_instances):
+        """
+        :description: Moves traffic from old instances to new ones.
+        :param
+            aws_connection: Map of AWS connections
+            old_instances: list of instances which get traffic now
+            new_instances: list of instances which should get it
+        :return: boolean status
+        """
+        raise NotImplementedError()
+
+
+class ElasticIpCutover(Cutover):
+    """
+    Elastic IPs (public IPs or allocation IDs) are associated with instances of live color, one address per instance.
+    Live alias should be A record with these addresses.
+    """
+
+    def __init__(self, addresses):
+        self.addresses = list(addresses)
+
+    def __str__(self):
+        return 'Elastic IP %s' % ', '.join(self.addresses)
+
+    def _describe(self, ec2_conn):
+        allocation_ids = [address for address in self.addresses if address.startswith('eipalloc-')]
+        public_ips = [address for address in self.addresses if not address.startswith('eipalloc-')]
+
+        found = []
+        if allocation_ids:
+            found += ec2_conn.get_all_addresses(allocation_ids=allocation_ids)
+        if public_ips:
+            found += ec2_conn.get_all_addresses(addresses=public_ips)
+
+        return found
+
+    def live_env(self, aws_connection):
+        ec2_conn = aws_connection.get('ec2')
+
+        return env_of(ec2_conn, [address.instance_id for address in self._describe(ec2_conn) if address.instance_id])
+
+    def check(self, aws_connection):
+        try:
+            found = self._describe(aws_connection.get('ec2'))
+        except exception.BotoServerError as ex:
+            return ['%s: %s' % (self, getattr(ex, 'error_code', None) or ex)]
+
+        if len(found) != len(self.addresses):
+            return ['Only %s of %s Elastic IPs exist.' % (len(found), len(self.addresses))]
+
+        return []
+
+    def switch(self, aws_connection, old_instances, new_instances):
+        ec2_conn = aws_connection.get('ec2')
+
+        if not new_instances or len(new_instances) < len(self.addresses):
+            LOGGER.error('%s Elastic IPs but only %s new instances.' % (len(self.addresses), len(new_instances)))
+            return False
+
+        # Reassociation is atomic per address, old instance loses it at the same moment.
+        for address, instance in zip(sorted(self._describe(ec2_conn), key=lambda found: found.public_ip),
+                                     sorted(new_instances, key=lambda new_instance: new_instance.id)):
+            if address.allocation_id:
+                ec2_conn.associate_address(instance_id=instance.id, allocation_id=address.allocation_id,
+                                           allow_reassociation=True)
+            else:
+                ec2_conn.associate_address(instance_id=instance.id, public_ip=address.public_ip,
+                                           allow_reassociation=True)
+            LOGGER.info('%s moved from %s to %s.' % (address.public_ip, address.instance_id, instance.id))
+
+        # Public IPs of instances changed.
+        inventory.invalidate(ec2_conn)
+
+        return True
+
+
+class LoadBalancerCutover(Cutover):
+    """
+    Instances of live color are registered to classic ELB. Live alias should be alias of the load balancer.
+    """
+
+    def __init__(self, name, timeout=REGISTER_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+
+    def __str__(self):
+        return 'load balancer %s' % self.name
+
+    def in_service(self, elb_conn):
+        return [state.instance_id for state in elb_conn.describe_instance_health(self.name)
+                if state.state == 'InService']
+
+    def live_env(self, aws_connection):
+        return env_of(aws_connection.get('ec2'), self.in_service(aws_connection.get('elb')))
+
+    def check(self, aws_connection):
+        try:
+            aws_connection.get('elb').get_all_load_balancers(load_balancer_names=[self.name])
+        except exception.BotoServerError as ex:
+            return ['%s: %s' % (self, getattr(ex, 'error_code', None) or ex)]
+
+        return []
+
+    def wait_in_service(self, elb_conn, instance_ids, sleep=None):
+        """
+        :description: Waits with backoff until all instances are InService.
+        :return: True or False when timeout was reached
+        """
+        sleep = sleep or time.sleep
+        deadline = time.time() + self.timeout
+        attempt = 0
+
+        while not set(instance_ids) <= set(self.in_service(elb_conn)):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            sleep(min(remaining, waiters.backoff_delay(attempt, BASE_DELAY, MAX_DELAY)))
+            attempt += 1
+
+        return True
+
+    def switch(self, aws_connection, old_instances, new_instances):
+        elb_conn = aws_connection.get('elb')
+        new_ids = [instance.id for instance in new_instances]
+        old_ids = [instance.id for instance in old_instances if instance.id not in new_ids]
+
+        if not new_ids:
+            LOGGER.error('No new instance to register with %s.' % self.name)
+            return False
+
+        elb_conn.register_instances(self.name, new_ids)
+
+        # Old color keeps the traffic until new one passes health check of load balancer.
+        if not self.wait_in_service(elb_conn, new_ids):
+            LOGGER.error('%s are not InService behind %s after %s seconds.' % (new_ids, self.name, self.timeout))
+            elb_conn.deregister_instances(self.name, new_ids)
+            return False
+
+        if old_ids:
+            elb_conn.deregister_instances(self.name, old_ids)
+
+        return True
+
+
+def from_options(kind, elastic_ips=None, load_balancer=None):
+    """
+    :description: Builds cutover backend from command line options.
+    :param
+        kind: dns, eip or elb
+        elastic_ips: List of Elastic IPs (or allocation IDs) for eip
+        load_balancer: Name of classic ELB for elb
+    :return: Cutover or None for dns
+    """
+    if kind in (None, 'dns'):
+        return None
+    elif kind == 'eip':
+        if not elastic_ips:
+            raise ValueError('eip cutover needs at least one Elastic IP.')
+        return ElasticIpCutover(elastic_ips)
+    elif kind == 'elb':
+        if not load_balancer:
+            raise ValueError('elb cutover needs load balancer name.')
+        return LoadBalancerCutover(load_balancer)
+
+    raise ValueError('Unknown cutover %s, use one of %s.' % (kind, ', '.join(KINDS)))
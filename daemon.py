@@ -0,0 +1,481 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Long-running deployment daemon. boto is imported and logging is set up once, AWS connections are kept in a pool per
+(region, credentials) and deploy / switch / roll jobs come over local HTTP API (Unix socket or TCP) to a job queue
+with global and per-region concurrency limits.
+
+Start it with:
+
+    python daemon.py --listen /var/run/blue-green.sock --workers 4 --per-region 1
+
+and point deployment.py at it with --daemon /var/run/blue-green.sock.
+
+API has no authentication and jobs carry AWS access and secret keys in plain JSON. Unix socket is usable by its
+owner only; TCP (host:port) is accepted on loopback address only, e.g. --listen 127.0.0.1:8400.
+
+API:
+    POST /jobs              body {"action": ..., "region": ..., "args": [...], "kwargs": {...}} -> job
+    POST /jobs?wait=1       same, but answers when the job is finished
+    GET  /jobs/<id>         job
+    GET  /health            {"status": "ok", "queued": N, "running": N, "throttling": {...}}
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import argparse
+import collections
+import hashlib
+import http.client
+import http.server
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+WORKERS = 4
+PER_REGION = 1
+KEEP_FINISHED = 1000    # finished jobs kept for GET /jobs/<id>
+
+ACTIONS = ('deploy', 'switch', 'roll', 'refresh', 'reap')
+
+#####################################################################
+#      Connection pool
+#####################################################################
+
+
+class JobConnection(object):
+    """
+    Pooled connection as one job sees it. Inventory and record set caches are kept per connection object, so every
+    job gets caches of its own (nobody drops them under a running job) while boto connection is shared.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class ConnectionPool(object):
+    """
+    AWS connections kept between runs, one set per (region, access key, secret key).
+    """
+
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def get(self, region, access_key, secret_key, connect):
+        """
+        :description: Returns pooled connections or opens new ones. Every call gets its own JobConnection handles,
+                      so every run sees fresh inventory and record sets.
+        :param
+            region: AWS region
+            access_key: AWS Access Key
+            secret_key: AWS Secret Key
+            connect: Function opening new connections (region, access_key, secret_key) -> map of connections
+        :return: map of aws services and connection handles for them.
+        """
+        key = (region, access_key, hashlib.sha256(secret_key.encode('utf-8')).hexdigest())
+
+        with self.lock:
+            if key not in self.connections:
+                LOGGER.info('Opening new AWS connections for %s' % region)
+                self.connections[key] = connect(region, access_key, secret_key)
+            connections = self.connections[key]
+
+        return dict((service, JobConnection(connection)) for service, connection in connections.items())
+
+
+#####################################################################
+#      Jobs
+#####################################################################
+
+
+class Job(object):
+    def __init__(self, job_id, action, region, args, kwargs):
+        self.id = job_id
+        self.action = action
+        self.region = region
+        self.args = args
+        self.kwargs = kwargs
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {'id': self.id, 'action': self.action, 'region': self.region, 'status': self.status,
+                'result': self.result, 'error': self.error, 'submitted': self.submitted, 'finished': self.finished}
+
+
+class JobQueue(object):
+    """
+    Queue of jobs processed by fixed number of workers. At most per_region jobs run in one region at the same time.
+    Jobs wait in per-region queues and worker takes the oldest job of a region with free slot, so burst of jobs in
+    one region never holds workers needed by other regions.
+    """
+
+    def __init__(self, workers=WORKERS, per_region=PER_REGION, prometheus_file=None):
+        self.pending = collections.OrderedDict()
+        self.jobs = collections.OrderedDict()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.per_region = per_region
+        self.region_running = collections.Counter()
+        self.prometheus_file = prometheus_file
+        self.running = 0
+
+        for number in range(workers):
+            worker = threading.Thread(target=self.work, name='worker-%s' % number)
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, action, region, args, kwargs):
+        with self.lock:
+            job = Job(str(next(self.ids)), action, region, args, kwargs)
+            self.jobs[job.id] = job
+
+            # Forget the oldest finished jobs.
+            while len(self.jobs) > KEEP_FINISHED:
+                oldest = next(iter(self.jobs.values()))
+                if not oldest.done.is_set():
+                    break
+                del self.jobs[oldest.id]
+
+            self.pending.setdefault(region, collections.deque()).append(job)
+            self.ready.notify()
+
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def queued(self):
+        with self.lock:
+            return sum(len(jobs) for jobs in self.pending.values())
+
+    def stats(self):
+        import throttle
+        return {'status': 'ok', 'queued': self.queued(), 'running': self.running, 'throttling': throttle.stats()}
+
+    def take(self):
+        """
+        :description: Waits for the oldest queued job whose region has free slot and marks it running.
+        :return: Job
+        """
+        with self.lock:
+            while True:
+                heads = [jobs[0] for region, jobs in self.pending.items()
+                         if self.region_running[region] < self.per_region]
+                if heads:
+                    job = min(heads, key=lambda head: head.submitted)
+                    self.pending[job.region].popleft()
+                    if not self.pending[job.region]:
+                        del self.pending[job.region]
+
+                    self.region_running[job.region] += 1
+                    self.running += 1
+                    job.status = 'running'
+                    return job
+
+                self.ready.wait()
+
+    def release(self, job):
+        """
+        :description: Frees region slot of finished job.
+        :param
+            job: Job returned by take
+        :return: None
+        """
+        with self.lock:
+            self.region_running[job.region] -= 1
+            self.running -= 1
+            # Queued job of this region could run now, any worker may take it.
+            self.ready.notify_all()
+
+    def work(self):
+        import aws_lib
+        import manifest
+        import metrics
+
+        functions = dict((action, getattr(aws_lib, name)) for action, name in manifest.FUNCTIONS.items())
+
+        while True:
+            job = self.take()
+
+            try:
+                job.result = str(functions[job.action](job.region, *job.args, **manifest.build_kwargs(job.kwargs)))
+                job.status = 'ok'
+            except SystemExit as ex:
+                # aws_lib still exits on errors (and on successful dry run).
+                job.status = 'ok' if not ex.code else 'failed'
+                job.error = None if not ex.code else 'exit code %s' % ex.code
+            except Exception as ex:
+                LOGGER.exception('Job %s failed.' % job.id)
+                job.status = 'failed'
+                job.error = str(ex)
+            finally:
+                job.finished = time.time()
+                self.release(job)
+                job.done.set()
+
+            if self.prometheus_file:
+                metrics.write_prometheus(self.prometheus_file)
+
+
+#####################################################################
+#      HTTP API
+#####################################################################
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+    def respond(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+
+        if path == '/health':
+            self.respond(200, self.server.jobs.stats())
+        elif path.startswith('/jobs/'):
+            job = self.server.jobs.get(path[len('/jobs/'):])
+            if job is None:
+                self.respond(404, {'error': 'no such job'})
+            else:
+                self.respond(200, job.to_dict())
+        else:
+            self.respond(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+
+        if url.path != '/jobs':
+            return self.respond(404, {'error': 'not found'})
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            action, region = body['action'], body['region']
+            if action not in ACTIONS:
+                raise ValueError('action has to be one of %s' % (ACTIONS,))
+        except (ValueError, KeyError, TypeError) as ex:
+            return self.respond(400, {'error': 'bad job: %s' % ex})
+
+        job = self.server.jobs.submit(action, region, body.get('args', []), body.get('kwargs', {}))
+
+        if urllib.parse.parse_qs(url.query).get('wait'):
+            job.done.wait()
+            return self.respond(200, job.to_dict())
+
+        self.respond(202, job.to_dict())
+
+
+class TCPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class TCPServer6(TCPServer):
+    address_family = socket.AF_INET6
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        os.chmod(self.server_address, 0o600)
+
+
+def is_unix_socket(address):
+    return '/' in address or ':' not in address
+
+
+def is_loopback(host):
+    """
+    :description: Checks if TCP host is loopback address (localhost, 127.0.0.0/8 or ::1).
+    :param
+        host: Host part of host:port
+    :return: boolean result
+    """
+    if host == 'localhost':
+        return True
+
+    try:
+        return ipaddress.ip_address(host.strip('[]')).is_loopback
+    except ValueError:
+        return False
+
+
+def make_server(address, jobs):
+    """
+    :description: Creates HTTP server listening on Unix socket (path) or TCP (host:port, loopback only).
+    :param
+        address: Path of Unix socket or host:port
+        jobs: JobQueue
+    :return: server (raises ValueError for TCP address which is not loopback)
+    """
+    if is_unix_socket(address):
+        server = UnixServer(address, Handler)
+    else:
+        host, port = address.rsplit(':', 1)
+        if not is_loopback(host):
+            raise ValueError('%s is not loopback address. API has no authentication and gets AWS keys, listen on '
+                             'Unix socket or 127.0.0.1.' % host)
+        host = host.strip('[]')
+        server_class = TCPServer6 if ':' in host else TCPServer
+        server = server_class((host, int(port)), Handler)
+
+    server.jobs = jobs
+
+    return server
+
+
+#####################################################################
+#      Client
+#####################################################################
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def request(address, method, path, body=None):
+    """
+    :description: Sends request to the daemon.
+    :param
+        address: Path of Unix socket or host:port
+        method: GET or POST
+        path: Request path
+        body: Dictionary sent as JSON
+    :return: tuple with status code and decoded JSON
+    """
+    if is_unix_socket(address):
+        connection = UnixHTTPConnection(address)
+    else:
+        connection = http.client.HTTPConnection(address)
+
+    try:
+        payload = None if body is None else json.dumps(body)
+        connection.request(method, path, payload, {'Content-Type': 'application/json'})
+        respond = connection.getresponse()
+        return respond.status, json.loads(respond.read().decode('utf-8'))
+    finally:
+        connection.close()
+
+
+def submit(address, action, region, args, kwargs, wait=False):
+    """
+    :description: Submits job to the daemon.
+    :param
+        address: Path of Unix socket or host:port
+        action: deploy, switch, roll, refresh or reap
+        region: AWS region
+        args: Positional arguments of aws_lib function (after region)
+        kwargs: Keyword arguments of aws_lib function
+        wait: True or False. If True, answer comes when job is finished.
+    :return: job dictionary
+    """
+    status, job = request(address, 'POST', '/jobs?wait=1' if wait else '/jobs',
+                          {'action': action, 'region': region, 'args': list(args), 'kwargs': kwargs})
+    if status >= 400:
+        raise RuntimeError(job.get('error'))
+
+    return job
+
+
+def wait(address, job_id, interval=2):
+    """
+    :description: Waits until job is finished.
+    :param
+        address: Path of Unix socket or host:port
+        job_id: Job ID returned by submit
+        interval: Seconds between polls
+    :return: job dictionary
+    """
+    while True:
+        status, job = request(address, 'GET', '/jobs/%s' % job_id)
+        if status >= 400:
+            raise RuntimeError(job.get('error'))
+        if job['status'] in ('ok', 'failed'):
+            return job
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AWS Blue-Green deployment daemon.')
+    parser.add_argument('--listen', dest='listen', default='/var/run/blue-green-deploy.sock',
+                        metavar='[/path/to/socket | host:port]')
+    parser.add_argument('--workers', dest='workers', default=WORKERS, type=int)
+    parser.add_argument('--per-region', dest='per_region', default=PER_REGION, type=int)
+    parser.add_argument('--prometheus-file', dest='prometheus_file', default=None, metavar='blue_green.prom')
+    parser.add_argument('--journal-dir', dest='journal_dir', default=None, metavar='DIR')
+    parser.add_argument('--history-file', dest='history_file', default=None, metavar='history.sqlite3')
+    options = parser.parse_args(argv)
+
+    # Everything heavy is done once, not for every job.
+    import aws_lib
+    import history
+    import journal
+    aws_lib.CONNECTION_POOL = ConnectionPool()
+    journal.JOURNAL_DIR = options.journal_dir or journal.JOURNAL_DIR
+    history.HISTORY_FILE = options.history_file or history.HISTORY_FILE
+
+    try:
+        server = make_server(options.listen, JobQueue(options.workers, options.per_region, options.prometheus_file))
+    except ValueError as ex:
+        parser.error(str(ex))
+    LOGGER.warning('Listening on %s' % options.listen)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
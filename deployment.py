@@ -4,43 +4,186 @@ __author__ = 'root'
 
 import argparse
 import sys
-import aws_lib
+import cutover
+import drain
+import history
+import journal
+import load_test
+import manifest
+import metrics
+import orchestrator
+import placement
+import snapshot
+import warm_up
 
 parser = argparse.ArgumentParser(description='AWS Blue-Green deployment script.')
 
 parser.add_argument('--dry-run', dest='dry_run', action='store_true')
-parser.add_argument('--region', dest='region', type=str, required=True)
-parser.add_argument('--access-key', dest='aws_access_key', required=True)
-parser.add_argument('--secret-key', dest='aws_secret_key', required=True)
+parser.add_argument('--region', dest='region', type=str, nargs='+', default=[], metavar='REGION')
+parser.add_argument('--regions-file', dest='regions_file', default=None, metavar='regions.txt')
+parser.add_argument('--max-parallel', dest='max_parallel', default=orchestrator.MAX_WORKERS, type=int, metavar='N')
+parser.add_argument('--fail-fast', dest='fail_fast', action='store_true')
+parser.add_argument('--manifest', dest='manifest', default=None, metavar='apps.json')
+parser.add_argument('--per-region', dest='per_region', default=None, type=int, metavar='N')
+parser.add_argument('--access-key', dest='aws_access_key', default=None)
+parser.add_argument('--secret-key', dest='aws_secret_key', default=None)
 parser.add_argument('--type', dest='instance_size', default='t2.micro')
-parser.add_argument('--key', dest='ssh_key', required=True)
-parser.add_argument('--image', dest='image_id', required=True)
-parser.add_argument('--live-alias', dest='live_alias', required=True, metavar='live.example.com.')
-parser.add_argument('--domain', dest='domain', required=True, metavar='example.com.')
+parser.add_argument('--key', dest='ssh_key', default=None)
+parser.add_argument('--image', dest='image_id', default=None)
+parser.add_argument('--live-alias', dest='live_alias', default=None, metavar='live.example.com.')
+parser.add_argument('--domain', dest='domain', default=None, metavar='example.com.')
 parser.add_argument('--server-name', dest='web_srv_name', default='Web Server', type=str)
-parser.add_argument('--subnet', dest='subnet_id', required=True, metavar='subnet-XXX')
-parser.add_argument('--sec-group', dest='sec_group', nargs='+', required=True, metavar='sg-XXX')
-parser.add_argument('--action', dest='action', required=True, metavar='[deploy | switch | roll]')
+parser.add_argument('--subnet', dest='subnet_id', nargs='+', default=None, metavar='subnet-XXX')
+parser.add_argument('--hedge-delay', dest='hedge_delay', default=placement.HEDGE_DELAY, type=int, metavar='SECONDS')
+parser.add_argument('--subnet-order', dest='subnet_order', default='given', choices=placement.ORDERS)
+parser.add_argument('--launch-latency-file', dest='latency_file', default=placement.LATENCY_FILE,
+                    metavar='launch-latency.jsonl')
+parser.add_argument('--count', dest='count', default=1, type=int, metavar='N')
+parser.add_argument('--warm-pool', dest='warm_pool', default=0, type=int, metavar='N')
+parser.add_argument('--sec-group', dest='sec_group', nargs='+', default=None, metavar='sg-XXX')
+parser.add_argument('--no-health-check', dest='check_health', action='store_false')
+parser.add_argument('--health-port', dest='health_port', default=80, type=int)
+parser.add_argument('--health-path', dest='health_path', default='/', metavar='/health')
+parser.add_argument('--health-window', dest='health_window', default=5, type=int, metavar='N')
+parser.add_argument('--health-max-p99', dest='health_max_p99', default=None, type=float, metavar='SECONDS')
+parser.add_argument('--health-max-error-rate', dest='health_max_error_rate', default=None, type=float,
+                    metavar='FRACTION')
+parser.add_argument('--load-test', dest='load_test', action='store_true')
+parser.add_argument('--load-mix', dest='load_mix', nargs='+', default=None, metavar='METHOD:PATH:WEIGHT')
+parser.add_argument('--load-rps', dest='load_rps', default=load_test.RPS, type=float, metavar='N')
+parser.add_argument('--load-duration', dest='load_duration', default=load_test.DURATION, type=int, metavar='SECONDS')
+parser.add_argument('--load-concurrency', dest='load_concurrency', default=load_test.CONCURRENCY, type=int,
+                    metavar='N')
+parser.add_argument('--load-compare-live', dest='load_compare_live', action='store_true')
+parser.add_argument('--load-results', dest='load_results', default=load_test.RESULTS_FILE, metavar='load-tests.jsonl')
+parser.add_argument('--load-max-rps-drop', dest='load_max_rps_drop', default=load_test.MAX_RPS_DROP, type=float,
+                    metavar='FRACTION')
+parser.add_argument('--load-max-p99-increase', dest='load_max_p99_increase', default=load_test.MAX_P99_INCREASE,
+                    type=float, metavar='FRACTION')
+parser.add_argument('--load-max-error-rate', dest='load_max_error_rate', default=load_test.MAX_ERROR_RATE,
+                    type=float, metavar='FRACTION')
+parser.add_argument('--warm-up-log', dest='warm_up_log', default=None, metavar='access.log')
+parser.add_argument('--warm-up-sample', dest='warm_up_sample', default=warm_up.SAMPLE_SIZE, type=int, metavar='N')
+parser.add_argument('--warm-up-rps', dest='warm_up_rps', default=warm_up.RPS, type=float, metavar='N')
+parser.add_argument('--warm-up-round', dest='warm_up_round', default=warm_up.ROUND, type=int, metavar='SECONDS')
+parser.add_argument('--warm-up-tolerance', dest='warm_up_tolerance', default=warm_up.TOLERANCE, type=float,
+                    metavar='FRACTION')
+parser.add_argument('--warm-up-timeout', dest='warm_up_timeout', default=warm_up.TIMEOUT, type=int, metavar='SECONDS')
+parser.add_argument('--shift-steps', dest='shift_steps', nargs='+', default=None, type=int, metavar='PERCENT')
+parser.add_argument('--shift-wait', dest='shift_wait', default=60, type=int, metavar='SECONDS')
+parser.add_argument('--drain-agent-port', dest='drain_agent_port', default=None, type=int, metavar='PORT')
+parser.add_argument('--drain-agent-path', dest='drain_agent_path', default=drain.AGENT_PATH, metavar='/connections')
+parser.add_argument('--drain-timeout', dest='drain_timeout', default=drain.TIMEOUT, type=int, metavar='SECONDS')
+parser.add_argument('--drain-min-wait', dest='drain_min_wait', default=None, type=int, metavar='SECONDS')
+parser.add_argument('--no-preflight', dest='check_preflight', action='store_false')
+parser.add_argument('--no-propagation-check', dest='verify_propagation', action='store_false')
+parser.add_argument('--propagation-timeout', dest='propagation_timeout', default=None, type=int, metavar='SECONDS')
+parser.add_argument('--cutover', dest='cutover', default='dns', choices=cutover.KINDS)
+parser.add_argument('--elastic-ip', dest='elastic_ips', nargs='+', default=None, metavar='[IP | eipalloc-XXX]')
+parser.add_argument('--load-balancer', dest='load_balancer', default=None, metavar='NAME')
+parser.add_argument('--reap-keep', dest='reap_keep', default=None, type=int, metavar='N')
+parser.add_argument('--reap-orphans', dest='reap_orphans', action='store_true')
+parser.add_argument('--report-json', dest='report_json', default=None, metavar='report.json')
+parser.add_argument('--prometheus-file', dest='prometheus_file', default=None, metavar='blue_green.prom')
+parser.add_argument('--resume', dest='resume', action='store_true')
+parser.add_argument('--journal-dir', dest='journal_dir', default=journal.JOURNAL_DIR, metavar='DIR')
+parser.add_argument('--history-file', dest='history_file', default=history.HISTORY_FILE, metavar='history.sqlite3')
+parser.add_argument('--history-weeks', dest='history_weeks', default=4, type=int, metavar='N')
+parser.add_argument('--daemon', dest='daemon', default=None, metavar='[/path/to/socket | host:port]')
+parser.add_argument('--plan-action', dest='plan_action', default='deploy', choices=('deploy', 'switch', 'roll'))
+parser.add_argument('--snapshot-dir', dest='snapshot_dir', default=snapshot.SNAPSHOT_DIR, metavar='DIR')
+parser.add_argument('--action', dest='action', required=True,
+                    metavar='[deploy | switch | roll | plan | refresh | reap | history]')
 
 args = parser.parse_args()
 
-shutdown_behavior = 'stop'
+journal.JOURNAL_DIR = args.journal_dir
+history.HISTORY_FILE = args.history_file
 
-blue_alias = 'blue' + '.' + args.domain
-green_alias = 'green' + '.' + args.domain
+regions = args.region + (orchestrator.read_regions_file(args.regions_file) if args.regions_file else [])
 
-old_tag = {'Environment': 'old-app'}
-
-if args.action == 'switch':
-    print(aws_lib.switch(args.region, args.aws_access_key, args.aws_secret_key, old_tag, args.domain, args.live_alias,
-                   blue_alias, green_alias, dry_run=False))
-elif args.action == 'roll':
-    print(aws_lib.roll_back(args.region, args.aws_access_key, args.aws_secret_key, old_tag, args.domain, args.live_alias, blue_alias,
-                      green_alias, dry_run=False))
-elif args.action == 'deploy':
-    print(aws_lib.deployment_stage(args.region, args.aws_access_key, args.aws_secret_key, args.web_srv_name, args.domain,
-                             args.live_alias, blue_alias, green_alias, old_tag, args.image_id, args.ssh_key,
-                             args.sec_group, args.subnet_id, args.instance_size, shutdown_behavior, args.dry_run))
-else:
+if args.action not in ('deploy', 'switch', 'roll', 'plan', 'refresh', 'reap', 'history'):
     print('--action not set properly.')
-    sys.exit(1)
\ No newline at end of file
+    sys.exit(1)
+
+if args.action == 'history':
+    # Trends of phase timings from local history, no AWS call.
+    print(history.trends(regions, args.history_weeks))
+    sys.exit(0)
+
+if args.manifest:
+    # Many applications from manifest. Per-application arguments are defaults for the manifest.
+    if args.daemon:
+        parser.error('--manifest can not be used with --daemon')
+
+    try:
+        apps = manifest.load(args.manifest)
+        tasks = manifest.build_tasks(apps, args.action, args, regions)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    try:
+        results = orchestrator.run_tasks(tasks, apps.get('max_parallel', args.max_parallel),
+                                         apps.get('per_region', args.per_region), args.fail_fast)
+        print(orchestrator.format_report(results))
+
+        if any(result.status != orchestrator.OK for result in results):
+            sys.exit(1)
+    finally:
+        metrics.export(args.report_json, args.prometheus_file)
+
+    sys.exit(0)
+
+missing = manifest.missing_options(args.action, args)
+if missing:
+    flags = dict((option.dest, option.option_strings[0]) for option in parser._actions if option.option_strings)
+    parser.error('the following arguments are required: %s' % ', '.join(flags[name] for name in missing))
+
+if not regions:
+    parser.error('at least one region is required (--region or --regions-file)')
+
+if args.daemon and args.action != 'plan':
+    # Thin client. Daemon keeps connections open and runs the job; drain provider and cutover are built on its side,
+    # so neither aws_lib nor boto is imported here.
+    import daemon
+
+    try:
+        action_args, action_kwargs = manifest.action_arguments(args.action, args)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    jobs = [(region, daemon.submit(args.daemon, args.action, region, action_args, action_kwargs))
+            for region in regions]
+    results = []
+    for region, job in jobs:
+        job = daemon.wait(args.daemon, job['id'])
+        results.append(orchestrator.RegionResult(region, orchestrator.OK if job['status'] == 'ok' else
+                                                 orchestrator.FAILED, job['result'], job['error'],
+                                                 (job['finished'] or job['submitted']) - job['submitted']))
+
+    if len(results) == 1:
+        print(results[0].result if results[0].status == orchestrator.OK else results[0].error)
+    else:
+        print(orchestrator.format_report(results))
+
+    sys.exit(0 if all(result.status == orchestrator.OK for result in results) else 1)
+
+try:
+    action, action_args, action_kwargs = manifest.prepare_action(args.action, args)
+except ValueError as ex:
+    parser.error(str(ex))
+
+try:
+    if len(regions) == 1:
+        print(action(regions[0], *action_args, **action_kwargs))
+    else:
+        # Multi-region mode. Every region has its own pipeline and they are run at the same time.
+        results = orchestrator.run_in_regions(action, regions, action_args, action_kwargs, args.max_parallel,
+                                              args.fail_fast)
+        print(orchestrator.format_report(results))
+
+        if any(result.status != orchestrator.OK for result in results):
+            sys.exit(1)
+finally:
+    # Timings of phases and API calls, also when deployment failed.
+    metrics.export(args.report_json, args.prometheus_file)
@@ -0,0 +1,136 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Connection drain of the old color. Instead of waiting fixed 5 minutes we watch activity of the old instances and
+finish as soon as there is no traffic left. Activity comes from pluggable metrics provider.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import json
+import logging
+import time
+from concurrent import futures
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+TIMEOUT = 300       # upper bound, the same 5 minutes we always waited
+INTERVAL = 10       # seconds between checks
+QUIET_CHECKS = 2    # checks in a row without connections before we call it drained
+
+AGENT_PORT = 8080
+AGENT_PATH = '/connections'
+
+DrainResult = collections.namedtuple('DrainResult', ['drained', 'elapsed', 'connections'])
+
+#####################################################################
+#      Classes and functions
+#####################################################################
+
+
+class MetricsProvider(object):
+    """
+    Source of activity of instances. Subclass it and implement active_connections.
+    """
+
+    def active_connections(self, instances):
+        """
+        :description: Returns number of active connections per instance.
+        :param
+            instances: list of EC2 instances
+        :return: dictionary instance ID -> number of connections (None when it is unknown)
+        """
+        raise NotImplementedError()
+
+
+class AgentMetricsProvider(MetricsProvider):
+    """
+    Asks local agent running on every instance. Agent answers with JSON {"active_connections": N} or just N.
+    """
+
+    def __init__(self, port=AGENT_PORT, path=AGENT_PATH, address_attribute='ip_address', timeout=5):
+        self.port = port
+        self.path = path
+        self.address_attribute = address_attribute
+        self.timeout = timeout
+
+    def _ask(self, instance):
+        # Imported here, command line imports this module for its defaults only.
+        import urllib.request
+
+        url = 'http://%s:%s%s' % (getattr(instance, self.address_attribute), self.port, self.path)
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as respond:
+                body = json.loads(respond.read().decode('utf-8'))
+        except (OSError, ValueError) as ex:
+            LOGGER.debug('Could not get active connections from %s: %s' % (url, ex))
+            return None
+
+        return int(body['active_connections'] if isinstance(body, dict) else body)
+
+    def active_connections(self, instances):
+        if not instances:
+            return {}
+
+        with futures.ThreadPoolExecutor(max_workers=min(len(instances), 32)) as executor:
+            counts = executor.map(self._ask, instances)
+
+        return dict(zip([instance.id for instance in instances], counts))
+
+
+def drain(instances, provider=None, timeout=TIMEOUT, interval=INTERVAL, quiet_checks=QUIET_CHECKS, min_wait=0,
+          sleep=None):
+    """
+    :description: Waits until old instances have no active connections. Unknown activity counts as active, so
+                  without provider it simply waits until timeout as before.
+    :param
+        instances: list of EC2 instances of the old color
+        provider: MetricsProvider or None
+        timeout: Upper bound of waiting in seconds
+        interval: Seconds between checks
+        quiet_checks: Checks in a row without any connection before instances are treated as drained
+        min_wait: Minimum seconds to wait (e.g. DNS TTL), no matter what provider says. Timeout is raised to it.
+        sleep: Function used for sleeping (time.sleep by default)
+    :return: DrainResult
+    """
+    sleep = sleep or time.sleep
+    start = time.time()
+    timeout = max(timeout, min_wait)
+
+    if provider is None or not instances:
+        if instances:
+            sleep(timeout)
+        return DrainResult(not instances, time.time() - start, {})
+
+    quiet = 0
+    counts = {}
+
+    while True:
+        counts = provider.active_connections(instances)
+        elapsed = time.time() - start
+
+        if counts and all(count == 0 for count in counts.values()):
+            quiet += 1
+        else:
+            quiet = 0
+
+        if quiet >= quiet_checks and elapsed >= min_wait:
+            LOGGER.info('Instances %s drained after %.0f seconds.' % (sorted(counts), elapsed))
+            return DrainResult(True, elapsed, counts)
+
+        if elapsed + interval > timeout:
+            sleep(max(0, timeout - elapsed))
+            LOGGER.warning('Instances were not drained after %s seconds. Active connections: %s' % (timeout, counts))
+            return DrainResult(False, time.time() - start, counts)
+
+        sleep(interval)
@@ -0,0 +1,282 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Asyncio health checks of staging nodes. Every node is probed concurrently over its own keep-alive connection,
+status codes and latencies are gathered and the check passes as soon as every node answered correctly for the
+whole success window, or fails as soon as a node keeps failing.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import logging
+import math
+import time
+
+# Local modules
+import lazy
+
+# Imported on first use, command line doesn't need event loop to start.
+asyncio = lazy.load('asyncio')
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# Default gate settings.
+PORT = 80
+PATH = '/'
+METHOD = 'HEAD'
+OK_STATUSES = (200,)
+SUCCESS_WINDOW = 5          # consecutive good answers required from every node
+MAX_FAILURES = 3            # consecutive bad answers after which node fails the check
+INTERVAL = 1.0              # seconds between probing rounds
+REQUEST_TIMEOUT = 5.0       # seconds for single request
+TIMEOUT = 600               # seconds for the whole check (10 minutes as simple_check)
+MAX_P99 = None              # seconds, no latency gate by default
+MAX_ERROR_RATE = None       # fraction of failed probes, no error-rate gate by default
+
+HealthReport = collections.namedtuple('HealthReport', ['passed', 'reason', 'status_codes', 'p50', 'p95', 'p99',
+                                                       'nodes'])
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def percentile(values, pct):
+    """
+    :description: Nearest-rank percentile.
+    :param
+        values: list of numbers
+        pct: percentile (0 - 100)
+    :return: value or None for empty list
+    """
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+
+    return ordered[max(rank, 1) - 1]
+
+
+def error_ratio(status_codes, ok_statuses=OK_STATUSES):
+    """
+    :description: Fraction of probes which did not return healthy status.
+    :param
+        status_codes: Counter of status codes (None for connection errors)
+        ok_statuses: Status codes treated as healthy
+    :return: float
+    """
+    total = sum(status_codes.values())
+    if not total:
+        return 0.0
+
+    return float(sum(count for status, count in status_codes.items() if status not in ok_statuses)) / total
+
+
+def unique(nodes):
+    """
+    :description: Drops repeated nodes, order is kept.
+    :param
+        nodes: list of IP addresses (or hostnames)
+    :return: list
+    """
+    return list(collections.OrderedDict.fromkeys(nodes))
+
+
+class HttpConnection(object):
+    """
+    Single keep-alive HTTP/1.1 connection. It reconnects on its own when server closed the previous one.
+    """
+
+    def __init__(self, address, port=PORT, host_header=None, timeout=REQUEST_TIMEOUT):
+        self.address = address
+        self.port = port
+        self.host_header = host_header or address
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.address, self.port)
+
+    async def _read_response(self, method):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by %s' % self.address)
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if method != 'HEAD' and status not in (204, 304):
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                while True:
+                    size = int((await self.reader.readline()).split(b';')[0], 16)
+                    await self.reader.readexactly(size + 2)
+                    if size == 0:
+                        break
+            elif 'content-length' in headers:
+                await self.reader.readexactly(int(headers['content-length']))
+            else:
+                await self.reader.read()
+                headers['connection'] = 'close'
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+
+        return status
+
+    async def request(self, method=METHOD, path=PATH, headers=None):
+        """
+        :description: Sends request over the kept-alive connection.
+        :param
+            method: HTTP method
+            path: Request path
+            headers: Additional headers
+        :return: tuple with status code and latency in seconds
+        """
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % self.host_header, 'Connection: keep-alive']
+        lines.extend('%s: %s' % (name, value) for name, value in (headers or {}).items())
+        payload = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        for attempt in range(2):
+            reused = self.writer is not None
+            start = time.time()
+            try:
+                if not reused:
+                    await asyncio.wait_for(self._connect(), self.timeout)
+                self.writer.write(payload)
+                status = await asyncio.wait_for(self._read_response(method), self.timeout)
+                return status, time.time() - start
+            except (ConnectionError, asyncio.IncompleteReadError, IndexError, ValueError):
+                self.close()
+                if not reused or attempt:
+                    # Fresh connection failed so it is not the stale keep-alive.
+                    raise
+            except (OSError, asyncio.TimeoutError):
+                self.close()
+                raise
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+
+async def probe_nodes(nodes, host_header=None, port=PORT, path=PATH, method=METHOD, ok_statuses=OK_STATUSES,
+                      success_window=SUCCESS_WINDOW, max_failures=MAX_FAILURES, interval=INTERVAL,
+                      request_timeout=REQUEST_TIMEOUT, timeout=TIMEOUT, max_p99=MAX_P99,
+                      max_error_rate=MAX_ERROR_RATE):
+    """
+    :description: Probes all nodes concurrently in rounds until the gate passes or fails.
+    :param
+        nodes: list of IP addresses (or hostnames) of staging nodes
+        host_header: Host header sent to nodes, usually staging alias
+        port: Port of web server
+        path: Path which is checked
+        method: HTTP method
+        ok_statuses: Status codes treated as healthy
+        success_window: Consecutive good answers required from every node
+        max_failures: Consecutive bad answers after which the check fails straight away
+        interval: Seconds between rounds
+        request_timeout: Seconds for single request
+        timeout: Seconds for the whole check
+        max_p99: Highest accepted p99 latency in seconds (None - no latency gate)
+        max_error_rate: Highest accepted fraction of failed probes (None - no error-rate gate)
+    :return: HealthReport
+    """
+    # Node listed twice would share its keep-alive connection between two concurrent probes.
+    nodes = unique(nodes)
+    connections = dict((node, HttpConnection(node, port, host_header, request_timeout)) for node in nodes)
+    stats = dict((node, {'ok': 0, 'failed': 0, 'latencies': []}) for node in nodes)
+    status_codes = collections.Counter()
+    deadline = time.time() + timeout
+
+    async def probe(node):
+        try:
+            status, latency = await connections[node].request(method, path)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as ex:
+            LOGGER.debug('Health check of %s failed: %s' % (node, ex))
+            status, latency = None, None
+
+        status_codes[status] += 1
+        node_stats = stats[node]
+        if status in ok_statuses:
+            node_stats['ok'] += 1
+            node_stats['failed'] = 0
+            node_stats['latencies'].append(latency)
+        else:
+            node_stats['ok'] = 0
+            node_stats['failed'] += 1
+
+    def report(passed, reason):
+        latencies = [latency for node_stats in stats.values() for latency in node_stats['latencies']]
+        nodes_summary = dict((node, {'ok': node_stats['ok'], 'failed': node_stats['failed'],
+                                     'p50': percentile(node_stats['latencies'], 50),
+                                     'p99': percentile(node_stats['latencies'], 99)})
+                             for node, node_stats in stats.items())
+        return HealthReport(passed, reason, dict(status_codes), percentile(latencies, 50), percentile(latencies, 95),
+                            percentile(latencies, 99), nodes_summary)
+
+    try:
+        while True:
+            await asyncio.gather(*[probe(node) for node in nodes])
+
+            failing = [node for node, node_stats in stats.items() if node_stats['failed'] >= max_failures]
+            if failing:
+                return report(False, 'Nodes %s failed %s checks in a row.' % (failing, max_failures))
+
+            if all(node_stats['ok'] >= success_window for node_stats in stats.values()):
+                result = report(True, 'All nodes passed %s checks in a row.' % success_window)
+                if max_p99 is not None and result.p99 > max_p99:
+                    return result._replace(passed=False, reason='p99 latency %.3fs is above %.3fs.' %
+                                                                (result.p99, max_p99))
+                error_rate = error_ratio(status_codes, ok_statuses)
+                if max_error_rate is not None and error_rate > max_error_rate:
+                    return result._replace(passed=False, reason='Error rate %.3f is above %.3f.' %
+                                                                (error_rate, max_error_rate))
+                return result
+
+            if time.time() + interval > deadline:
+                return report(False, 'Health check timed out after %s seconds.' % timeout)
+
+            await asyncio.sleep(interval)
+    finally:
+        for connection in connections.values():
+            connection.close()
+
+
+def check_nodes(nodes, **options):
+    """
+    :description: Blocking wrapper of probe_nodes. Accepts the same options.
+    :param
+        nodes: list of IP addresses (or hostnames) of staging nodes
+        options: see probe_nodes
+    :return: HealthReport
+    """
+    nodes = unique(nodes)
+    if not nodes:
+        return HealthReport(False, 'No nodes to check.', {}, None, None, None, {})
+
+    result = asyncio.run(probe_nodes(nodes, **options))
+
+    LOGGER.info('Health check of %s: %s (p50: %s, p95: %s, p99: %s, codes: %s)' %
+                (nodes, result.reason, result.p50, result.p95, result.p99, result.status_codes))
+
+    return result
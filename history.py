@@ -0,0 +1,249 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Local history of phase timings (SQLite). Every run records how long its phases took, keyed by region, instance type
+and AMI:
+
+    running        launch of instance until it is running
+    ip             running until it has Public IP
+    healthy        health check of staging until it passed (during switch, so its timeout never goes below default)
+    propagation    change of live alias until all nameservers answer with it
+
+Waits then take their timeout and polling from percentiles of recent timings instead of fixed values: polls are dense
+between p10 and p90 of the phase and we give up at p99.9 x MARGIN. Without enough samples defaults are used.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Local modules
+import health_check
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# Database next to parameters files unless configured otherwise. Empty value switches history off.
+HISTORY_FILE = 'history.sqlite3'
+
+PHASES = ('running', 'ip', 'healthy', 'propagation')
+
+MIN_SAMPLES = 10            # fewer samples than this and defaults are used
+SAMPLES = 500               # newest samples used for percentiles
+TAIL = 99.9
+MARGIN = 1.5
+MIN_TIMEOUT = 10            # seconds, adaptive timeout is never shorter
+
+WEEK = 7 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS timings (
+    time REAL NOT NULL,
+    region TEXT NOT NULL,
+    instance_type TEXT NOT NULL,
+    image_id TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_key ON timings (phase, region, instance_type, image_id, time);
+"""
+
+Estimate = collections.namedtuple('Estimate', ['samples', 'p10', 'p50', 'p90', 'tail'])
+
+_LOCK = threading.Lock()
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def connect(path=None):
+    """
+    :description: Opens history database (it is created when it doesn't exist).
+    :param
+        path: Database file (HISTORY_FILE by default)
+    :return: sqlite3.Connection
+    """
+    connection = sqlite3.connect(path or HISTORY_FILE, timeout=30)
+    connection.executescript(SCHEMA)
+
+    return connection
+
+
+def enabled(path=None):
+    return bool(path or HISTORY_FILE)
+
+
+def record(phase, region, instance_type, image_id, seconds, path=None):
+    """
+    :description: Saves timing of a phase. History problems never stop deployment.
+    :param
+        phase: One of PHASES
+        region: AWS region
+        instance_type: Instance type (None when phase doesn't depend on it)
+        image_id: AMI ID (None when phase doesn't depend on it)
+        seconds: Duration of the phase or list of durations (e.g. one per instance)
+        path: Database file (HISTORY_FILE by default)
+    :return: None
+    """
+    if not enabled(path):
+        return
+
+    durations = seconds if isinstance(seconds, (list, tuple)) else [seconds]
+    rows = [(time.time(), region, instance_type or '', image_id or '', phase, float(duration))
+            for duration in durations if duration is not None]
+
+    try:
+        with _LOCK:
+            connection = connect(path)
+            try:
+                with connection:
+                    connection.executemany('INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?)', rows)
+            finally:
+                connection.close()
+    except sqlite3.Error as ex:
+        LOGGER.warning('Cannot save %s timings to history: %s' % (phase, ex))
+
+
+def samples(phase, region, instance_type=None, image_id=None, path=None, limit=SAMPLES):
+    """
+    :description: Returns newest timings of a phase. Filters which are None are not applied.
+    :return: list of seconds
+    """
+    if not enabled(path) or not os.path.exists(path or HISTORY_FILE):
+        return []
+
+    query = 'SELECT seconds FROM timings WHERE phase = ? AND region = ?'
+    arguments = [phase, region]
+    for column, value in (('instance_type', instance_type), ('image_id', image_id)):
+        if value is not None:
+            query += ' AND %s = ?' % column
+            arguments.append(value)
+    query += ' ORDER BY time DESC LIMIT ?'
+    arguments.append(limit)
+
+    try:
+        with _LOCK:
+            connection = connect(path)
+            try:
+                return [row[0] for row in connection.execute(query, arguments)]
+            finally:
+                connection.close()
+    except sqlite3.Error as ex:
+        LOGGER.warning('Cannot read %s timings from history: %s' % (phase, ex))
+        return []
+
+
+def estimate(phase, region, instance_type=None, image_id=None, path=None):
+    """
+    :description: Percentiles of recent timings of a phase.
+    :return: Estimate or None when there are not enough samples
+    """
+    values = samples(phase, region, instance_type, image_id, path)
+    if len(values) < MIN_SAMPLES:
+        return None
+
+    return Estimate(len(values), health_check.percentile(values, 10), health_check.percentile(values, 50),
+                    health_check.percentile(values, 90), health_check.percentile(values, TAIL))
+
+
+def wait_plan(phases, region, instance_type, image_id, default_timeout, elapsed=0.0, margin=MARGIN, path=None):
+    """
+    :description: Timeout and polling window of a wait which covers given phases one after another.
+    :param
+        phases: List of phases (e.g. ['running', 'ip'] for launch until Public IP)
+        region: AWS region
+        instance_type: Instance type
+        image_id: AMI ID
+        default_timeout: Timeout used when some phase has not enough samples
+        elapsed: Seconds of the phases which already passed before the wait started
+        margin: Timeout is p99.9 x margin
+        path: Database file (HISTORY_FILE by default)
+    :return: tuple with timeout and (start, end) of dense polling (relative to start of the wait) or None
+    """
+    estimates = [estimate(phase, region, instance_type, image_id, path) for phase in phases]
+    if None in estimates:
+        return default_timeout, None
+
+    timeout = max(sum(found.tail for found in estimates) * margin - elapsed, MIN_TIMEOUT)
+    expected = (max(sum(found.p10 for found in estimates) - elapsed, 0.0),
+                max(sum(found.p90 for found in estimates) - elapsed, 0.0))
+    LOGGER.info('%s in %s: p50 %.1fs, giving up after %.1fs.' % (' + '.join(phases), region,
+                                                                 sum(found.p50 for found in estimates), timeout))
+
+    return timeout, expected
+
+
+def timeout(phase, region, instance_type=None, image_id=None, default=None, margin=MARGIN, path=None):
+    """
+    :description: Timeout of single phase (p99.9 x margin) or default when there are not enough samples.
+    :return: seconds
+    """
+    return wait_plan([phase], region, instance_type, image_id, default, margin=margin, path=path)[0]
+
+
+def trends(region=None, weeks=4, path=None):
+    """
+    :description: Table of phase timings with median of every week (oldest first), to spot AMIs which boot slower.
+    :param
+        region: AWS region or list of them (all regions by default)
+        weeks: Number of weeks in the trend
+        path: Database file (HISTORY_FILE by default)
+    :return: string
+    """
+    if not enabled(path) or not os.path.exists(path or HISTORY_FILE):
+        return 'No history in %s.' % (path or HISTORY_FILE)
+
+    regions = [region] if isinstance(region, str) else list(region or [])
+    now = time.time()
+
+    with _LOCK:
+        connection = connect(path)
+        try:
+            rows = connection.execute('SELECT phase, region, instance_type, image_id, time, seconds FROM timings '
+                                      'WHERE time >= ? ORDER BY time', (now - weeks * WEEK,)).fetchall()
+        finally:
+            connection.close()
+
+    grouped = collections.OrderedDict()
+    for phase, row_region, instance_type, image_id, taken, seconds in rows:
+        if regions and row_region not in regions:
+            continue
+        week = min(int((now - taken) // WEEK), weeks - 1)
+        key = (PHASES.index(phase) if phase in PHASES else len(PHASES), phase, row_region, instance_type, image_id)
+        grouped.setdefault(key, [[] for _ in range(weeks)])[weeks - 1 - week].append(seconds)
+
+    if not grouped:
+        return 'No timings in the last %s weeks.' % weeks
+
+    lines = ['%-12s %-14s %-12s %-22s %7s %8s %8s %8s   %s' % ('phase', 'region', 'type', 'ami', 'samples', 'p50',
+                                                                'p90', 'p99.9', 'p50 by week (oldest first)')]
+    for key in sorted(grouped):
+        _, phase, row_region, instance_type, image_id = key
+        values = sum(grouped[key], [])
+        medians = [health_check.percentile(week_values, 50) for week_values in grouped[key]]
+        trend = ' > '.join('-' if median is None else '%.1f' % median for median in medians)
+
+        known = [median for median in medians if median is not None]
+        if len(known) > 1 and known[0]:
+            trend += ' (%+.0f%%)' % ((known[-1] - known[0]) * 100.0 / known[0])
+
+        lines.append('%-12s %-14s %-12s %-22s %7s %8.1f %8.1f %8.1f   %s' % (
+            phase, row_region, instance_type or '-', image_id or '-', len(values),
+            health_check.percentile(values, 50), health_check.percentile(values, 90),
+            health_check.percentile(values, TAIL), trend))
+
+    return '\n'.join(lines)
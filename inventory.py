@@ -0,0 +1,174 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+In-memory inventory of EC2 instances. Instances are loaded once per connection (so once per run), indexed by
+App tag, Environment tag and state and reloaded only after we changed something (start, stop, terminate, tag).
+
+App tag holds domain of the application (e.g. example.com), so many applications could live in one account and
+region. Instances without App tag were launched before App tag existed. Single application run adopts them (see
+adopt_untagged), so upgraded deployments still find their fleets; they get App tag as soon as they are retagged.
+Manifest runs don't adopt them, because they couldn't tell which application they belong to.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import logging
+import threading
+import weakref
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# Tag by which instances are indexed. Only instances with this tag are loaded.
+TAG_KEY = 'Environment'
+
+# Tag with application (domain) the instance belongs to.
+APP_TAG_KEY = 'App'
+
+_INVENTORIES = weakref.WeakKeyDictionary()
+_LOCK = threading.Lock()
+
+#####################################################################
+#      Classes and functions
+#####################################################################
+
+
+class Inventory(object):
+    """
+    Snapshot of instances tagged with TAG_KEY, indexed by (application, tag value, state).
+    """
+
+    def __init__(self, ec2_conn, tag_key=TAG_KEY):
+        self.ec2_conn = ec2_conn
+        self.tag_key = tag_key
+        self.index = None
+        self.untagged_app = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        :description: Loads all instances with tag_key with one describe call and builds index.
+        :return: None
+        """
+        instances = self.ec2_conn.get_only_instances(filters={'tag-key': self.tag_key})
+
+        index = {}
+        untagged = 0
+        for instance in instances:
+            app = instance.tags.get(APP_TAG_KEY)
+            if app is None:
+                untagged += 1
+                app = self.untagged_app
+            index.setdefault((app, instance.tags.get(self.tag_key), instance.state), []).append(instance)
+
+        LOGGER.debug('Loaded %s instances to inventory.' % len(instances))
+        if untagged and self.untagged_app is not None:
+            LOGGER.info('%s instance(s) without %s tag are treated as instances of %s.'
+                        % (untagged, APP_TAG_KEY, self.untagged_app))
+        self.index = index
+
+    def find(self, tag_value, instance_state, app=None):
+        """
+        :description: Returns instances with given tag value in given state(s).
+        :param
+            tag_value: Value of the tag.
+            instance_state: State or list of states - "running" / "pending" / "stopped".
+            app: Application (see app_name) or None for instances of all applications.
+        :return: list of instances
+        """
+        states = instance_state if isinstance(instance_state, (list, tuple)) else [instance_state]
+
+        with self.lock:
+            if self.index is None:
+                self.load()
+
+            if app is not None:
+                return [instance for state in states for instance in self.index.get((app, tag_value, state), [])]
+
+            return [instance for state in states for (_, value, indexed_state), instances in self.index.items()
+                    if (value, indexed_state) == (tag_value, state) for instance in instances]
+
+    def all(self):
+        """
+        :description: Returns all instances from inventory.
+        :return: list of instances
+        """
+        with self.lock:
+            if self.index is None:
+                self.load()
+
+            return [instance for instances in self.index.values() for instance in instances]
+
+    def invalidate(self):
+        """
+        :description: Drops the snapshot. It will be loaded again on next lookup.
+        :return: None
+        """
+        with self.lock:
+            self.index = None
+
+    def adopt_untagged(self, app):
+        """
+        :description: Makes lookups of given application find also instances without App tag.
+        :param
+            app: Application (see app_name)
+        :return: None
+        """
+        with self.lock:
+            if self.untagged_app != app:
+                self.untagged_app = app
+                self.index = None
+
+
+def app_name(domain):
+    """
+    :description: Returns App tag value of application with given domain.
+    :param
+        domain: Your Domain (e.g. example.com.)
+    :return: domain without trailing dot, lower case
+    """
+    return domain.lower().rstrip('.')
+
+
+def for_connection(ec2_conn):
+    """
+    :description: Returns inventory of given connection. New inventory is created for new connection.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+    :return: Inventory
+    """
+    with _LOCK:
+        if ec2_conn not in _INVENTORIES:
+            _INVENTORIES[ec2_conn] = Inventory(ec2_conn)
+
+        return _INVENTORIES[ec2_conn]
+
+
+def adopt_untagged(ec2_conn, app):
+    """
+    :description: Instances without App tag found through given connection are treated as instances of app. Use it
+                  only when app is the only application deployed with the connection.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        app: Application (see app_name)
+    :return: None
+    """
+    for_connection(ec2_conn).adopt_untagged(app)
+
+
+def invalidate(ec2_conn):
+    """
+    :description: Marks inventory of given connection as outdated. Call it after every change of instances.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+    :return: None
+    """
+    for_connection(ec2_conn).invalidate()
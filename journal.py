@@ -0,0 +1,177 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Append-only journal of deployment steps. Every finished step of deploy / roll is written as one JSON line (with
+instance IDs, IPs, DNS change IDs...) and synced to disk. When run dies in the middle, the next run with resume
+reads the journal and skips steps which were done (and are still valid - it is up to caller to check).
+
+Journal file has one line per record:
+
+    {"run": "1449000000.123", "step": "start", "time": 1449000000.123, "data": {...}}
+    {"run": "1449000000.123", "step": "launch", "time": 1449000012.456, "data": {"instance_ids": [...]}}
+    {"run": "1449000000.123", "step": "finished", "time": 1449000099.789, "data": {}}
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import json
+import logging
+import os
+import threading
+import time
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# Journals are written next to parameters files unless configured otherwise.
+JOURNAL_DIR = '.'
+
+START = 'start'
+FINISHED = 'finished'
+
+#####################################################################
+#      Classes and functions
+#####################################################################
+
+
+class Journal(object):
+    """
+    Journal of a single run. Disabled journal (path None) remembers nothing, so dry run doesn't leave traces.
+    """
+
+    def __init__(self, path, run_id, steps=None):
+        self.path = path
+        self.run_id = run_id
+        self.steps = steps or {}
+        self.lock = threading.Lock()
+
+    def get(self, step):
+        """
+        :description: Returns data of the step if it was done in this run (or in the run we resume).
+        :param
+            step: Name of the step
+        :return: dictionary or None
+        """
+        return self.steps.get(step)
+
+    def discard(self, step):
+        """
+        :description: Forgets the step. Used when the step is no longer valid and has to be done again.
+        :param
+            step: Name of the step
+        :return: None
+        """
+        self.steps.pop(step, None)
+
+    def record(self, step, **data):
+        """
+        :description: Writes finished step to the journal.
+        :param
+            step: Name of the step
+            data: JSON serializable details of the step
+        :return: None
+        """
+        self.steps[step] = data
+
+        if self.path is None:
+            return
+
+        line = json.dumps({'run': self.run_id, 'step': step, 'time': time.time(), 'data': data}, sort_keys=True)
+
+        with self.lock:
+            with open(self.path, 'a') as journal_file:
+                journal_file.write(line + '\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def finish(self):
+        """
+        :description: Marks the run as finished. There is nothing to resume after that.
+        :return: None
+        """
+        self.record(FINISHED)
+
+
+def journal_path(action, region, directory=None, app=None):
+    """
+    :description: Returns path of the journal of given action, region and application.
+    :param
+        action: deploy or roll
+        region: AWS region
+        directory: Directory with journals (JOURNAL_DIR by default)
+        app: Application (see inventory.app_name) or None
+    :return: path
+    """
+    name = '%s-%s-%s.journal' % (action, region, app) if app else '%s-%s.journal' % (action, region)
+
+    return os.path.join(directory or JOURNAL_DIR, name)
+
+
+def read_last_run(path):
+    """
+    :description: Reads steps of the last run from the journal. Broken last line (we died while writing) is skipped.
+    :param
+        path: Journal file
+    :return: tuple with run ID and dictionary of steps (step -> data), or (None, {}) if there is no journal.
+    """
+    run_id, steps = None, {}
+
+    if not os.path.exists(path):
+        return run_id, steps
+
+    with open(path) as journal_file:
+        for line in journal_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                LOGGER.warning('Skipping broken line of journal %s' % path)
+                continue
+
+            if entry['step'] == START:
+                run_id, steps = entry['run'], {}
+            elif entry['run'] == run_id:
+                steps[entry['step']] = entry['data']
+
+    return run_id, steps
+
+
+def open_run(action, region, resume=False, enabled=True, directory=None, app=None, **details):
+    """
+    :description: Starts journal of new run or continues the last one.
+    :param
+        action: deploy or roll
+        region: AWS region
+        resume: True or False. If True and the last run didn't finish, its steps are loaded.
+        enabled: True or False. If False, nothing is read or written (dry run).
+        directory: Directory with journals (JOURNAL_DIR by default)
+        app: Application (see inventory.app_name) or None. Applications in the same region have separate journals.
+        details: JSON serializable parameters of the run written to start record
+    :return: Journal
+    """
+    if not enabled:
+        return Journal(None, None)
+
+    path = journal_path(action, region, directory, app)
+
+    if resume:
+        run_id, steps = read_last_run(path)
+        if run_id is not None and FINISHED not in steps:
+            LOGGER.warning('Resuming %s in %s from journal %s. Done steps: %s' %
+                           (action, region, path, ', '.join(sorted(steps)) or 'none'))
+            return Journal(path, run_id, steps)
+
+        LOGGER.info('Nothing to resume in %s. Starting from scratch.' % path)
+
+    journal = Journal(path, '%.3f' % time.time())
+    journal.record(START, action=action, region=region, app=app, **details)
+    journal.steps.pop(START)
+
+    return journal
@@ -0,0 +1,61 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Lazy imports of heavy libraries. Boto and requests take longer to import than the rest of the script together, yet
+--help, wrong --action, plan or history never call AWS. Modules keep their usual names for them, e.g.
+
+    exception = lazy.load('boto.exception')
+
+and the library is imported on the first attribute access (e.g. when the first connection is made or the first
+"except exception.EC2ResponseError" is evaluated).
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import importlib
+
+#####################################################################
+#      Classes and functions
+#####################################################################
+
+
+class LazyModule(object):
+    """
+    Stands in for a module until one of its attributes is needed.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+
+    def _lazy_load(self):
+        if self._lazy_module is None:
+            # import_module is thread safe, at worst two threads look the module up in sys.modules.
+            self.__dict__['_lazy_module'] = importlib.import_module(self._lazy_name)
+
+        return self._lazy_module
+
+    def __getattr__(self, name):
+        return getattr(self._lazy_load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._lazy_load(), name, value)
+
+    def __repr__(self):
+        return '<lazy module %r (%s)>' % (self._lazy_name, 'loaded' if self._lazy_module else 'not loaded')
+
+
+def load(name):
+    """
+    :description: Returns module which is imported on first use.
+    :param
+        name: Full name of the module (e.g. boto.ec2.elb)
+    :return: LazyModule
+    """
+    return LazyModule(name)
+
@@ -0,0 +1,264 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Load test gate run before switch. Configurable request mix is sent to all staging nodes (and optionally to live nodes
+at the same time) at fixed rate, requests per second and latency percentiles are measured and staging is compared
+with live (or with the last saved result when live is not tested). Staging which regressed beyond thresholds is not
+switched. Every result is appended to results file (JSON lines), so later runs are compared against it.
+
+Requests are sent open-loop: they are scheduled at fixed rate no matter how fast the server answers and latency is
+measured from the scheduled time, so slow server can't hide its latency by slowing down the load.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import itertools
+import json
+import logging
+import os
+import random
+import time
+
+# Local modules
+import health_check
+import lazy
+
+# Imported on first use, command line doesn't need event loop to start.
+asyncio = lazy.load('asyncio')
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# Default load.
+MIX = [('GET', '/', 1)]
+RPS = 50                    # requests per second sent to all nodes of one target together
+DURATION = 30               # seconds
+CONCURRENCY = 10            # connections per node
+PORT = health_check.PORT
+REQUEST_TIMEOUT = health_check.REQUEST_TIMEOUT
+OK_STATUSES = (200, 201, 204, 301, 302, 304)
+
+# Default thresholds (compared with live or with the last saved result).
+MAX_RPS_DROP = 0.1          # staging has to reach 90% of baseline requests per second
+MAX_P99_INCREASE = 0.25     # p99 latency of staging can be at most 25% higher
+MAX_ERROR_RATE = 0.01       # absolute fraction of failed requests
+
+RESULTS_FILE = 'load-tests.jsonl'
+
+LoadResult = collections.namedtuple('LoadResult', ['target', 'requests', 'errors', 'rps', 'p50', 'p95', 'p99',
+                                                   'status_codes', 'seconds'])
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def parse_mix(entries):
+    """
+    :description: Parses request mix from command line ("METHOD:PATH:WEIGHT", e.g. "GET:/api/items:3").
+    :param
+        entries: list of strings (or already parsed triples)
+    :return: list of (method, path, weight)
+    """
+    mix = []
+    for entry in entries or []:
+        if not isinstance(entry, str):
+            mix.append((entry[0], entry[1], float(entry[2])))
+            continue
+
+        method, _, rest = entry.partition(':')
+        path, _, weight = rest.rpartition(':')
+        if not path:
+            path, weight = rest, '1'
+        mix.append((method.upper(), path, float(weight)))
+
+    return mix or list(MIX)
+
+
+async def run_load(nodes, host_header, mix=None, rps=RPS, duration=DURATION, concurrency=CONCURRENCY, port=PORT,
+                   request_timeout=REQUEST_TIMEOUT, ok_statuses=OK_STATUSES, target=None):
+    """
+    :description: Sends request mix to nodes at fixed rate (round robin) for given time.
+    :param
+        nodes: list of IP addresses (or hostnames)
+        host_header: Host header sent to nodes
+        mix: list of (method, path, weight)
+        rps: Requests per second for all nodes together
+        duration: Seconds of load
+        concurrency: Connections per node
+        port: Port of web server
+        request_timeout: Seconds for single request
+        ok_statuses: Status codes counted as successful
+        target: Name of the target in the result (host_header by default)
+    :return: LoadResult
+    """
+    loop = asyncio.get_running_loop()
+    mix = parse_mix(mix)
+    requests = [(method, path) for method, path, _ in mix]
+    weights = [weight for _, _, weight in mix]
+
+    connections = [health_check.HttpConnection(node, port, host_header, request_timeout)
+                   for node in nodes for _ in range(concurrency)]
+    pools = dict((node, asyncio.Queue()) for node in nodes)
+    for connection in connections:
+        pools[connection.address].put_nowait(connection)
+
+    latencies = []
+    status_codes = collections.Counter()
+    node_cycle = itertools.cycle(nodes)
+
+    async def send(node, method, path, scheduled):
+        connection = await pools[node].get()
+        try:
+            status, _ = await connection.request(method, path)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as ex:
+            LOGGER.debug('Load test request to %s failed: %s' % (node, ex))
+            status = None
+        finally:
+            pools[node].put_nowait(connection)
+
+        status_codes[status] += 1
+        if status in ok_statuses:
+            # From the time request should have been sent, waiting for free connection counts too.
+            latencies.append(loop.time() - scheduled)
+
+    start = loop.time()
+    total = int(rps * duration)
+    tasks = []
+    try:
+        for number in range(total):
+            scheduled = start + number / float(rps)
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            method, path = random.choices(requests, weights)[0]
+            tasks.append(loop.create_task(send(next(node_cycle), method, path, scheduled)))
+
+        # Requests which didn't finish in time count as errors.
+        if tasks:
+            await asyncio.wait(tasks, timeout=request_timeout)
+    finally:
+        for task in tasks:
+            task.cancel()
+        for connection in connections:
+            connection.close()
+
+    seconds = loop.time() - start
+    completed = sum(status_codes.values())
+    errors = completed - len(latencies) + (total - completed)
+
+    return LoadResult(target or host_header, total, errors, len(latencies) / seconds if seconds else 0.0,
+                      health_check.percentile(latencies, 50), health_check.percentile(latencies, 95),
+                      health_check.percentile(latencies, 99), dict(status_codes), seconds)
+
+
+async def run_targets(targets, options):
+    return await asyncio.gather(*[run_load(nodes, host_header, target=name, **options)
+                                  for name, (nodes, host_header) in targets])
+
+
+def load_test(targets, **options):
+    """
+    :description: Loads all targets at the same time (blocking).
+    :param
+        targets: list of (name, (nodes, host_header)) pairs, e.g. staging and live
+        options: see run_load
+    :return: list of LoadResult (same order as targets)
+    """
+    results = asyncio.run(run_targets([(name, target) for name, target in targets if target[0]], options))
+
+    for result in results:
+        LOGGER.info('Load test of %s: %.1f rps, p50 %s, p95 %s, p99 %s, %s errors of %s (codes: %s)' %
+                    (result.target, result.rps, result.p50, result.p95, result.p99, result.errors, result.requests,
+                     result.status_codes))
+
+    return results
+
+
+def evaluate(staging, baseline, max_rps_drop=MAX_RPS_DROP, max_p99_increase=MAX_P99_INCREASE,
+             max_error_rate=MAX_ERROR_RATE):
+    """
+    :description: Compares staging with baseline.
+    :param
+        staging: LoadResult of staging
+        baseline: LoadResult (or dictionary from results file) of live / previous run, or None
+        max_rps_drop: Highest accepted drop of requests per second (fraction of baseline)
+        max_p99_increase: Highest accepted increase of p99 latency (fraction of baseline)
+        max_error_rate: Highest accepted fraction of failed requests
+    :return: tuple with boolean and reason
+    """
+    error_rate = float(staging.errors) / staging.requests if staging.requests else 1.0
+    if max_error_rate is not None and error_rate > max_error_rate:
+        return False, 'Error rate %.3f is above %.3f.' % (error_rate, max_error_rate)
+
+    if staging.p99 is None:
+        # Latency is measured on successful requests only, nothing to compare.
+        return False, 'No request to staging succeeded (%s of %s failed).' % (staging.errors, staging.requests)
+
+    if baseline is None:
+        return True, 'No baseline to compare with. Error rate %.3f.' % error_rate
+
+    if isinstance(baseline, dict):
+        baseline = LoadResult(**dict((field, baseline.get(field)) for field in LoadResult._fields))
+
+    if max_rps_drop is not None and baseline.rps and staging.rps < baseline.rps * (1 - max_rps_drop):
+        return False, 'Requests per second dropped from %.1f to %.1f.' % (baseline.rps, staging.rps)
+
+    if max_p99_increase is not None and baseline.p99 and staging.p99 > baseline.p99 * (1 + max_p99_increase):
+        return False, 'p99 latency grew from %.3fs to %.3fs.' % (baseline.p99, staging.p99)
+
+    return True, '%.1f rps (baseline %.1f), p99 %.3fs (baseline %.3fs).' % (staging.rps, baseline.rps or 0,
+                                                                           staging.p99, baseline.p99 or 0)
+
+
+def save_result(path, domain, role, result, passed=None, reason=None):
+    """
+    :description: Appends result to results file.
+    :param
+        path: Results file
+        domain: Your Domain
+        role: staging or live
+        result: LoadResult
+        passed: Result of the gate (staging only)
+        reason: Reason of the result
+    :return: None
+    """
+    entry = dict(result._asdict(), time=time.time(), domain=domain, role=role, passed=passed, reason=reason)
+    entry['status_codes'] = dict((str(status), count) for status, count in result.status_codes.items())
+
+    with open(path, 'a') as results_file:
+        results_file.write(json.dumps(entry, sort_keys=True) + '\n')
+
+
+def last_result(path, domain):
+    """
+    :description: Returns the last staging result of the domain which passed the gate (it is live now).
+    :param
+        path: Results file
+        domain: Your Domain
+    :return: dictionary or None
+    """
+    if not os.path.exists(path):
+        return None
+
+    last = None
+    with open(path) as results_file:
+        for line in results_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('domain') == domain and entry.get('role') == 'staging' and entry.get('passed'):
+                last = entry
+
+    return last
@@ -0,0 +1,160 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Deferred logging. install() only puts a placeholder handler on the root logger, so importing the script opens no
+file. The first record which reaches it opens the console and log file handlers and from then on records are passed
+to them: to the console and, as JSON lines, to the log file.
+
+Line of the log file:
+
+    {"level": "WARNING", "logger": "aws_lib", "message": "...", "thread": "MainThread", "time": "2016-...Z"}
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+# Log file. Always in /var/log!!
+LOG_PATH = '/var/log/'
+FILE_NAME = 'blue-green-deploy'
+
+LEVEL = logging.WARN
+CONSOLE_FORMAT = logging.BASIC_FORMAT
+
+_LOCK = threading.Lock()
+
+#####################################################################
+#      Classes and functions
+#####################################################################
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record.
+    """
+    converter = time.gmtime
+
+    def format(self, record):
+        entry = {'time': '%s.%03dZ' % (self.formatTime(record, '%Y-%m-%dT%H:%M:%S'), record.msecs),
+                 'level': record.levelname, 'logger': record.name, 'thread': record.threadName,
+                 'message': record.getMessage()}
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, sort_keys=True)
+
+
+class DeferredHandler(logging.Handler):
+    """
+    Placeholder which opens handlers when the first record reaches it and passes records to them.
+    """
+
+    def __init__(self, path, file, console):
+        logging.Handler.__init__(self)
+        self.path = path
+        self.file = file
+        self.console = console
+        self.targets = None
+
+    def emit(self, record):
+        # Called with handler lock held, so handlers are opened once.
+        if self.targets is None:
+            self.targets = open_handlers(self.path, self.file, self.console)
+
+        for target in self.targets:
+            if record.levelno >= target.level:
+                target.handle(record)
+
+    def flush(self):
+        for target in self.targets or []:
+            target.flush()
+
+    def close_targets(self):
+        """
+        :description: Closes opened handlers. They are opened again by the next record.
+        :return: None
+        """
+        with self.lock:
+            targets, self.targets = self.targets or [], None
+
+        for target in targets:
+            target.close()
+
+    def close(self):
+        self.close_targets()
+        logging.Handler.close(self)
+
+
+def install(path=LOG_PATH, file=FILE_NAME, level=LEVEL):
+    """
+    :description: Puts placeholder handler on the root logger. Nothing is opened until something is logged. Console
+                  handler is added only when logging was not configured yet (like logging.basicConfig).
+    :param
+        path: Directory of the log file
+        file: Name of the log file (without .log)
+        level: Level of the root logger (only when logging was not configured yet)
+    :return: root logger
+    """
+    root_logger = logging.getLogger()
+
+    with _LOCK:
+        if not any(isinstance(handler, DeferredHandler) for handler in root_logger.handlers):
+            console = not root_logger.handlers
+            if console:
+                root_logger.setLevel(level)
+            root_logger.addHandler(DeferredHandler(path, file, console))
+
+    return root_logger
+
+
+def open_handlers(path=LOG_PATH, file=FILE_NAME, console=True):
+    """
+    :description: Opens console and log file handlers.
+    :param
+        path: Directory of the log file
+        file: Name of the log file (without .log)
+        console: True or False. If True, records are written to the console too.
+    :return: list of handlers
+    """
+    targets = []
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        targets.append(console_handler)
+
+    try:
+        file_handler = logging.FileHandler(os.path.join(path, file + '.log'))
+        file_handler.setFormatter(JsonFormatter())
+        targets.append(file_handler)
+    except OSError as ex:
+        # Missing permissions to /var/log must not stop deployment.
+        sys.stderr.write('Cannot open log file in %s: %s\n' % (path, ex))
+
+    return targets
+
+
+def stop():
+    """
+    :description: Closes handlers opened by placeholder of the root logger (they are flushed on exit anyway).
+    :return: None
+    """
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, DeferredHandler):
+            handler.close_targets()
@@ -0,0 +1,342 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Manifest of many applications released together. Every application has its own blue / green pair and is deployed
+in its regions; applications could depend on other ones (e.g. API before frontend). Manifest is JSON:
+
+    {
+        "max_parallel": 8,
+        "per_region": 2,
+        "defaults": {"aws_access_key": "...", "aws_secret_key": "...", "ssh_key": "deploy"},
+        "apps": [
+            {"name": "api", "region": ["eu-west-1", "us-east-1"], "domain": "api.example.com.",
+             "live_alias": "www.api.example.com.", "image_id": "ami-XXX", "subnet_id": ["subnet-A", "subnet-B"],
+             "sec_group": ["sg-XXX"]},
+            {"name": "frontend", "depends_on": ["api"], "region": "eu-west-1", "domain": "example.com.", ...}
+        ]
+    }
+
+Keys of defaults and apps are the same as destinations of deployment.py arguments (aws_access_key, domain,
+live_alias, image_id, subnet_id, sec_group, instance_size, web_srv_name, count, check_health...). Command line
+values are used for everything manifest doesn't set. Application waits for its dependencies in the same region (or
+for all their regions if the dependency is not deployed in that region).
+
+Instances are tagged with App tag (domain of the application) next to Environment tag (blue / green / old-app) and
+every lookup is scoped to its application, so any number of applications could share AWS account and region.
+Instances without App tag (launched before it existed) are not adopted by any application of the manifest; tag them
+with App=<domain> or run single application deployment once.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import argparse
+import json
+import logging
+
+# Local modules
+import cutover
+import drain
+import inventory
+import load_test
+import orchestrator
+import snapshot
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+OLD_TAG = {'Environment': 'old-app'}
+SHUTDOWN_BEHAVIOR = 'stop'
+
+# Options every application has to have (from manifest or command line).
+REQUIRED = ('aws_access_key', 'aws_secret_key', 'domain', 'live_alias')
+REQUIRED_FOR_DEPLOY = ('ssh_key', 'image_id', 'subnet_id', 'sec_group')
+
+# Plan works with snapshot only (no credentials), refresh doesn't need anything about the deployment.
+REQUIRED_FOR_PLAN = ('domain', 'live_alias')
+REQUIRED_FOR_PLAN_DEPLOY = ('image_id', 'subnet_id')
+REQUIRED_FOR_REFRESH = ('aws_access_key', 'aws_secret_key', 'domain')
+
+# aws_lib function of every action (plan is snapshot.plan).
+FUNCTIONS = {'deploy': 'deployment_stage', 'switch': 'switch', 'roll': 'roll_back', 'refresh': 'refresh_snapshot',
+             'reap': 'reap'}
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def missing_options(action, options):
+    """
+    :description: Returns names of required options which are not set.
+    :param
+        action: deploy, switch, roll, plan, refresh or reap
+        options: argparse.Namespace with options of single application
+    :return: list of names
+    """
+    if action == 'plan':
+        required = REQUIRED_FOR_PLAN + (REQUIRED_FOR_PLAN_DEPLOY if options.plan_action == 'deploy' else ())
+    elif action == 'refresh':
+        required = REQUIRED_FOR_REFRESH
+    else:
+        required = REQUIRED + (REQUIRED_FOR_DEPLOY if action == 'deploy' else ())
+
+    return [name for name in required if getattr(options, name, None) in (None, '', [])]
+
+
+def prepare_action(action, options):
+    """
+    :description: Picks aws_lib (or snapshot) function and its arguments for given action.
+    :param
+        action: deploy, switch, roll, plan, refresh or reap
+        options: argparse.Namespace with options of single application (same names as deployment.py arguments)
+    :return: tuple with function, positional arguments (after region) and keyword arguments
+    """
+    blue_alias = 'blue' + '.' + options.domain
+    green_alias = 'green' + '.' + options.domain
+
+    if action == 'plan':
+        # Plan doesn't touch AWS, so boto isn't even imported.
+        plan_options = {'switch': {'check_health': options.check_health, 'shift_steps': options.shift_steps,
+                                   'verify_propagation': options.verify_propagation},
+                        'roll': {'check_health': options.check_health},
+                        'deploy': {'image_id': options.image_id, 'instance_size': options.instance_size,
+                                   'subnet_id': options.subnet_id, 'srv_name': options.web_srv_name,
+                                   'count': options.count, 'warm_pool_size': options.warm_pool}}
+        return snapshot.plan, \
+            (options.plan_action, options.domain, options.live_alias, blue_alias, green_alias, OLD_TAG), \
+            dict(plan_options[options.plan_action], directory=options.snapshot_dir)
+
+    import aws_lib
+
+    args, kwargs = action_arguments(action, options)
+
+    return getattr(aws_lib, FUNCTIONS[action]), args, build_kwargs(kwargs)
+
+
+def action_arguments(action, options):
+    """
+    :description: Arguments of aws_lib function of given action as plain values, so they could be sent to daemon as
+                  JSON. Drain provider and cutover backend are given by their settings (see build_kwargs). Neither
+                  aws_lib nor boto is imported.
+    :param
+        action: deploy, switch, roll, refresh or reap
+        options: argparse.Namespace with options of single application (same names as deployment.py arguments)
+    :return: tuple with positional arguments (after region) and keyword arguments
+    """
+    blue_alias = 'blue' + '.' + options.domain
+    green_alias = 'green' + '.' + options.domain
+
+    if action == 'refresh':
+        return (options.aws_access_key, options.aws_secret_key, options.domain), {'directory': options.snapshot_dir}
+
+    health_options = {'port': options.health_port, 'path': options.health_path,
+                      'success_window': options.health_window, 'max_p99': options.health_max_p99,
+                      'max_error_rate': options.health_max_error_rate}
+
+    cutover_options = {'cutover_kind': options.cutover, 'elastic_ips': options.elastic_ips,
+                       'load_balancer': options.load_balancer}
+
+    load_options = None
+    if options.load_test:
+        load_options = {'mix': load_test.parse_mix(options.load_mix), 'rps': options.load_rps,
+                        'duration': options.load_duration, 'concurrency': options.load_concurrency,
+                        'port': options.health_port, 'compare_live': options.load_compare_live,
+                        'results_file': options.load_results, 'max_rps_drop': options.load_max_rps_drop,
+                        'max_p99_increase': options.load_max_p99_increase,
+                        'max_error_rate': options.load_max_error_rate}
+
+    warm_up_options = None
+    if options.warm_up_log:
+        warm_up_options = {'access_log': options.warm_up_log, 'sample_size': options.warm_up_sample,
+                           'rps': options.warm_up_rps, 'round_seconds': options.warm_up_round,
+                           'tolerance': options.warm_up_tolerance, 'timeout': options.warm_up_timeout,
+                           'port': options.health_port}
+
+    if action == 'reap':
+        # By default one old fleet of the expected size is kept for roll back.
+        return (options.aws_access_key, options.aws_secret_key, OLD_TAG, options.domain, options.live_alias), \
+            dict(cutover_options, keep=options.count if options.reap_keep is None else options.reap_keep,
+                 orphans=options.reap_orphans, dry_run=options.dry_run)
+    elif action == 'switch':
+        return (options.aws_access_key, options.aws_secret_key, OLD_TAG, options.domain, options.live_alias,
+                blue_alias, green_alias), \
+            dict(cutover_options, dry_run=False, check_health=options.check_health, health_options=health_options,
+                 drain_agent_port=options.drain_agent_port, drain_agent_path=options.drain_agent_path,
+                 drain_timeout=options.drain_timeout, drain_min_wait=options.drain_min_wait,
+                 shift_steps=options.shift_steps, shift_wait=options.shift_wait,
+                 verify_propagation=options.verify_propagation, propagation_timeout=options.propagation_timeout,
+                 load_options=load_options, warm_up_options=warm_up_options)
+    elif action == 'roll':
+        return (options.aws_access_key, options.aws_secret_key, OLD_TAG, options.domain, options.live_alias,
+                blue_alias, green_alias), \
+            dict(cutover_options, dry_run=False, check_health=options.check_health, health_options=health_options,
+                 resume=options.resume)
+    elif action == 'deploy':
+        return (options.aws_access_key, options.aws_secret_key, options.web_srv_name, options.domain,
+                options.live_alias, blue_alias, green_alias, OLD_TAG, options.image_id, options.ssh_key,
+                options.sec_group, options.subnet_id, options.instance_size, SHUTDOWN_BEHAVIOR, options.dry_run,
+                options.count), \
+            dict(cutover_options, warm_pool_size=options.warm_pool, resume=options.resume,
+                 check_preflight=options.check_preflight, hedge_delay=options.hedge_delay,
+                 subnet_order=options.subnet_order, latency_file=options.latency_file)
+
+    raise ValueError('Unknown action %s' % action)
+
+
+def build_kwargs(kwargs):
+    """
+    :description: Turns plain keyword arguments (see action_arguments) into arguments of aws_lib functions: drain
+                  agent settings into drain provider, cutover settings into cutover backend.
+    :param
+        kwargs: Dictionary
+    :return: Dictionary
+    """
+    kwargs = dict(kwargs)
+
+    if kwargs.get('drain_agent_port') is not None:
+        kwargs['drain_provider'] = drain.AgentMetricsProvider(kwargs.pop('drain_agent_port'),
+                                                              kwargs.pop('drain_agent_path', drain.AGENT_PATH))
+    else:
+        kwargs.pop('drain_agent_port', None)
+        kwargs.pop('drain_agent_path', None)
+
+    if 'cutover_kind' in kwargs:
+        kwargs['cutover'] = cutover.from_options(kwargs.pop('cutover_kind'), kwargs.pop('elastic_ips', None),
+                                                 kwargs.pop('load_balancer', None))
+
+    return kwargs
+
+
+def check_dependencies(apps):
+    """
+    :description: Checks that application names are unique, dependencies exist and there is no cycle.
+    :param
+        apps: list of applications from manifest
+    :return: None (raises ValueError)
+    """
+    names = [app.get('name') for app in apps]
+    if None in names or len(set(names)) != len(names):
+        raise ValueError('Every application in manifest needs unique name.')
+
+    depends_on = dict((app['name'], list(app.get('depends_on', []))) for app in apps)
+    for name, dependencies in depends_on.items():
+        unknown = [dependency for dependency in dependencies if dependency not in depends_on]
+        if unknown:
+            raise ValueError('%s depends on unknown application(s) %s.' % (name, unknown))
+
+    # Depth first search, every application is visited once.
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError('Dependency cycle: %s' % ' -> '.join(path + [name]))
+
+        state[name] = 'visiting'
+        for dependency in depends_on[name]:
+            visit(dependency, path + [name])
+        state[name] = 'done'
+
+    for name in names:
+        visit(name, [])
+
+
+def load(path):
+    """
+    :description: Reads and checks manifest.
+    :param
+        path: Path to manifest file.
+    :return: dictionary
+    """
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if not manifest.get('apps'):
+        raise ValueError('Manifest %s has no apps.' % path)
+
+    check_dependencies(manifest['apps'])
+
+    return manifest
+
+
+def build_tasks(manifest, action, cli_options, cli_regions):
+    """
+    :description: Builds tasks (one per application and region) for orchestrator.run_tasks.
+    :param
+        manifest: Dictionary from load()
+        action: deploy, switch, roll, plan, refresh or reap
+        cli_options: argparse.Namespace from deployment.py (values used when manifest doesn't set them)
+        cli_regions: Regions used for applications without region
+    :return: list of orchestrator.Task
+    """
+    app_regions = {}
+    options = {}
+
+    for app in manifest['apps']:
+        values = dict(vars(cli_options))
+        values.update(manifest.get('defaults', {}))
+        values.update(dict((key, value) for key, value in app.items() if key not in ('name', 'depends_on', 'region')))
+        options[app['name']] = argparse.Namespace(**values)
+
+        regions = app.get('region', cli_regions)
+        app_regions[app['name']] = [regions] if isinstance(regions, str) else list(regions)
+
+        missing = missing_options(action, options[app['name']])
+        if missing:
+            raise ValueError('Application %s has no %s.' % (app['name'], ', '.join(missing)))
+        if not app_regions[app['name']]:
+            raise ValueError('Application %s has no region.' % app['name'])
+
+    check_domains(app_regions, options)
+
+    tasks = []
+    for app in manifest['apps']:
+        function, args, kwargs = prepare_action(action, options[app['name']])
+        if action != 'refresh':
+            # Applications could share account and region, untagged instances don't belong to any of them.
+            kwargs = dict(kwargs, adopt_untagged=False)
+
+        for region in app_regions[app['name']]:
+            depends_on = []
+            for dependency in app.get('depends_on', []):
+                if region in app_regions[dependency]:
+                    depends_on.append(task_name(dependency, region))
+                else:
+                    depends_on.extend(task_name(dependency, other) for other in app_regions[dependency])
+
+            tasks.append(orchestrator.Task(task_name(app['name'], region), region, function, args, kwargs,
+                                           depends_on))
+
+    return tasks
+
+
+def check_domains(app_regions, options):
+    """
+    :description: Checks that no two applications use the same domain in the same region. Domain is their App tag
+                  and blue / green records, they would take over each other's instances.
+    :param
+        app_regions: Dictionary with list of regions by application name
+        options: Dictionary with argparse.Namespace by application name
+    :return: None (raises ValueError)
+    """
+    owners = {}
+    for name in sorted(app_regions):
+        for region in app_regions[name]:
+            key = (region, inventory.app_name(options[name].domain))
+            if key in owners and owners[key] != name:
+                raise ValueError('Applications %s and %s use the same domain %s in %s.'
+                                 % (owners[key], name, options[name].domain, region))
+            owners[key] = name
+
+
+def task_name(app, region):
+    return '%s@%s' % (app, region)
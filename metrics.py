@@ -0,0 +1,330 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Timing of deployment phases and AWS API calls. Every deploy / switch / roll is a run made of named spans
+(connect, delete_old, check_live, launch...). Every boto call made through instrumented connection is counted and
+timed. Finished runs are exported as JSON report and Prometheus textfile.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+PROMETHEUS_PREFIX = 'blue_green'
+MAX_FINISHED = 1000     # long-running daemon keeps only the latest runs
+
+_LOCAL = threading.local()
+_FINISHED = []
+_LOCK = threading.Lock()
+
+#####################################################################
+#      Classes and functions
+#####################################################################
+
+
+class Run(object):
+    """
+    Measurements of single deploy / switch / roll.
+    """
+
+    def __init__(self, action, region):
+        self.action = action
+        self.region = region
+        self.start = time.time()
+        self.duration = None
+        self.status = 'running'
+        self.spans = []
+        self.calls = collections.defaultdict(lambda: {'count': 0, 'errors': 0, 'seconds': 0.0, 'throttled': 0,
+                                                      'retries': 0})
+        self.lock = threading.Lock()
+
+    def add_span(self, name, start, duration, status):
+        self.spans.append({'phase': name, 'start': start, 'seconds': duration, 'status': status})
+
+    def add_call(self, service, operation, duration, failed):
+        with self.lock:
+            stats = self.calls[(service, operation)]
+            stats['count'] += 1
+            stats['errors'] += 1 if failed else 0
+            stats['seconds'] += duration
+
+    def add_retry(self, service, operation, throttled):
+        with self.lock:
+            stats = self.calls[(service, operation)]
+            stats['retries'] += 1
+            stats['throttled'] += 1 if throttled else 0
+
+    def to_dict(self):
+        return {'action': self.action,
+                'region': self.region,
+                'start': self.start,
+                'seconds': self.duration,
+                'status': self.status,
+                'phases': self.spans,
+                'api_calls': [dict(stats, service=service, operation=operation)
+                              for (service, operation), stats in sorted(self.calls.items())]}
+
+
+def current_run():
+    """
+    :description: Returns run of current thread or None.
+    :return: Run
+    """
+    return getattr(_LOCAL, 'run', None)
+
+
+def _status(exc_type, exc_value):
+    if exc_type is None:
+        return 'ok'
+    if exc_type is SystemExit and not exc_value.code:
+        return 'ok'
+
+    return 'failed'
+
+
+@contextlib.contextmanager
+def run(action, region):
+    """
+    :description: Measures whole deploy / switch / roll. Spans and API calls made in this thread belong to it.
+    :param
+        action: deploy, switch or roll
+        region: AWS region
+    :return: Run
+    """
+    previous = current_run()
+    new_run = Run(action, region)
+    _LOCAL.run = new_run
+
+    try:
+        yield new_run
+    except BaseException as ex:
+        new_run.status = _status(type(ex), ex)
+        raise
+    else:
+        new_run.status = 'ok'
+    finally:
+        new_run.duration = time.time() - new_run.start
+        _LOCAL.run = previous
+
+        with _LOCK:
+            _FINISHED.append(new_run)
+            del _FINISHED[:-MAX_FINISHED]
+
+        LOGGER.info('%s in %s took %.1f seconds (%s). Phases: %s' %
+                    (action, region, new_run.duration, new_run.status,
+                     ', '.join('%s %.1fs' % (span['phase'], span['seconds']) for span in new_run.spans)))
+
+
+@contextlib.contextmanager
+def attached(current):
+    """
+    :description: Makes spans and API calls of this (worker) thread belong to given run.
+    :param
+        current: Run (from current_run() of the thread which started the work) or None
+    :return: None
+    """
+    previous = current_run()
+    _LOCAL.run = current
+
+    try:
+        yield current
+    finally:
+        _LOCAL.run = previous
+
+
+def instrumented(action):
+    """
+    :description: Decorator measuring function as a run. First argument of the function has to be region.
+    :param
+        action: deploy, switch or roll
+    :return: decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(region, *args, **kwargs):
+            with run(action, region):
+                return function(region, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def span(name):
+    """
+    :description: Measures single phase of current run.
+    :param
+        name: Name of the phase (connect, delete_old, check_live, launch, wait_for_ip, assign_dns, swap, drain, stop)
+    :return: None
+    """
+    start = time.time()
+    status = 'ok'
+
+    try:
+        yield
+    except BaseException as ex:
+        status = _status(type(ex), ex)
+        raise
+    finally:
+        current = current_run()
+        if current is not None:
+            current.add_span(name, start, time.time() - start, status)
+
+
+class InstrumentedConnection(object):
+    """
+    Proxy of boto connection which counts and times every method call in current run.
+    """
+
+    def __init__(self, connection, service):
+        self._connection = connection
+        self._service = service
+
+    def __getattr__(self, name):
+        attribute = getattr(self._connection, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            start = time.time()
+            failed = True
+            try:
+                result = attribute(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                current = current_run()
+                if current is not None:
+                    current.add_call(self._service, name, time.time() - start, failed)
+
+        return call
+
+
+def instrument(connection, service):
+    """
+    :description: Wraps boto connection so all its calls are measured.
+    :param
+        connection: boto connection
+        service: ec2 or route53
+    :return: InstrumentedConnection
+    """
+    return InstrumentedConnection(connection, service)
+
+
+def finished_runs():
+    """
+    :description: Returns all runs finished in this process.
+    :return: list of Run
+    """
+    with _LOCK:
+        return list(_FINISHED)
+
+
+def _write_atomically(path, content):
+    # Prometheus textfile collector could read half written file otherwise.
+    temporary = '%s.%s.tmp' % (path, os.getpid())
+    with open(temporary, 'w') as output:
+        output.write(content)
+    os.rename(temporary, path)
+
+
+def write_json(path, runs=None):
+    """
+    :description: Writes JSON report of runs.
+    :param
+        path: Output file
+        runs: list of Run (all finished runs by default)
+    :return: None
+    """
+    runs = finished_runs() if runs is None else runs
+    _write_atomically(path, json.dumps({'runs': [one_run.to_dict() for one_run in runs]}, indent=2, sort_keys=True))
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in sorted(labels.items()))
+
+
+def write_prometheus(path, runs=None):
+    """
+    :description: Writes latest runs in Prometheus text exposition format (for node_exporter textfile collector).
+    :param
+        path: Output file (*.prom)
+        runs: list of Run (all finished runs by default)
+    :return: None
+    """
+    runs = finished_runs() if runs is None else runs
+
+    # Only the latest run of every action and region, samples can't repeat.
+    runs = list(collections.OrderedDict(((one_run.action, one_run.region), one_run) for one_run in runs).values())
+
+    metrics = collections.OrderedDict([
+        ('run_seconds', ('gauge', 'Duration of whole deploy / switch / roll.', [])),
+        ('run_success', ('gauge', '1 if run finished successfully, 0 otherwise.', [])),
+        ('phase_seconds', ('gauge', 'Duration of deployment phase.', [])),
+        ('api_calls_total', ('counter', 'Number of AWS API calls.', [])),
+        ('api_errors_total', ('counter', 'Number of failed AWS API calls.', [])),
+        ('api_call_seconds_total', ('counter', 'Time spent in AWS API calls.', [])),
+        ('api_retries_total', ('counter', 'Number of retried AWS API calls.', [])),
+        ('api_throttled_total', ('counter', 'Number of throttled AWS API calls.', [])),
+    ])
+
+    for one_run in runs:
+        labels = {'action': one_run.action, 'region': one_run.region}
+        metrics['run_seconds'][2].append((_labels(**labels), one_run.duration or 0.0))
+        metrics['run_success'][2].append((_labels(**labels), 1 if one_run.status == 'ok' else 0))
+
+        phases = collections.OrderedDict()
+        for one_span in one_run.spans:
+            phases[one_span['phase']] = phases.get(one_span['phase'], 0.0) + one_span['seconds']
+        for phase, seconds in phases.items():
+            metrics['phase_seconds'][2].append((_labels(phase=phase, **labels), seconds))
+
+        for (service, operation), stats in sorted(one_run.calls.items()):
+            call_labels = _labels(service=service, operation=operation, **labels)
+            metrics['api_calls_total'][2].append((call_labels, stats['count']))
+            metrics['api_errors_total'][2].append((call_labels, stats['errors']))
+            metrics['api_call_seconds_total'][2].append((call_labels, stats['seconds']))
+            metrics['api_retries_total'][2].append((call_labels, stats['retries']))
+            metrics['api_throttled_total'][2].append((call_labels, stats['throttled']))
+
+    lines = []
+    for name, (metric_type, description, samples) in metrics.items():
+        full_name = '%s_%s' % (PROMETHEUS_PREFIX, name)
+        lines.append('# HELP %s %s' % (full_name, description))
+        lines.append('# TYPE %s %s' % (full_name, metric_type))
+        lines.extend('%s%s %s' % (full_name, labels, value) for labels, value in samples)
+
+    _write_atomically(path, '\n'.join(lines) + '\n')
+
+
+def export(json_path=None, prometheus_path=None):
+    """
+    :description: Exports all finished runs to given files.
+    :param
+        json_path: JSON report file or None
+        prometheus_path: Prometheus textfile or None
+    :return: None
+    """
+    if json_path:
+        write_json(json_path)
+    if prometheus_path:
+        write_prometheus(prometheus_path)
@@ -0,0 +1,196 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Runs the same deployment step in many regions at the same time on a bounded pool of workers. Tasks of many
+applications (see manifest module) are scheduled with dependencies and global / per-region limits.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import logging
+import threading
+import time
+from concurrent import futures
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+MAX_WORKERS = 4
+
+RegionResult = collections.namedtuple('RegionResult', ['region', 'status', 'result', 'error', 'duration'])
+
+# Task is a function run in single region. It starts when all tasks it depends on (names) finished successfully.
+Task = collections.namedtuple('Task', ['name', 'region', 'function', 'args', 'kwargs', 'depends_on'])
+TaskResult = collections.namedtuple('TaskResult', ['name', 'region', 'status', 'result', 'error', 'duration'])
+
+# Statuses of region pipeline.
+OK = 'ok'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def read_regions_file(path):
+    """
+    :description: Reads regions manifest. One region per line, empty lines and lines starting with # are ignored.
+    :param
+        path: Path to manifest file.
+    :return: list of regions
+    """
+    with open(path) as manifest:
+        lines = [line.split('#', 1)[0].strip() for line in manifest]
+
+    return [line for line in lines if line]
+
+
+def run_in_region(function, region, args=(), kwargs=None):
+    """
+    :description: Runs function for single region and catches everything, including sys.exit() calls of aws_lib.
+    :param
+        function: Function which gets region as first argument.
+        region: AWS region.
+        args: Other positional arguments.
+        kwargs: Keyword arguments.
+    :return: RegionResult
+    """
+    start = time.time()
+
+    try:
+        result = function(region, *args, **(kwargs or {}))
+        return RegionResult(region, OK, result, None, time.time() - start)
+    except SystemExit as ex:
+        # aws_lib still exits on errors (and on successful dry run).
+        status = OK if not ex.code else FAILED
+        return RegionResult(region, status, None, None if status == OK else 'exit code %s' % ex.code,
+                            time.time() - start)
+    except Exception as ex:
+        LOGGER.exception('Deployment in %s failed.' % region)
+        return RegionResult(region, FAILED, None, str(ex), time.time() - start)
+
+
+def run_in_regions(function, regions, args=(), kwargs=None, max_workers=MAX_WORKERS, fail_fast=False):
+    """
+    :description: Runs function in all regions in parallel. At most max_workers regions are processed at once.
+    :param
+        function: Function which gets region as first argument (deployment_stage, switch, roll_back).
+        regions: list of AWS regions.
+        args: Other positional arguments.
+        kwargs: Keyword arguments.
+        max_workers: How many regions are processed at the same time.
+        fail_fast: True or False. If True, regions which were not started yet are skipped after first failure.
+    :return: list of RegionResult (in the same order as regions)
+    """
+    failed = threading.Event()
+
+    def pipeline(region):
+        if fail_fast and failed.is_set():
+            return RegionResult(region, SKIPPED, None, 'skipped after previous failure', 0.0)
+
+        region_result = run_in_region(function, region, args, kwargs)
+        if region_result.status == FAILED:
+            failed.set()
+
+        return region_result
+
+    with futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(regions)))) as executor:
+        results = list(executor.map(pipeline, regions))
+
+    return results
+
+
+def run_tasks(tasks, max_workers=MAX_WORKERS, per_region=None, fail_fast=False):
+    """
+    :description: Runs tasks in parallel as soon as their dependencies are done. Task is skipped when any of its
+                  dependencies didn't finish successfully.
+    :param
+        tasks: list of Task (names have to be unique)
+        max_workers: How many tasks run at the same time.
+        per_region: How many tasks run in one region at the same time (no limit if None).
+        fail_fast: True or False. If True, tasks which were not started yet are skipped after first failure.
+    :return: list of TaskResult (in the same order as tasks)
+    """
+    results = {}
+    pending = list(tasks)
+    running = {}
+    region_load = collections.Counter()
+    failed = False
+
+    def skip(task, reason):
+        results[task.name] = TaskResult(task.name, task.region, SKIPPED, None, reason, 0.0)
+        pending.remove(task)
+
+    with futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while pending or running:
+            progress = False
+
+            for task in list(pending):
+                dependencies = [results.get(name) for name in task.depends_on]
+
+                if fail_fast and failed:
+                    skip(task, 'skipped after previous failure')
+                elif any(result is not None and result.status != OK for result in dependencies):
+                    skip(task, 'dependency %s did not finish' %
+                         ', '.join(result.name for result in dependencies if result and result.status != OK))
+                elif any(result is None for result in dependencies) or len(running) >= max_workers or \
+                        (per_region and region_load[task.region] >= per_region):
+                    continue
+                else:
+                    LOGGER.info('Starting %s' % task.name)
+                    future = executor.submit(run_in_region, task.function, task.region, task.args, task.kwargs)
+                    running[future] = task
+                    region_load[task.region] += 1
+                    pending.remove(task)
+
+                progress = True
+
+            if not running:
+                if not progress:
+                    # Only tasks waiting for something that will never finish are left.
+                    for task in list(pending):
+                        skip(task, 'dependencies %s can not be satisfied' % task.depends_on)
+                continue
+
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                region_load[task.region] -= 1
+                region_result = future.result()
+                results[task.name] = TaskResult(task.name, task.region, region_result.status, region_result.result,
+                                                region_result.error, region_result.duration)
+                failed = failed or region_result.status == FAILED
+                LOGGER.info('%s %s' % (task.name, region_result.status))
+
+    return [results[task.name] for task in tasks]
+
+
+def format_report(results):
+    """
+    :description: Builds combined report for all regions (or tasks).
+    :param
+        results: list of RegionResult or TaskResult
+    :return: string
+    """
+    lines = []
+    labels = [getattr(region_result, 'name', region_result.region) for region_result in results]
+    width = max([16] + [len(label) for label in labels])
+
+    for label, region_result in zip(labels, results):
+        details = region_result.result if region_result.status == OK else region_result.error
+        lines.append('%-*s %-8s %8.1fs  %s' % (width, label, region_result.status, region_result.duration, details))
+
+    summary = collections.Counter(region_result.status for region_result in results)
+    lines.append('%s ok, %s failed, %s skipped' % (summary[OK], summary[FAILED], summary[SKIPPED]))
+
+    return '\n'.join(lines)
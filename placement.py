@@ -0,0 +1,267 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Hedged launch of new fleet in several subnets (availability zones). Fleet is launched in the primary subnet first;
+when it is not running after a short delay, or the launch fails (e.g. InsufficientInstanceCapacity), backup launch
+is started in the next subnet. The first instances which are running are kept and all the other ones are terminated.
+
+Launch latency of every subnet (seconds from RunInstances until instances are running, or the error) is appended to
+the latency file (JSON lines), so subnets could be ordered by their recent latency next time.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import json
+import logging
+import os
+import time
+
+# Local modules
+import health_check
+import inventory
+import lazy
+import waiters
+
+# AWS Boto library (imported on first use)
+exception = lazy.load('boto.exception')
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds after which backup launch is started when previous launch is not running yet.
+HEDGE_DELAY = 45
+
+# Overall time (in seconds) we wait for enough running instances.
+TIMEOUT = waiters.TIMEOUT
+POLL_DELAY = 1
+POLL_MAX_DELAY = 5
+
+ORDERS = ('given', 'fastest')
+
+# Latencies recorded before this many seconds are not used for ordering.
+HISTORY_AGE = 7 * 24 * 3600
+
+LATENCY_FILE = 'launch-latency.jsonl'
+
+# States of instances which will never be running (e.g. terminated because of missing capacity).
+FAILED_STATES = ('shutting-down', 'terminated')
+
+Launch = collections.namedtuple('Launch', ['subnet_id', 'started', 'instance_ids', 'seconds', 'error'])
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def subnet_list(subnet_id):
+    """
+    :description: Returns list of subnets from single subnet ID or list of them.
+    :param
+        subnet_id: Subnet ID or list of subnet IDs
+    :return: list of subnet IDs
+    """
+    if subnet_id is None:
+        return []
+
+    return [subnet_id] if isinstance(subnet_id, str) else list(subnet_id)
+
+
+def region_name(ec2_conn):
+    region = getattr(ec2_conn, 'region', None)
+
+    return getattr(region, 'name', region)
+
+
+def hedged_launch(ec2_conn, subnets, count, launch, hedge_delay=HEDGE_DELAY, timeout=TIMEOUT, sleep=None):
+    """
+    :description: Launches fleet in the first subnet and backup launches in the next ones. Keeps first count
+                  running instances and terminates the rest.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        subnets: List of subnet IDs (primary first)
+        count: Number of instances needed
+        launch: Function which gets subnet ID and number of instances, launches them and returns list of instances
+        hedge_delay: Seconds after which next subnet is tried when instances are not running yet
+        timeout: Seconds we wait for running instances in total
+        sleep: Function used for sleeping (time.sleep by default)
+    :return: tuple with list of kept instances (empty when launch failed in every subnet) and list of Launch (one
+             per tried subnet)
+    """
+    sleep = sleep or time.sleep
+    deadline = time.time() + timeout
+    backups = list(subnets)
+    launches = []
+    subnet_of = {}
+    pending = []
+    ready = []
+    next_launch = time.time()
+    attempt = 0
+
+    while True:
+        if pending:
+            try:
+                described = ec2_conn.get_only_instances(instance_ids=pending)
+            except exception.EC2ResponseError as ex:
+                # Freshly launched instances are not always visible straight away.
+                if ex.error_code != 'InvalidInstanceID.NotFound':
+                    raise
+                described = []
+
+            for instance in described:
+                if waiters.is_running(instance):
+                    pending.remove(instance.id)
+                    ready.append(instance)
+                    launches[:] = [finished(record, instance.id, time.time()) for record in launches]
+                elif instance.state in FAILED_STATES:
+                    LOGGER.warning('%s in %s is %s.' % (instance.id, subnet_of[instance.id], instance.state))
+                    pending.remove(instance.id)
+                    # Nothing to wait for in this subnet any more.
+                    next_launch = time.time()
+
+        if backups and time.time() >= next_launch and len(ready) < count:
+            subnet_id = backups.pop(0)
+            started = time.time()
+            try:
+                instances = launch(subnet_id, count - len(ready))
+            except exception.EC2ResponseError as ex:
+                # Capacity errors are per availability zone, next subnet is tried straight away.
+                LOGGER.warning('Launch in %s failed: %s' % (subnet_id, ex.error_code))
+                launches.append(Launch(subnet_id, started, [], None, ex.error_code or str(ex)))
+                continue
+
+            if launches:
+                LOGGER.info('Backup launch of %s instance(s) in %s.' % (len(instances), subnet_id))
+            launches.append(Launch(subnet_id, started, [instance.id for instance in instances], None, None))
+            subnet_of.update((instance.id, subnet_id) for instance in instances)
+            pending += [instance.id for instance in instances]
+            next_launch = time.time() + hedge_delay
+            attempt = 0
+
+        if len(ready) >= count or time.time() >= deadline or not (pending or backups):
+            break
+
+        # Short polls, running instance has to be noticed before next backup launch is due.
+        delay = waiters.backoff_delay(attempt, POLL_DELAY, POLL_MAX_DELAY)
+        if backups:
+            delay = min(delay, max(next_launch - time.time(), 0))
+        sleep(max(min(delay, deadline - time.time()), 0))
+        attempt += 1
+
+    # Not enough running instances in time - the ones still booting are kept too.
+    kept = ready[:count]
+    kept_ids = [instance.id for instance in kept] + pending[:count - len(kept)]
+    extra_ids = [instance_id for instance_id in subnet_of if instance_id not in kept_ids]
+
+    if extra_ids:
+        LOGGER.info('Terminating extra instances %s.' % extra_ids)
+        try:
+            ec2_conn.terminate_instances(instance_ids=extra_ids)
+        except exception.EC2ResponseError as ex:
+            LOGGER.error('Could not terminate extra instances %s: %s' % (extra_ids, ex))
+
+    inventory.invalidate(ec2_conn)
+    if len(kept) < len(kept_ids):
+        kept += ec2_conn.get_only_instances(instance_ids=kept_ids[len(kept):])
+
+    return kept, [abandoned(record, kept_ids, time.time()) for record in launches]
+
+
+def finished(record, instance_id, now):
+    # Subnet latency is the time until its first instance is running.
+    if instance_id in record.instance_ids and record.seconds is None:
+        return record._replace(seconds=now - record.started)
+
+    return record
+
+
+def abandoned(record, kept_ids, now):
+    # Subnet which didn't deliver anything in time is recorded with the time we waited for it.
+    if record.seconds is None and record.error is None:
+        return record._replace(error='abandoned' if not set(record.instance_ids) & set(kept_ids) else 'timeout',
+                               seconds=now - record.started)
+
+    return record
+
+
+def save_latencies(path, region, instance_size, image_id, launches):
+    """
+    :description: Appends launch latency of every tried subnet to latency file.
+    :param
+        path: Latency file
+        region: AWS region
+        instance_size: String with instance size
+        image_id: Amazon Machine Image ID
+        launches: list of Launch
+    :return: None
+    """
+    with open(path, 'a') as latency_file:
+        for record in launches:
+            latency_file.write(json.dumps({'time': record.started, 'region': region, 'subnet_id': record.subnet_id,
+                                           'instance_type': instance_size, 'image_id': image_id,
+                                           'seconds': record.seconds, 'error': record.error}, sort_keys=True) + '\n')
+
+
+def subnet_latencies(path, region, instance_size, max_age=HISTORY_AGE):
+    """
+    :description: Reads recent launch latencies of subnets.
+    :param
+        path: Latency file
+        region: AWS region
+        instance_size: String with instance size
+        max_age: Seconds after which records are ignored
+    :return: dictionary with list of seconds by subnet ID
+    """
+    latencies = {}
+    if not os.path.exists(path):
+        return latencies
+
+    oldest = time.time() - max_age
+    with open(path) as latency_file:
+        for line in latency_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('region') == region and entry.get('instance_type') == instance_size and \
+                    entry.get('time', 0) >= oldest:
+                # Abandoned launch was at least that slow, failed one counts as timeout.
+                latencies.setdefault(entry.get('subnet_id'), []).append(TIMEOUT if entry.get('seconds') is None
+                                                                        else entry['seconds'])
+
+    return latencies
+
+
+def order_subnets(subnets, region, instance_size, path=LATENCY_FILE, order='given'):
+    """
+    :description: Orders subnets for hedged launch.
+    :param
+        subnets: List of subnet IDs
+        region: AWS region
+        instance_size: String with instance size
+        path: Latency file
+        order: given (as they are) or fastest (by median of recent latencies, unknown subnets keep their place
+               after known ones)
+    :return: list of subnet IDs
+    """
+    if order == 'given' or len(subnets) < 2:
+        return list(subnets)
+
+    latencies = subnet_latencies(path, region, instance_size)
+    medians = dict((subnet_id, health_check.percentile(latencies[subnet_id], 50))
+                   for subnet_id in subnets if latencies.get(subnet_id))
+
+    ordered = sorted(subnets, key=lambda subnet_id: (subnet_id not in medians, medians.get(subnet_id, 0),
+                                                     subnets.index(subnet_id)))
+    LOGGER.info('Subnets by launch latency: %s' % ', '.join('%s (%s)' % (subnet_id, medians.get(subnet_id))
+                                                             for subnet_id in ordered))
+
+    return ordered
@@ -0,0 +1,200 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Pre-flight checks of deployment. AMI, key pair, every subnet, every security group, hosted zone and live alias record
+are checked at the same time before anything is changed, and all problems are reported together - bad parameter
+doesn't terminate rollback target and doesn't show up deep inside instance launch.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import logging
+from concurrent import futures
+
+# Local modules
+import lazy
+import metrics
+import placement
+import route53_cache
+
+# AWS Boto library (imported on first use)
+exception = lazy.load('boto.exception')
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+TIMEOUT = 10                # seconds for all checks together
+MAX_WORKERS = 16
+
+#####################################################################
+#      Checks
+#####################################################################
+
+
+def describe_error(ex):
+    return getattr(ex, 'error_code', None) or getattr(ex, 'reason', None) or str(ex)
+
+
+def check_image(ec2_conn, image_id):
+    """
+    :description: AMI has to exist and be available.
+    :return: tuple with list of problems and the image
+    """
+    images = ec2_conn.get_all_images(image_ids=[image_id])
+    if not images:
+        return ['AMI %s does not exist.' % image_id], None
+
+    state = getattr(images[0], 'state', 'available')
+    if state != 'available':
+        return ['AMI %s is %s, not available.' % (image_id, state)], images[0]
+
+    return [], images[0]
+
+
+def check_key_pair(ec2_conn, ssh_key):
+    """
+    :description: Key pair has to exist in the region.
+    :return: tuple with list of problems and the key pair
+    """
+    key_pairs = ec2_conn.get_all_key_pairs(keynames=[ssh_key])
+    if not key_pairs:
+        return ['Key pair %s does not exist.' % ssh_key], None
+
+    return [], key_pairs[0]
+
+
+def check_subnet(vpc_conn, subnet_id):
+    """
+    :description: Subnet has to exist and be available.
+    :return: tuple with list of problems and the subnet
+    """
+    subnets = vpc_conn.get_all_subnets(subnet_ids=[subnet_id])
+    if not subnets:
+        return ['Subnet %s does not exist.' % subnet_id], None
+
+    state = getattr(subnets[0], 'state', 'available')
+    if state != 'available':
+        return ['Subnet %s is %s, not available.' % (subnet_id, state)], subnets[0]
+
+    return [], subnets[0]
+
+
+def check_security_group(ec2_conn, group_id):
+    """
+    :description: Security group has to exist. Every group is asked separately, so all missing ones are reported.
+    :return: tuple with list of problems and the group
+    """
+    groups = ec2_conn.get_all_security_groups(group_ids=[group_id])
+    if not groups:
+        return ['Security group %s does not exist.' % group_id], None
+
+    return [], groups[0]
+
+
+def check_dns(route53_conn, domain, live_alias, blue_alias, green_alias, cutover=None):
+    """
+    :description: Hosted zone has to exist and live alias has to point to blue or green alias (unless traffic is
+                  moved by cutover backend).
+    :return: tuple with list of problems and live alias target
+    """
+    if route53_cache.get_zone(route53_conn, domain) is None:
+        return ['Hosted zone %s does not exist.' % domain], None
+
+    if cutover is not None:
+        return [], None
+
+    records = route53_cache.for_zone(route53_conn, domain).find(live_alias, 'A')
+    if not records:
+        return ['Live alias %s has no A record in %s.' % (live_alias, domain)], None
+
+    live = max(records, key=lambda record: int(record.weight or 0)).alias_dns_name
+    if live is None or route53_cache.normalize(live) not in (route53_cache.normalize(blue_alias),
+                                                             route53_cache.normalize(green_alias)):
+        return ['Live alias %s points to %s, not to %s or %s.' % (live_alias, live, blue_alias, green_alias)], None
+
+    return [], live
+
+
+def check_cutover(cutover, aws_connection):
+    """
+    :description: Elastic IPs / load balancer of cutover backend have to exist.
+    :return: tuple with list of problems and None
+    """
+    return cutover.check(aws_connection), None
+
+
+def _run_check(current, label, check, args):
+    # API calls made by the check belong to the run which started pre-flight.
+    with metrics.attached(current):
+        try:
+            return check(*args)
+        except exception.BotoServerError as ex:
+            return ['%s: %s' % (label, describe_error(ex))], None
+
+
+def run_checks(aws_connection, domain, live_alias, blue_alias, green_alias, image_id, ssh_key, sec_group, subnet_id,
+               timeout=TIMEOUT, cutover=None):
+    """
+    :description: Runs all checks at the same time.
+    :param
+        aws_connection: Map of AWS connections (ec2, vpc and route53)
+        domain: Your Domain
+        live_alias: Your external DNS record pointing to live web server.
+        blue_alias: Blue Url
+        green_alias: Green Url
+        image_id: Amazon Machine Image ID
+        ssh_key: AWS key pair name
+        sec_group: List of security group IDs
+        subnet_id: Subnet ID or list of them
+        timeout: Seconds we wait for all checks
+        cutover: cutover.Cutover (its Elastic IPs / load balancer are checked too) or None
+    :return: list of problems (empty when everything is fine)
+    """
+    ec2_conn = aws_connection.get('ec2')
+    checks = [('AMI %s' % image_id, check_image, (ec2_conn, image_id)),
+              ('Key pair %s' % ssh_key, check_key_pair, (ec2_conn, ssh_key)),
+              ('Hosted zone %s' % domain, check_dns,
+               (aws_connection.get('route53'), domain, live_alias, blue_alias, green_alias, cutover))]
+    checks += [('Subnet %s' % subnet, check_subnet, (aws_connection.get('vpc'), subnet))
+               for subnet in placement.subnet_list(subnet_id)]
+    checks += [('Security group %s' % group_id, check_security_group, (ec2_conn, group_id)) for group_id in sec_group]
+    if cutover is not None:
+        checks.append((str(cutover), check_cutover, (cutover, aws_connection)))
+
+    executor = futures.ThreadPoolExecutor(max_workers=min(len(checks), MAX_WORKERS))
+    try:
+        submitted = [(executor.submit(_run_check, metrics.current_run(), label, check, args), label, check)
+                     for label, check, args in checks]
+        futures.wait([future for future, _, _ in submitted], timeout)
+    finally:
+        # Checks which didn't answer in time are not waited for.
+        executor.shutdown(wait=False)
+
+    problems = []
+    found = {}
+    for future, label, check in submitted:
+        if not future.done():
+            problems.append('%s: no answer in %s seconds.' % (label, timeout))
+            continue
+
+        check_problems, resource = future.result()
+        problems.extend(check_problems)
+        found.setdefault(check, []).append(resource)
+
+    # Instance can't be launched to subnet with security groups of another VPC.
+    for subnet in found.get(check_subnet, []):
+        for group in found.get(check_security_group, []):
+            if subnet is not None and group is not None and getattr(group, 'vpc_id', None) and \
+                    group.vpc_id != getattr(subnet, 'vpc_id', group.vpc_id):
+                problems.append('Security group %s is in %s, but subnet %s is in %s.' % (group.id, group.vpc_id,
+                                                                                         subnet.id, subnet.vpc_id))
+
+    return problems
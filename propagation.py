@@ -0,0 +1,318 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Waits until Route53 change is really live. First the change status is polled (with backoff) until it is INSYNC, then
+all authoritative nameservers of the zone are asked (raw DNS over UDP, all at the same time) until every one of them
+answers with the new target. Measured latency of both phases is reported.
+
+Nameservers could be given as "host" or "host:port" (e.g. "127.0.0.1:5353" for local DNS stand-in).
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import asyncio
+import collections
+import logging
+import random
+import socket
+import struct
+import time
+
+# Local modules
+import waiters
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+TIMEOUT = 300               # seconds for both phases together
+INSYNC_BASE_DELAY = 2
+INSYNC_MAX_DELAY = 15
+DNS_PORT = 53
+DNS_INTERVAL = 2.0          # seconds between queries to nameserver which still answers with the old target
+DNS_TIMEOUT = 2.0           # seconds we wait for single answer
+
+TYPE_A = 1
+TYPE_CNAME = 5
+CLASS_IN = 1
+
+PropagationResult = collections.namedtuple('PropagationResult',
+                                           ['propagated', 'insync_seconds', 'seconds', 'nameservers'])
+
+#####################################################################
+#      Route53 change status
+#####################################################################
+
+
+def change_status(route53_conn, change_id):
+    """
+    :description: Returns status of Route53 change.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        change_id: ID of the change (from change batch commit)
+    :return: PENDING or INSYNC
+    """
+    return route53_conn.get_change(change_id)['GetChangeResponse']['ChangeInfo']['Status']
+
+
+def wait_for_insync(route53_conn, change_id, timeout=TIMEOUT, base_delay=INSYNC_BASE_DELAY,
+                    max_delay=INSYNC_MAX_DELAY, sleep=None):
+    """
+    :description: Polls change status with jittered exponential backoff until it is INSYNC.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        change_id: ID of the change
+        timeout: How long (in seconds) we wait
+        base_delay: Delay after first check
+        max_delay: Upper limit of the delay between checks
+        sleep: Function used for sleeping (time.sleep by default)
+    :return: seconds it took or None if timeout was reached
+    """
+    sleep = sleep or time.sleep
+    start = time.time()
+    attempt = 0
+
+    while True:
+        if change_status(route53_conn, change_id) == 'INSYNC':
+            return time.time() - start
+
+        elapsed = time.time() - start
+        if elapsed >= timeout:
+            LOGGER.warning('Change %s is not INSYNC after %s seconds.' % (change_id, timeout))
+            return None
+
+        sleep(min(waiters.backoff_delay(attempt, base_delay, max_delay), timeout - elapsed))
+        attempt += 1
+
+
+#####################################################################
+#      DNS over UDP
+#####################################################################
+
+
+def encode_name(name):
+    """
+    :description: Encodes DNS name as sequence of labels.
+    :param
+        name: DNS name
+    :return: bytes
+    """
+    labels = [label for label in name.rstrip('.').split('.') if label]
+
+    return b''.join(struct.pack('B', len(label)) + label.encode('ascii') for label in labels) + b'\x00'
+
+
+def build_query(name, query_id, record_type=TYPE_A):
+    """
+    :description: Builds DNS query. Recursion is not desired - we ask authoritative nameservers.
+    :param
+        name: DNS name
+        query_id: 16 bit ID of the query
+        record_type: Type of record (A by default)
+    :return: bytes
+    """
+    return struct.pack('>HHHHHH', query_id, 0, 1, 0, 0, 0) + encode_name(name) + struct.pack('>HH', record_type,
+                                                                                             CLASS_IN)
+
+
+def read_name(message, offset):
+    """
+    :description: Reads (possibly compressed) DNS name.
+    :param
+        message: Whole DNS message
+        offset: Where the name starts
+    :return: tuple with name and offset right after the name
+    """
+    labels = []
+    end = None
+
+    for _ in range(128):
+        length = message[offset]
+
+        if length & 0xC0 == 0xC0:
+            # Pointer to the name somewhere else in the message.
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack('>H', message[offset:offset + 2])[0] & 0x3FFF
+        elif length == 0:
+            return '.'.join(labels) + '.', end if end is not None else offset + 1
+        else:
+            labels.append(message[offset + 1:offset + 1 + length].decode('ascii'))
+            offset += 1 + length
+
+    raise ValueError('DNS name has too many labels or loops.')
+
+
+def parse_response(message, query_id=None):
+    """
+    :description: Parses DNS response.
+    :param
+        message: DNS message
+        query_id: Expected ID of the query (not checked if None)
+    :return: tuple with response code and list of answers (IPs of A records and names of CNAME records)
+    """
+    response_id, flags, questions, answer_count = struct.unpack('>HHHH', message[:8])
+
+    if query_id is not None and response_id != query_id:
+        raise ValueError('DNS response %s does not match query %s.' % (response_id, query_id))
+
+    offset = 12
+    for _ in range(questions):
+        offset = read_name(message, offset)[1] + 4
+
+    answers = []
+    for _ in range(answer_count):
+        offset = read_name(message, offset)[1]
+        record_type, _, _, length = struct.unpack('>HHIH', message[offset:offset + 10])
+        offset += 10
+
+        if record_type == TYPE_A and length == 4:
+            answers.append(socket.inet_ntoa(message[offset:offset + 4]))
+        elif record_type == TYPE_CNAME:
+            answers.append(read_name(message, offset)[0])
+
+        offset += length
+
+    return flags & 0x0F, answers
+
+
+class _DnsProtocol(asyncio.DatagramProtocol):
+    def __init__(self, query_id, future):
+        self.query_id = query_id
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done() and len(data) >= 2 and struct.unpack('>H', data[:2])[0] == self.query_id:
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+async def query(address, port, name, timeout=DNS_TIMEOUT):
+    """
+    :description: Asks nameserver for A record.
+    :param
+        address: IP address of nameserver
+        port: UDP port of nameserver
+        name: DNS name
+        timeout: Seconds we wait for answer
+    :return: tuple with response code and list of answers
+    """
+    loop = asyncio.get_running_loop()
+    query_id = random.randint(0, 0xFFFF)
+    future = loop.create_future()
+
+    transport, _ = await loop.create_datagram_endpoint(lambda: _DnsProtocol(query_id, future),
+                                                       remote_addr=(address, port))
+    try:
+        transport.sendto(build_query(name, query_id))
+        return parse_response(await asyncio.wait_for(future, timeout), query_id)
+    finally:
+        transport.close()
+
+
+def split_nameserver(nameserver):
+    """
+    :description: Splits "host" or "host:port" into host and port.
+    :param
+        nameserver: Nameserver
+    :return: tuple with host and port
+    """
+    host, _, port = nameserver.rstrip('.').partition(':')
+
+    return host, int(port) if port else DNS_PORT
+
+
+async def watch_nameserver(nameserver, name, expected, timeout, interval, request_timeout):
+    """
+    :description: Asks nameserver again and again until it answers with expected values.
+    :return: seconds it took or None if timeout was reached
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    host, port = split_nameserver(nameserver)
+    answers = None
+
+    try:
+        address = (await loop.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM))[0][4][0]
+    except (OSError, IndexError) as ex:
+        LOGGER.error('Cannot resolve nameserver %s: %s' % (nameserver, ex))
+        return None
+
+    while loop.time() - start < timeout:
+        try:
+            _, answers = await query(address, port, name, min(request_timeout, timeout))
+            if set(answers) == expected:
+                return loop.time() - start
+        except (OSError, ValueError, asyncio.TimeoutError) as ex:
+            LOGGER.debug('No answer from %s: %s' % (nameserver, ex))
+
+        await asyncio.sleep(interval)
+
+    LOGGER.warning('%s still answers %s for %s instead of %s.' % (nameserver, answers, name, sorted(expected)))
+    return None
+
+
+async def watch_nameservers(nameservers, name, expected, timeout, interval, request_timeout):
+    results = await asyncio.gather(*[watch_nameserver(nameserver, name, expected, timeout, interval, request_timeout)
+                                     for nameserver in nameservers])
+
+    return dict(zip(nameservers, results))
+
+
+def check_nameservers(nameservers, name, expected, timeout=TIMEOUT, interval=DNS_INTERVAL,
+                      request_timeout=DNS_TIMEOUT):
+    """
+    :description: Asks all nameservers at the same time until every one answers with expected values.
+    :param
+        nameservers: List of nameservers ("host" or "host:port")
+        name: DNS name
+        expected: List of expected answers (IPs)
+        timeout: How long (in seconds) we wait
+        interval: Seconds between queries to the same nameserver
+        request_timeout: Seconds we wait for single answer
+    :return: dictionary (nameserver -> seconds it took or None)
+    """
+    return asyncio.run(watch_nameservers(nameservers, name, set(expected), timeout, interval, request_timeout))
+
+
+def wait_for_propagation(route53_conn, nameservers, change_id, name, expected, timeout=TIMEOUT, sleep=None):
+    """
+    :description: Waits until change is INSYNC and all authoritative nameservers answer with new values.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        nameservers: List of authoritative nameservers of the zone
+        change_id: ID of the change or None (INSYNC is not checked then)
+        name: DNS name which was changed
+        expected: List of IPs the name should resolve to
+        timeout: How long (in seconds) we wait for both phases
+        sleep: Function used for sleeping (time.sleep by default)
+    :return: PropagationResult
+    """
+    start = time.time()
+    insync_seconds = 0.0
+
+    if change_id is not None:
+        insync_seconds = wait_for_insync(route53_conn, change_id, timeout, sleep=sleep)
+        if insync_seconds is None:
+            return PropagationResult(False, None, time.time() - start, {})
+
+    answered = check_nameservers(nameservers, name, expected, max(1.0, timeout - (time.time() - start)))
+    propagated = all(seconds is not None for seconds in answered.values())
+
+    result = PropagationResult(propagated, insync_seconds, time.time() - start, answered)
+    LOGGER.info('%s %s after %.1f seconds (INSYNC after %.1f). Nameservers: %s' %
+                (name, 'propagated' if propagated else 'did not propagate', result.seconds, insync_seconds,
+                 ', '.join('%s %s' % (nameserver, 'timeout' if seconds is None else '%.1fs' % seconds)
+                           for nameserver, seconds in sorted(answered.items()))))
+
+    return result
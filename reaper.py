@@ -0,0 +1,205 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Reaper of stale instances. Every switch leaves stopped old-app fleet behind and deploy terminates it only when there
+is exactly one fleet of expected size, so failed or interrupted runs pile them up (they keep their EBS volumes and
+slow down every describe call). Reaper keeps the newest instances needed for roll back and terminates all the rest
+with as few terminate calls as possible.
+
+Orphans are stopped blue / green instances (e.g. stop succeeded but retagging to old-app didn't). They are never
+rolled back to, so they are reaped only on request and never when they belong to the live color.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import calendar
+import collections
+import logging
+import time
+
+# Local modules
+import inventory
+import lazy
+
+# AWS Boto library (imported on first use)
+exception = lazy.load('boto.exception')
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# TerminateInstances accepts up to 1000 instance IDs.
+BATCH_SIZE = 1000
+
+# How many of the newest old-app instances are kept for roll back by default.
+KEEP = 1
+
+COLORS = ('blue', 'green')
+
+Reaped = collections.namedtuple('Reaped', ['terminated', 'kept', 'failed', 'volume_size'])
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def launched(instance):
+    """
+    :description: Returns launch time of instance in seconds since epoch (0 when it is unknown).
+    :param
+        instance: EC2 instance
+    :return: float
+    """
+    try:
+        return calendar.timegm(time.strptime(instance.launch_time[:19], '%Y-%m-%dT%H:%M:%S'))
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+def find_stale(ec2_conn, old_env, keep=KEEP, orphans=False, live_env=None, app=None):
+    """
+    :description: Picks instances to terminate. Newest stopped old-app instances are kept for roll back.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        old_env: Environment tag value of old fleet (old-app)
+        keep: How many of the newest old-app instances are kept
+        orphans: True or False. If True, stopped blue / green instances of color which is not live are reaped too.
+        live_env: Color which is live now (its instances are never reaped)
+        app: Application (App tag) or None
+    :return: tuple with list of instances to terminate and list of kept ones
+    """
+    stale = sorted(inventory.for_connection(ec2_conn).find(old_env, ['stopped'], app), key=launched, reverse=True)
+    kept, stale = stale[:max(keep, 0)], stale[max(keep, 0):]
+
+    # Without knowing which color is live no orphan is safe to terminate.
+    if orphans and live_env in COLORS:
+        staging_env = [env for env in COLORS if env != live_env][0]
+        stale += inventory.for_connection(ec2_conn).find(staging_env, ['stopped'], app)
+
+    return stale, kept
+
+
+def batches(items, size=BATCH_SIZE):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def volume_size(ec2_conn, instance_ids):
+    """
+    :description: Sums size of EBS volumes which are deleted together with given instances.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        instance_ids: IDs of instances
+    :return: GiB (None when volumes could not be described)
+    """
+    total = 0
+    try:
+        for batch in batches(instance_ids):
+            volumes = ec2_conn.get_all_volumes(filters={'attachment.instance-id': batch,
+                                                        'attachment.delete-on-termination': 'true'})
+            total += sum(int(volume.size or 0) for volume in volumes)
+    except exception.EC2ResponseError as ex:
+        LOGGER.warn('Cannot describe volumes of reaped instances: %s' % ex)
+        return None
+
+    return total
+
+
+def terminate(ec2_conn, instance_ids, batch_size=BATCH_SIZE):
+    """
+    :description: Terminates instances with one call per batch. Failed batch doesn't stop the other ones.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        instance_ids: IDs of instances
+        batch_size: Instance IDs per call
+    :return: tuple with list of terminated IDs and list of IDs which were not terminated
+    """
+    terminated = []
+    failed = []
+
+    for batch in batches(instance_ids, batch_size):
+        try:
+            done = [instance.id for instance in ec2_conn.terminate_instances(instance_ids=batch)]
+            terminated += done
+            failed += [instance_id for instance_id in batch if instance_id not in done]
+        except exception.EC2ResponseError as ex:
+            LOGGER.error('Cannot terminate %s instances (%s...): %s' % (len(batch), batch[0], ex))
+            failed += batch
+
+    if instance_ids:
+        inventory.invalidate(ec2_conn)
+
+    return terminated, failed
+
+
+def reap(ec2_conn, old_env, keep=KEEP, orphans=False, live_env=None, dry_run=False, app=None):
+    """
+    :description: Terminates stale instances.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        old_env: Environment tag value of old fleet (old-app)
+        keep: How many of the newest old-app instances are kept for roll back
+        orphans: True or False. If True, stopped blue / green instances of color which is not live are reaped too.
+        live_env: Color which is live now
+        dry_run: True or False. If True, nothing is terminated.
+        app: Application (App tag) or None
+    :return: Reaped
+    """
+    stale, kept = find_stale(ec2_conn, old_env, keep, orphans, live_env, app)
+    stale_ids = [instance.id for instance in stale]
+
+    LOGGER.info('Keeping %s for roll back.' % [instance.id for instance in kept])
+    if not stale:
+        return Reaped([], kept, [], 0)
+
+    # Volumes are gone after termination, so they are summed before.
+    size = volume_size(ec2_conn, stale_ids)
+
+    if dry_run:
+        LOGGER.info('Would terminate %s.' % stale_ids)
+        return Reaped(stale, kept, [], size)
+
+    LOGGER.info('Terminating %s.' % stale_ids)
+    terminated, failed = terminate(ec2_conn, stale_ids)
+
+    return Reaped([instance for instance in stale if instance.id in terminated], kept,
+                  [instance for instance in stale if instance.id in failed], size)
+
+
+def describe(instances):
+    """
+    :description: Short description of instances, e.g. "12 instances (10 x t2.micro, 2 x m4.large)".
+    :param
+        instances: list of EC2 instances
+    :return: string
+    """
+    types = collections.Counter(instance.instance_type for instance in instances)
+    if not types:
+        return 'no instance'
+
+    return '%s instances (%s)' % (len(instances), ', '.join('%s x %s' % (count, instance_type)
+                                                  for instance_type, count in sorted(types.items())))
+
+
+def report(reaped, dry_run=False):
+    """
+    :description: Summary of reaped instances.
+    :param
+        reaped: Reaped
+        dry_run: True or False
+    :return: string
+    """
+    summary = '%s %s' % ('would terminate' if dry_run else 'terminated', describe(reaped.terminated))
+    if reaped.volume_size:
+        summary += ' with %s GiB of EBS volumes' % reaped.volume_size
+    summary += ', kept %s for roll back' % describe(reaped.kept)
+    if reaped.failed:
+        summary += ', failed to terminate %s' % ', '.join(instance.id for instance in reaped.failed)
+
+    return summary
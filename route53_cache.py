@@ -0,0 +1,186 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Cache of Route53 hosted zones and their record sets. Zone is looked up once per connection (so once per run),
+record sets are listed once and listed again only after we committed a change.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import logging
+import threading
+import weakref
+
+# Local modules
+import lazy
+
+# AWS Boto library (imported on first use)
+route53 = lazy.load('boto.route53')
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+_CACHES = weakref.WeakKeyDictionary()
+_LOCK = threading.Lock()
+
+#####################################################################
+#      Classes and functions
+#####################################################################
+
+
+def normalize(name):
+    """
+    :description: Route53 returns lower case names with trailing dot. We do the same with ours.
+    :param
+        name: DNS name
+    :return: normalized name
+    """
+    name = name.lower()
+
+    return name if name.endswith('.') else name + '.'
+
+
+class ZoneCache(object):
+    """
+    Hosted zone handle with its record sets indexed by (name, type).
+    """
+
+    def __init__(self, route53_conn, domain):
+        self.route53_conn = route53_conn
+        self.domain = domain
+        self.zone = route53_conn.get_zone(domain)
+        self.records = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        :description: Lists all record sets of the zone and builds index.
+        :return: None
+        """
+        records = {}
+        for record in self.route53_conn.get_all_rrsets(self.zone.id):
+            records.setdefault((normalize(record.name), record.type), []).append(record)
+
+        self.records = records
+
+    def find(self, name, record_type='A'):
+        """
+        :description: Returns all record sets with given name and type (more than one for weighted records).
+        :param
+            name: DNS name
+            record_type: A, CNAME...
+        :return: list of records
+        """
+        with self.lock:
+            if self.records is None:
+                self.load()
+
+            return list(self.records.get((normalize(name), record_type), []))
+
+    def all(self):
+        """
+        :description: Returns all record sets of the zone.
+        :return: list of records
+        """
+        with self.lock:
+            if self.records is None:
+                self.load()
+
+            return [record for records in self.records.values() for record in records]
+
+    def invalidate(self):
+        """
+        :description: Drops record sets. They will be listed again on next lookup.
+        :return: None
+        """
+        with self.lock:
+            self.records = None
+
+
+def for_zone(route53_conn, domain):
+    """
+    :description: Returns cached zone of given connection.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+    :return: ZoneCache
+    """
+    with _LOCK:
+        zones = _CACHES.setdefault(route53_conn, {})
+        if normalize(domain) not in zones:
+            zones[normalize(domain)] = ZoneCache(route53_conn, domain)
+
+        return zones[normalize(domain)]
+
+
+def get_zone(route53_conn, domain):
+    """
+    :description: Returns hosted zone handle. AWS is asked only once per connection.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+    :return: zone
+    """
+    return for_zone(route53_conn, domain).zone
+
+
+def get_a(route53_conn, domain, name):
+    """
+    :description: Returns A record with given name from cached record sets.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+        name: DNS name
+    :return: record or None
+    """
+    records = for_zone(route53_conn, domain).find(name, 'A')
+
+    return records[0] if records else None
+
+
+def get_nameservers(route53_conn, domain):
+    """
+    :description: Returns authoritative nameservers of the zone from its cached NS record.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+    :return: list of nameservers
+    """
+    zone = for_zone(route53_conn, domain)
+    records = zone.find(zone.zone.name, 'NS')
+
+    return [nameserver for record in records for nameserver in record.resource_records]
+
+
+def new_change_batch(route53_conn, domain):
+    """
+    :description: Creates empty change batch for the zone. All changes added to it are committed atomically.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+    :return: ResourceRecordSets
+    """
+    return route53.record.ResourceRecordSets(connection=route53_conn, hosted_zone_id=get_zone(route53_conn, domain).id)
+
+
+def commit(route53_conn, domain, records):
+    """
+    :description: Commits change batch and drops cached record sets as they are outdated now.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+        records: Change batch
+    :return: Result of the change (AWS respond).
+    """
+    try:
+        return records.commit()
+    finally:
+        for_zone(route53_conn, domain).invalidate()
@@ -0,0 +1,313 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Saved snapshot of EC2 instances (the ones with Environment tag) and Route53 records of a zone, and plans computed
+from it. Refresh takes one describe and one record list call; plan doesn't call AWS at all, so planning many
+applications is instant. Plan follows the same decisions deploy / switch / roll make.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import json
+import logging
+import os
+import sys
+import time
+
+# Local modules
+import inventory
+import placement
+import route53_cache
+import warm_pool
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# Snapshots are written next to parameters files unless configured otherwise.
+SNAPSHOT_DIR = '.'
+
+#####################################################################
+#      Snapshot
+#####################################################################
+
+
+def snapshot_path(region, domain, directory=None):
+    """
+    :description: Returns path of the snapshot of given region and domain.
+    :param
+        region: AWS region
+        domain: Your Domain
+        directory: Directory with snapshots (SNAPSHOT_DIR by default)
+    :return: path
+    """
+    return os.path.join(directory or SNAPSHOT_DIR, 'snapshot-%s-%s.json' % (region, route53_cache.normalize(domain)
+                                                                             .rstrip('.')))
+
+
+def describe_instance(instance):
+    return {'id': instance.id,
+            'state': instance.state,
+            'tags': dict(instance.tags),
+            'ip_address': instance.ip_address,
+            'image_id': instance.image_id,
+            'instance_type': instance.instance_type,
+            'subnet_id': instance.subnet_id}
+
+
+def describe_record(record):
+    return {'name': route53_cache.normalize(record.name),
+            'type': record.type,
+            'ttl': record.ttl,
+            'values': list(record.resource_records or []),
+            'alias': record.alias_dns_name,
+            'identifier': record.identifier,
+            'weight': record.weight}
+
+
+def save(path, region, domain, zone_id, instances, records):
+    """
+    :description: Writes snapshot (atomically, plan could read it at the same time).
+    :param
+        path: Snapshot file
+        region: AWS region
+        domain: Your Domain
+        zone_id: Hosted zone ID
+        instances: EC2 instances
+        records: Route53 record sets of the zone
+    :return: dictionary which was saved
+    """
+    data = {'region': region,
+            'domain': route53_cache.normalize(domain),
+            'zone_id': zone_id,
+            'taken': time.time(),
+            'instances': [describe_instance(instance) for instance in instances],
+            'records': [describe_record(record) for record in records]}
+
+    temporary = '%s.%s.tmp' % (path, os.getpid())
+    with open(temporary, 'w') as snapshot_file:
+        json.dump(data, snapshot_file, indent=2, sort_keys=True)
+    os.rename(temporary, path)
+
+    return data
+
+
+def load(path):
+    """
+    :description: Reads snapshot.
+    :param
+        path: Snapshot file
+    :return: dictionary
+    """
+    with open(path) as snapshot_file:
+        return json.load(snapshot_file)
+
+
+def find_instances(snapshot, env, states):
+    # Only instances of the application (App tag) the snapshot was taken for. Instances without App tag are
+    # counted in when plan adopts them (see inventory.adopt_untagged).
+    app = inventory.app_name(snapshot['domain'])
+
+    return [instance for instance in snapshot['instances']
+            if instance['tags'].get(inventory.APP_TAG_KEY, snapshot.get('untagged_app')) == app and
+            instance['tags'].get(inventory.TAG_KEY) == env and instance['state'] in states]
+
+
+def find_records(snapshot, name, record_type='A'):
+    return [record for record in snapshot['records']
+            if record['name'] == route53_cache.normalize(name) and record['type'] == record_type]
+
+
+def which_is_live(snapshot, live_alias):
+    """
+    :description: Same as aws_lib.check_which_is_live, but from snapshot.
+    :return: alias target with the biggest weight or None
+    """
+    records = find_records(snapshot, live_alias)
+    if not records:
+        return None
+
+    return max(records, key=lambda record: int(record['weight'] or 0))['alias']
+
+
+def ids(instances):
+    return ', '.join(instance['id'] for instance in instances) or 'none'
+
+
+def ips(instances):
+    return ', '.join(str(instance['ip_address']) for instance in instances) or 'none'
+
+
+#####################################################################
+#      Plans
+#####################################################################
+
+
+def plan_deploy(snapshot, domain, live_alias, blue_alias, green_alias, tag, image_id, instance_size, subnet_id,
+                srv_name, count=1, warm_pool_size=0):
+    """
+    :description: Ordered changes deployment_stage would make.
+    :return: list of steps (strings)
+    """
+    steps = []
+    old_env = ''.join(tag.values())
+
+    old = find_instances(snapshot, old_env, ['stopped'])
+    if len(old) == count:
+        steps.append('terminate %s fleet: %s' % (old_env, ids(old)))
+    else:
+        steps.append('keep %s fleet (found %s stopped instances, expected %s): %s' % (old_env, len(old), count,
+                                                                                      ids(old)))
+
+    live = which_is_live(snapshot, live_alias)
+    env = 'green' if live == route53_cache.normalize(blue_alias) else 'blue'
+    steps.append('%s is live (%s), new fleet is %s' % (live_alias, live, env))
+
+    running = find_instances(snapshot, env, ['running', 'pending'])
+    if running:
+        steps.append('BLOCKED: %s instances are already running (%s). Nothing would be launched.' % (env, ids(running)))
+        return steps
+
+    subnets = placement.subnet_list(subnet_id)
+    taken = []
+    if warm_pool_size > 0:
+        taken = [instance for instance in find_instances(snapshot, warm_pool.TAG_VALUE, ['stopped'])
+                 if (instance['image_id'], instance['instance_type']) == (image_id, instance_size) and
+                 instance['subnet_id'] in subnets][:count]
+        steps.append('start %s instance(s) from warm pool: %s' % (len(taken), ids(taken)))
+
+    if count > len(taken):
+        steps.append('launch %s x %s from %s in %s' % (count - len(taken), instance_size, image_id, subnets[0]))
+        if len(subnets) > 1:
+            steps.append('backup launches in %s if not running in time, extra instances terminated'
+                         % ', '.join(subnets[1:]))
+
+    steps.append('tag %s new instance(s) with Name=%s, Environment=%s, App=%s' % (count, srv_name, env,
+                                                                                inventory.app_name(domain)))
+    steps.append('wait for public IPs')
+    steps.append('UPSERT A %s -> public IPs of new fleet (now %s)' %
+                 (env + '.' + route53_cache.normalize(domain),
+                  ', '.join(sum([record['values'] for record in find_records(snapshot, env + '.' + domain)], []))
+                  or 'no record yet'))
+
+    if warm_pool_size > 0:
+        steps.append('refill warm pool to %s instance(s) in the background' % warm_pool_size)
+
+    return steps
+
+
+def plan_switch(snapshot, domain, live_alias, blue_alias, green_alias, tag, check_health=True, shift_steps=None,
+                verify_propagation=True):
+    """
+    :description: Ordered changes switch would make.
+    :return: list of steps (strings)
+    """
+    steps = []
+
+    live = which_is_live(snapshot, live_alias)
+    future_live = route53_cache.normalize(green_alias if live == route53_cache.normalize(blue_alias) else blue_alias)
+    old_env = live.replace('.' + route53_cache.normalize(domain), '') if live else None
+    staging = find_records(snapshot, future_live)
+
+    steps.append('%s is live (%s), %s goes live' % (live_alias, live, future_live))
+    if not staging:
+        steps.append('BLOCKED: %s has no record. Deploy first.' % future_live)
+        return steps
+
+    if check_health:
+        steps.append('health check %s nodes: %s' % (future_live, ', '.join(staging[0]['values'])))
+
+    if shift_steps:
+        for percent in shift_steps:
+            if percent >= 100:
+                break
+            steps.append('weighted %s: %s%% %s, %s%% %s, then gate' % (live_alias, 100 - percent, live, percent,
+                                                                       future_live))
+    steps.append('UPSERT A %s -> alias %s' % (live_alias, future_live))
+
+    if verify_propagation:
+        steps.append('wait for INSYNC and authoritative nameservers')
+
+    old = find_instances(snapshot, old_env, ['running'])
+    steps.append('drain %s fleet: %s' % (old_env, ids(old)))
+    steps.append('stop %s fleet and tag it Environment=%s' % (old_env, ''.join(tag.values())))
+
+    return steps
+
+
+def plan_roll(snapshot, domain, live_alias, blue_alias, green_alias, tag, check_health=True):
+    """
+    :description: Ordered changes roll_back would make.
+    :return: list of steps (strings)
+    """
+    steps = []
+    old_env = ''.join(tag.values())
+
+    old = find_instances(snapshot, old_env, ['stopped', 'running'])
+    if not old:
+        steps.append('BLOCKED: no instance with tag %s. No chance to roll back.' % old_env)
+        return steps
+
+    live = which_is_live(snapshot, live_alias)
+    env = live.replace('.' + route53_cache.normalize(domain), '') if live else None
+    staging_alias = route53_cache.normalize(blue_alias if live == route53_cache.normalize(green_alias)
+                                            else green_alias)
+
+    steps.append('%s is live (%s)' % (live_alias, live))
+    steps.append('start %s fleet and tag it Environment=%s: %s' % (old_env, 'blue' if env == 'green' else 'green',
+                                                                   ids(old)))
+    steps.append('wait for public IPs (were %s)' % ips(old))
+    if check_health:
+        steps.append('health check started instances')
+    steps.append('UPSERT A %s -> their public IPs and %s -> alias %s (one batch)' % (staging_alias, live_alias,
+                                                                                     staging_alias))
+    steps.append('stop %s fleet and tag it Environment=%s: %s' % (env, old_env,
+                                                                  ids(find_instances(snapshot, env, ['running']))))
+
+    return steps
+
+
+def plan(region, plan_action, domain, live_alias, blue_alias, green_alias, tag, directory=None, adopt_untagged=True,
+         **options):
+    """
+    :description: Builds plan of deploy / switch / roll from saved snapshot. No AWS call is made.
+    :param
+        region: AWS region
+        plan_action: deploy, switch or roll
+        domain: Your Domain
+        live_alias: Your external DNS record pointing to live web server.
+        blue_alias: Blue Url
+        green_alias: Green Url
+        tag: Dictionary with <tag_name> <tag_value> pair of old fleet
+        directory: Directory with snapshots (SNAPSHOT_DIR by default)
+        adopt_untagged: True or False. If True, instances without App tag are planned as instances of this
+                        application, the same way aws_lib treats them.
+        options: Other arguments of plan_deploy / plan_switch / plan_roll
+    :return: string with numbered steps or exits the script when there is no snapshot
+    """
+    path = snapshot_path(region, domain, directory)
+
+    try:
+        snapshot = load(path)
+    except (IOError, ValueError) as ex:
+        LOGGER.error('Cannot read snapshot %s (%s). Run refresh first.' % (path, ex))
+        sys.exit(1)
+
+    if adopt_untagged:
+        snapshot['untagged_app'] = inventory.app_name(domain)
+
+    planners = {'deploy': plan_deploy, 'switch': plan_switch, 'roll': plan_roll}
+    steps = planners[plan_action](snapshot, domain, live_alias, blue_alias, green_alias, tag, **options)
+
+    header = '%s of %s in %s, snapshot from %s (%s instances, %s records):' % (
+        plan_action, domain, region, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['taken'])),
+        len(snapshot['instances']), len(snapshot['records']))
+
+    return '\n'.join([header] + ['  %s. %s' % (number, step) for number, step in enumerate(steps, 1)])
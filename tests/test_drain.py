@@ -0,0 +1,153 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Drain of the old color with fake metrics provider and virtual clock (nothing really sleeps).
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import drain
+
+#####################################################################
+#      Fakes
+#####################################################################
+
+Instance = collections.namedtuple('Instance', ['id'])
+
+INSTANCES = [Instance('i-00000001'), Instance('i-00000002')]
+
+
+class Clock(object):
+    """
+    Virtual clock. Sleeping only moves the time.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeProvider(drain.MetricsProvider):
+    """
+    Answers with given connection counts, one per check. The last one is repeated.
+    """
+
+    def __init__(self, *counts):
+        self.counts = list(counts)
+        self.checks = []
+
+    def active_connections(self, instances):
+        self.checks.append(drain.time.time())
+        count = self.counts[min(len(self.checks), len(self.counts)) - 1]
+
+        return dict((instance.id, count) for instance in instances)
+
+
+#####################################################################
+#      Tests
+#####################################################################
+
+
+class DrainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(drain, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_quiet_checks_end_drain_early(self):
+        provider = FakeProvider(3, 1, 0, 0, 5)
+
+        result = drain.drain(INSTANCES, provider, timeout=300, interval=10, quiet_checks=2)
+
+        self.assertTrue(result.drained)
+        self.assertEqual(30, result.elapsed)
+        self.assertEqual({'i-00000001': 0, 'i-00000002': 0}, result.connections)
+        self.assertEqual(4, len(provider.checks))
+
+    def test_activity_resets_quiet_checks(self):
+        provider = FakeProvider(0, 2, 0, 0)
+
+        result = drain.drain(INSTANCES, provider, timeout=300, interval=10, quiet_checks=2)
+
+        self.assertTrue(result.drained)
+        self.assertEqual(30, result.elapsed)
+
+    def test_unknown_activity_counts_as_active(self):
+        result = drain.drain(INSTANCES, FakeProvider(None), timeout=60, interval=10)
+
+        self.assertFalse(result.drained)
+
+    def test_timeout(self):
+        provider = FakeProvider(4)
+
+        result = drain.drain(INSTANCES, provider, timeout=35, interval=10)
+
+        self.assertFalse(result.drained)
+        self.assertEqual(35, result.elapsed)
+        self.assertEqual([10, 10, 10, 5], self.clock.sleeps)
+        self.assertEqual({'i-00000001': 4, 'i-00000002': 4}, result.connections)
+
+    def test_min_wait_keeps_drained_instances(self):
+        provider = FakeProvider(0)
+
+        result = drain.drain(INSTANCES, provider, timeout=300, interval=10, quiet_checks=2, min_wait=60)
+
+        self.assertTrue(result.drained)
+        self.assertEqual(60, result.elapsed)
+
+    def test_min_wait_raises_timeout(self):
+        result = drain.drain(INSTANCES, FakeProvider(1), timeout=30, interval=10, min_wait=60)
+
+        self.assertFalse(result.drained)
+        self.assertEqual(60, result.elapsed)
+
+    def test_without_provider_waits_timeout(self):
+        result = drain.drain(INSTANCES, None, timeout=120)
+
+        self.assertFalse(result.drained)
+        self.assertEqual([120], self.clock.sleeps)
+
+    def test_without_provider_waits_min_wait(self):
+        result = drain.drain(INSTANCES, None, timeout=120, min_wait=300)
+
+        self.assertFalse(result.drained)
+        self.assertEqual([300], self.clock.sleeps)
+
+    def test_nothing_to_drain(self):
+        result = drain.drain([], FakeProvider(1), timeout=120)
+
+        self.assertTrue(result.drained)
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_custom_sleep(self):
+        slept = []
+
+        drain.drain(INSTANCES, None, timeout=15, sleep=slept.append)
+
+        self.assertEqual([15], slept)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Health check against local HTTP stand-in (http.server on localhost).
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import http.server
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import health_check
+
+#####################################################################
+#      Local web server
+#####################################################################
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        time.sleep(self.server.delay)
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def start_server(status=200, delay=0.0):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.status = status
+    server.delay = delay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+#####################################################################
+#      Tests
+#####################################################################
+
+
+class CheckNodesTest(unittest.TestCase):
+    OPTIONS = {'success_window': 3, 'max_failures': 2, 'interval': 0.05, 'request_timeout': 1.0, 'timeout': 5}
+
+    def check(self, server, nodes=('127.0.0.1',), **options):
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        return health_check.check_nodes(list(nodes), port=server.server_address[1],
+                                        **dict(self.OPTIONS, **options))
+
+    def test_healthy_nodes_pass(self):
+        report = self.check(start_server(200))
+
+        self.assertTrue(report.passed, report.reason)
+        self.assertEqual({200: 3}, report.status_codes)
+        self.assertIsNotNone(report.p99)
+
+    def test_repeated_node_is_probed_once(self):
+        report = self.check(start_server(200), nodes=['127.0.0.1', '127.0.0.1'])
+
+        self.assertTrue(report.passed, report.reason)
+        self.assertEqual(['127.0.0.1'], list(report.nodes))
+
+    def test_failing_node_fails_fast(self):
+        started = time.time()
+        report = self.check(start_server(500))
+
+        self.assertFalse(report.passed)
+        self.assertIn('failed 2 checks in a row', report.reason)
+        self.assertEqual({500: 2}, report.status_codes)
+        self.assertLess(time.time() - started, self.OPTIONS['timeout'])
+
+    def test_slow_node_times_out(self):
+        report = self.check(start_server(200, delay=0.3), success_window=100, max_failures=100, timeout=0.5)
+
+        self.assertFalse(report.passed)
+        self.assertIn('timed out', report.reason)
+
+    def test_latency_gate(self):
+        report = self.check(start_server(200, delay=0.05), max_p99=0.001)
+
+        self.assertFalse(report.passed)
+        self.assertIn('p99 latency', report.reason)
+
+
+if __name__ == '__main__':
+    unittest.main()
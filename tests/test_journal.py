@@ -0,0 +1,196 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Journal of deploy steps and resume of unfinished deploy against local stand-in of EC2 and Route53
+(benchmarks/fake_aws.py).
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_aws
+
+fake_aws.install()
+
+import journal
+import logs
+
+# Log file of aws_lib goes to temporary directory, not to /var/log.
+LOG_DIR = tempfile.mkdtemp(prefix='blue-green-test-logs-')
+logs.LOG_PATH = LOG_DIR
+
+import aws_lib
+import history
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+REGION = 'eu-west-1'
+DOMAIN = 'example.com.'
+LIVE_ALIAS = 'www.' + DOMAIN
+BLUE_ALIAS = 'blue.' + DOMAIN
+GREEN_ALIAS = 'green.' + DOMAIN
+OLD_TAG = {'Environment': 'old-app'}
+
+
+def tearDownModule():
+    logs.stop()
+    shutil.rmtree(LOG_DIR)
+
+
+#####################################################################
+#      Tests
+#####################################################################
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='blue-green-journal-')
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_resume_loads_steps_of_unfinished_run(self):
+        first = journal.open_run('deploy', REGION, directory=self.directory, app='example.com')
+        first.record('delete_old')
+        first.record('launch', instance_ids=['i-00000001'])
+
+        resumed = journal.open_run('deploy', REGION, resume=True, directory=self.directory, app='example.com')
+
+        self.assertEqual(first.run_id, resumed.run_id)
+        self.assertEqual({}, resumed.get('delete_old'))
+        self.assertEqual({'instance_ids': ['i-00000001']}, resumed.get('launch'))
+        self.assertIsNone(resumed.get('assign_dns'))
+
+    def test_finished_run_is_not_resumed(self):
+        first = journal.open_run('deploy', REGION, directory=self.directory)
+        first.record('launch', instance_ids=['i-00000001'])
+        first.finish()
+
+        resumed = journal.open_run('deploy', REGION, resume=True, directory=self.directory)
+
+        self.assertNotEqual(first.run_id, resumed.run_id)
+        self.assertIsNone(resumed.get('launch'))
+
+    def test_only_the_last_run_is_read(self):
+        journal.open_run('deploy', REGION, directory=self.directory).record('launch', instance_ids=['i-1'])
+        with mock.patch.object(journal.time, 'time', return_value=journal.time.time() + 1):
+            last = journal.open_run('deploy', REGION, directory=self.directory)
+            last.record('delete_old')
+
+        run_id, steps = journal.read_last_run(journal.journal_path('deploy', REGION, self.directory))
+
+        self.assertEqual(last.run_id, run_id)
+        self.assertEqual({'delete_old': {}}, steps)
+
+    def test_broken_last_line_is_skipped(self):
+        run = journal.open_run('deploy', REGION, directory=self.directory)
+        run.record('delete_old')
+        with open(run.path, 'a') as journal_file:
+            journal_file.write('{"run": "%s", "step": "lau' % run.run_id)
+
+        self.assertEqual({'delete_old': {}}, journal.read_last_run(run.path)[1])
+
+    def test_applications_have_separate_journals(self):
+        journal.open_run('deploy', REGION, directory=self.directory, app='api.example.com').record('delete_old')
+
+        resumed = journal.open_run('deploy', REGION, resume=True, directory=self.directory, app='example.com')
+
+        self.assertIsNone(resumed.get('delete_old'))
+
+    def test_dry_run_writes_nothing(self):
+        run = journal.open_run('deploy', REGION, enabled=False, directory=self.directory)
+        run.record('delete_old')
+
+        self.assertEqual([], os.listdir(self.directory))
+
+
+class ResumeDeployTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='blue-green-resume-')
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        # Parameters file, journal and launch latencies are written to current directory.
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, cwd)
+
+        patcher = mock.patch.object(history, 'HISTORY_FILE', '')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.clock = fake_aws.VirtualClock()
+        self.world = fake_aws.World(self.clock)
+        self.world.add_zone(DOMAIN)
+        blue = self.world.add_instances(REGION, 2, {'Name': 'Web Server', 'Environment': 'blue', 'App': 'example.com'})
+        self.world.add_record(DOMAIN, BLUE_ALIAS, values=[instance.ip_address or '10.255.0.1' for instance in blue])
+        self.world.add_record(DOMAIN, LIVE_ALIAS, alias=BLUE_ALIAS)
+        self.world.add_instances(REGION, 2, {'Name': 'Web Server', 'Environment': 'old-app', 'App': 'example.com'},
+                                 state='stopped')
+        fake_aws.use(self.world)
+
+        self.clock.patch()
+        self.addCleanup(self.clock.unpatch)
+
+    def deploy(self, resume=False):
+        return aws_lib.deployment_stage(REGION, 'AKIATEST', 'secret', srv_name='Web Server', domain=DOMAIN,
+                                        live_url=LIVE_ALIAS, blue_alias=BLUE_ALIAS, green_alias=GREEN_ALIAS,
+                                        tag=OLD_TAG, image_id='ami-00000001', ssh_key='test',
+                                        sec_group=['sg-00000000'], subnet_id='subnet-00000000',
+                                        instance_size='t2.micro', shutdown='stop', count=2, resume=resume)
+
+    def test_resume_skips_done_steps(self):
+        with mock.patch.object(aws_lib, 'assign_to_staging', side_effect=RuntimeError('Route53 is down')):
+            with self.assertRaises(RuntimeError):
+                self.deploy()
+
+        run_id, steps = journal.read_last_run(journal.journal_path('deploy', REGION, app='example.com'))
+        self.assertEqual(['delete_old', 'launch', 'wait_for_ip'], sorted(steps))
+        launched = steps['launch']['instance_ids']
+
+        self.world.calls.clear()
+        result = self.deploy(resume=True)
+
+        # Old fleet was deleted and new one launched by the first run.
+        self.assertEqual(0, self.world.calls['ec2']['RunInstances'])
+        self.assertEqual(0, self.world.calls['ec2']['TerminateInstances'])
+        self.assertEqual(1, self.world.calls['route53']['ChangeResourceRecordSets'])
+
+        ips = sorted(self.world.instances[REGION][instance_id].ip_address for instance_id in launched)
+        self.assertEqual(ips, sorted(self.world.resolve(GREEN_ALIAS)))
+        self.assertEqual('green.%s: %s' % (DOMAIN, ', '.join(steps['wait_for_ip']['ips'])), result)
+
+        resumed_run, steps = journal.read_last_run(journal.journal_path('deploy', REGION, app='example.com'))
+        self.assertEqual(run_id, resumed_run)
+        self.assertIn(journal.FINISHED, steps)
+
+    def test_start_of_run_records_application(self):
+        with mock.patch.object(aws_lib, 'assign_to_staging', side_effect=RuntimeError('Route53 is down')):
+            with self.assertRaises(RuntimeError):
+                self.deploy()
+
+        with open(journal.journal_path('deploy', REGION, app='example.com')) as journal_file:
+            starts = [entry for entry in map(json.loads, journal_file) if entry['step'] == journal.START]
+
+        self.assertEqual(1, len(starts))
+        self.assertEqual('example.com', starts[0]['data']['app'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Manifest checks and tasks built from it. Plan action is used, so nothing needs AWS.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import argparse
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import manifest
+import snapshot
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+# Command line values used for everything manifest doesn't set (the ones plan needs).
+CLI_OPTIONS = {'plan_action': 'deploy', 'check_health': True, 'shift_steps': None, 'verify_propagation': True,
+               'image_id': 'ami-00000001', 'instance_size': 't2.micro', 'subnet_id': ['subnet-00000000'],
+               'web_srv_name': 'Web Server', 'count': 1, 'warm_pool': 0, 'snapshot_dir': None, 'domain': None,
+               'live_alias': None}
+
+
+def app(name, domain, region=None, depends_on=None):
+    values = {'name': name, 'domain': domain, 'live_alias': 'www.' + domain}
+    if region is not None:
+        values['region'] = region
+    if depends_on is not None:
+        values['depends_on'] = depends_on
+
+    return values
+
+
+def build(apps, cli_regions=('eu-west-1',), **cli_options):
+    return manifest.build_tasks({'apps': apps}, 'plan', argparse.Namespace(**dict(CLI_OPTIONS, **cli_options)),
+                                list(cli_regions))
+
+
+#####################################################################
+#      Tests
+#####################################################################
+
+
+class CheckDependenciesTest(unittest.TestCase):
+
+    def test_valid_dependencies(self):
+        manifest.check_dependencies([app('api', 'api.example.com.'),
+                                     app('frontend', 'example.com.', depends_on=['api']),
+                                     app('admin', 'admin.example.com.', depends_on=['api', 'frontend'])])
+
+    def test_names_have_to_be_unique(self):
+        with self.assertRaisesRegex(ValueError, 'unique'):
+            manifest.check_dependencies([app('api', 'api.example.com.'), app('api', 'example.com.')])
+
+    def test_unknown_dependency(self):
+        with self.assertRaisesRegex(ValueError, 'unknown'):
+            manifest.check_dependencies([app('frontend', 'example.com.', depends_on=['api'])])
+
+    def test_cycle(self):
+        with self.assertRaisesRegex(ValueError, 'cycle: .*api -> frontend -> admin -> api'):
+            manifest.check_dependencies([app('api', 'api.example.com.', depends_on=['frontend']),
+                                         app('frontend', 'example.com.', depends_on=['admin']),
+                                         app('admin', 'admin.example.com.', depends_on=['api'])])
+
+
+class BuildTasksTest(unittest.TestCase):
+
+    def test_task_per_application_and_region(self):
+        tasks = build([app('api', 'api.example.com.', region=['eu-west-1', 'us-east-1']),
+                       app('frontend', 'example.com.')])
+
+        self.assertEqual([('api@eu-west-1', 'eu-west-1'), ('api@us-east-1', 'us-east-1'),
+                          ('frontend@eu-west-1', 'eu-west-1')], [(task.name, task.region) for task in tasks])
+        self.assertTrue(all(task.function is snapshot.plan for task in tasks))
+        self.assertEqual(('deploy', 'example.com.', 'www.example.com.'), tasks[2].args[:3])
+
+    def test_dependency_in_the_same_region(self):
+        tasks = build([app('api', 'api.example.com.', region=['eu-west-1', 'us-east-1']),
+                       app('frontend', 'example.com.', region=['eu-west-1', 'us-east-1'], depends_on=['api'])])
+
+        depends_on = dict((task.name, task.depends_on) for task in tasks)
+        self.assertEqual(['api@eu-west-1'], depends_on['frontend@eu-west-1'])
+        self.assertEqual(['api@us-east-1'], depends_on['frontend@us-east-1'])
+
+    def test_dependency_in_other_regions(self):
+        tasks = build([app('api', 'api.example.com.', region=['eu-west-1', 'us-east-1']),
+                       app('frontend', 'example.com.', region='ap-south-1', depends_on=['api'])])
+
+        self.assertEqual(['api@eu-west-1', 'api@us-east-1'], tasks[-1].depends_on)
+
+    def test_untagged_instances_are_not_adopted(self):
+        tasks = build([app('api', 'api.example.com.'), app('frontend', 'example.com.')])
+
+        self.assertTrue(all(task.kwargs['adopt_untagged'] is False for task in tasks))
+
+    def test_missing_option(self):
+        with self.assertRaisesRegex(ValueError, 'frontend has no image_id'):
+            build([app('frontend', 'example.com.')], image_id=None)
+
+    def test_missing_region(self):
+        with self.assertRaisesRegex(ValueError, 'frontend has no region'):
+            build([app('frontend', 'example.com.')], cli_regions=())
+
+    def test_same_domain_in_the_same_region(self):
+        with self.assertRaisesRegex(ValueError, 'same domain'):
+            build([app('api', 'example.com.'), app('frontend', 'Example.com')])
+
+    def test_same_domain_in_other_regions(self):
+        tasks = build([app('api', 'example.com.', region='eu-west-1'),
+                       app('frontend', 'example.com.', region='us-east-1')])
+
+        self.assertEqual(2, len(tasks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Scheduling of tasks (dependencies, skipping and per-region limit) with plain functions instead of deployments.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orchestrator
+
+#####################################################################
+#      Fake deployment steps
+#####################################################################
+
+
+class Recorder(object):
+    """
+    Records order in which tasks started and finished and how many of them ran in one region at once.
+    """
+
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.events = []
+        self.running = {}
+        self.most_running = {}
+        self.lock = threading.Lock()
+
+    def step(self, region, name, fail=False):
+        with self.lock:
+            self.events.append(('start', name))
+            self.running[region] = self.running.get(region, 0) + 1
+            self.most_running[region] = max(self.most_running.get(region, 0), self.running[region])
+
+        time.sleep(self.seconds)
+
+        with self.lock:
+            self.running[region] -= 1
+            self.events.append(('finish', name))
+
+        if fail:
+            raise RuntimeError('%s failed' % name)
+
+        return name
+
+    def task(self, name, region, depends_on=(), fail=False):
+        return orchestrator.Task(name, region, self.step, (name,), {'fail': fail}, list(depends_on))
+
+
+#####################################################################
+#      Tests
+#####################################################################
+
+
+class RunTasksTest(unittest.TestCase):
+
+    def test_task_starts_after_its_dependencies(self):
+        recorder = Recorder()
+        tasks = [recorder.task('frontend@eu', 'eu', ['api@eu', 'api@us']),
+                 recorder.task('api@eu', 'eu'),
+                 recorder.task('api@us', 'us')]
+
+        results = orchestrator.run_tasks(tasks, max_workers=4)
+
+        self.assertEqual(['frontend@eu', 'api@eu', 'api@us'], [result.name for result in results])
+        self.assertEqual([orchestrator.OK] * 3, [result.status for result in results])
+        started = recorder.events.index(('start', 'frontend@eu'))
+        self.assertLess(recorder.events.index(('finish', 'api@eu')), started)
+        self.assertLess(recorder.events.index(('finish', 'api@us')), started)
+
+    def test_independent_tasks_run_at_the_same_time(self):
+        recorder = Recorder(seconds=0.2)
+        tasks = [recorder.task('api@eu', 'eu'), recorder.task('frontend@eu', 'eu')]
+
+        orchestrator.run_tasks(tasks, max_workers=4)
+
+        self.assertEqual(2, recorder.most_running['eu'])
+
+    def test_failed_dependency_skips_dependants(self):
+        recorder = Recorder()
+        tasks = [recorder.task('api@eu', 'eu', fail=True),
+                 recorder.task('frontend@eu', 'eu', ['api@eu']),
+                 recorder.task('admin@eu', 'eu', ['frontend@eu']),
+                 recorder.task('api@us', 'us')]
+
+        results = dict((result.name, result) for result in orchestrator.run_tasks(tasks, max_workers=4))
+
+        self.assertEqual(orchestrator.FAILED, results['api@eu'].status)
+        self.assertEqual(orchestrator.SKIPPED, results['frontend@eu'].status)
+        self.assertIn('api@eu', results['frontend@eu'].error)
+        self.assertEqual(orchestrator.SKIPPED, results['admin@eu'].status)
+        self.assertEqual(orchestrator.OK, results['api@us'].status)
+        self.assertNotIn(('start', 'frontend@eu'), recorder.events)
+        self.assertNotIn(('start', 'admin@eu'), recorder.events)
+
+    def test_fail_fast_skips_tasks_not_started(self):
+        recorder = Recorder()
+        tasks = [recorder.task('api@eu', 'eu', fail=True), recorder.task('api@us', 'us', ['api@eu'])]
+
+        results = orchestrator.run_tasks(tasks, max_workers=1, fail_fast=True)
+
+        self.assertEqual([orchestrator.FAILED, orchestrator.SKIPPED], [result.status for result in results])
+
+    def test_unknown_dependency_is_skipped(self):
+        recorder = Recorder()
+
+        results = orchestrator.run_tasks([recorder.task('frontend@eu', 'eu', ['missing@eu'])])
+
+        self.assertEqual(orchestrator.SKIPPED, results[0].status)
+        self.assertEqual([], recorder.events)
+
+    def test_per_region_limit(self):
+        recorder = Recorder()
+        tasks = [recorder.task('app%s@eu' % number, 'eu') for number in range(4)] + \
+                [recorder.task('app%s@us' % number, 'us') for number in range(4)]
+
+        results = orchestrator.run_tasks(tasks, max_workers=8, per_region=2)
+
+        self.assertTrue(all(result.status == orchestrator.OK for result in results))
+        self.assertEqual({'eu': 2, 'us': 2}, recorder.most_running)
+
+    def test_max_workers_limit(self):
+        recorder = Recorder()
+        tasks = [recorder.task('app%s@eu' % number, 'eu') for number in range(4)]
+
+        orchestrator.run_tasks(tasks, max_workers=1)
+
+        self.assertEqual({'eu': 1}, recorder.most_running)
+
+
+if __name__ == '__main__':
+    unittest.main()
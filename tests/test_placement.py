@@ -0,0 +1,138 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Hedged launch in several subnets against local stand-in of EC2 (benchmarks/fake_aws.py).
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_aws
+
+fake_aws.install()
+
+import placement
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+REGION = 'eu-west-1'
+SUBNETS = ['subnet-0000000a', 'subnet-0000000b', 'subnet-0000000c']
+HEDGE_DELAY = 45
+
+#####################################################################
+#      Tests
+#####################################################################
+
+
+class HedgedLaunchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = fake_aws.VirtualClock()
+        self.world = fake_aws.World(self.clock, boot_seconds=40)
+        self.ec2_conn = fake_aws.EC2Connection(self.world, REGION)
+        self.started = {}
+
+        # hedged_launch reads time.time, the clock has to be the virtual one.
+        self.clock.patch()
+        self.addCleanup(self.clock.unpatch)
+
+    def launch(self, subnet_id, count):
+        self.started[subnet_id] = self.clock.time()
+
+        return self.ec2_conn.run_instances('ami-00000001', min_count=count, max_count=count,
+                                           subnet_id=subnet_id).instances
+
+    def hedged_launch(self, count=2, timeout=600):
+        self.start = self.clock.time()
+
+        return placement.hedged_launch(self.ec2_conn, SUBNETS, count, self.launch, hedge_delay=HEDGE_DELAY,
+                                       timeout=timeout, sleep=self.clock.sleep)
+
+    def states(self, subnet_id):
+        return sorted(instance.state for instance in self.world.instances[REGION].values()
+                      if instance.subnet_id == subnet_id)
+
+    def test_fast_primary_subnet_needs_no_backup(self):
+        kept, launches = self.hedged_launch()
+
+        self.assertEqual([SUBNETS[0]], list(self.started))
+        self.assertEqual([SUBNETS[0]] * 2, [instance.subnet_id for instance in kept])
+        self.assertEqual(0, self.world.calls['ec2']['TerminateInstances'])
+        self.assertEqual(1, len(launches))
+        self.assertIsNone(launches[0].error)
+
+    def test_backup_launch_starts_after_hedge_delay(self):
+        self.world.subnet_boot_seconds[SUBNETS[0]] = 300
+
+        kept, launches = self.hedged_launch()
+
+        self.assertEqual(SUBNETS[:2], list(self.started))
+        self.assertGreaterEqual(self.started[SUBNETS[1]] - self.start, HEDGE_DELAY)
+        self.assertLess(self.started[SUBNETS[1]] - self.start, HEDGE_DELAY + placement.POLL_MAX_DELAY)
+
+        # Backup was running first, slow instances of primary subnet are terminated.
+        self.assertEqual([SUBNETS[1]] * 2, [instance.subnet_id for instance in kept])
+        self.assertEqual(['terminated', 'terminated'], self.states(SUBNETS[0]))
+        self.assertEqual(['running', 'running'], self.states(SUBNETS[1]))
+        self.assertEqual('abandoned', launches[0].error)
+        self.assertIsNone(launches[1].error)
+
+    def test_failed_launch_moves_to_next_subnet_straight_away(self):
+        self.world.no_capacity.add(SUBNETS[0])
+
+        kept, launches = self.hedged_launch()
+
+        self.assertLess(self.started[SUBNETS[1]] - self.start, 1)
+        self.assertEqual([SUBNETS[1]] * 2, [instance.subnet_id for instance in kept])
+        self.assertEqual('InsufficientInstanceCapacity', launches[0].error)
+        self.assertEqual(0, self.world.calls['ec2']['TerminateInstances'])
+
+    def test_booting_instances_are_kept_after_timeout(self):
+        for subnet_id in SUBNETS:
+            self.world.subnet_boot_seconds[subnet_id] = 1000
+
+        kept, launches = self.hedged_launch(timeout=120)
+
+        # Every subnet was tried, the first launched instances are kept and backups terminated.
+        self.assertEqual(SUBNETS, list(self.started))
+        self.assertEqual([SUBNETS[0]] * 2, [instance.subnet_id for instance in kept])
+        self.assertEqual(['terminated'] * 4, self.states(SUBNETS[1]) + self.states(SUBNETS[2]))
+        self.assertEqual(['timeout', 'abandoned', 'abandoned'], [record.error for record in launches])
+
+
+class OrderSubnetsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='blue-green-placement-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'launch-latency.jsonl')
+
+    def test_fastest_subnet_goes_first(self):
+        now = placement.time.time()
+        placement.save_latencies(self.path, REGION, 't2.micro', 'ami-00000001', [
+            placement.Launch(SUBNETS[0], now, [], 120.0, 'abandoned'),
+            placement.Launch(SUBNETS[1], now, ['i-00000001'], 40.0, None),
+            placement.Launch(SUBNETS[0], now, [], None, 'InsufficientInstanceCapacity')])
+
+        self.assertEqual([SUBNETS[1], SUBNETS[0], SUBNETS[2]],
+                         placement.order_subnets(SUBNETS, REGION, 't2.micro', self.path, 'fastest'))
+        self.assertEqual(SUBNETS, placement.order_subnets(SUBNETS, REGION, 't2.micro', self.path, 'given'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Propagation checks against local DNS stand-in (benchmarks/fake_dns.py) and fake Route53 change status.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_dns
+import propagation
+
+#####################################################################
+#      Fakes
+#####################################################################
+
+NAME = 'www.example.com.'
+OLD = ['10.0.0.1', '10.0.0.2']
+NEW = ['10.0.1.1', '10.0.1.2']
+
+
+class Zone(object):
+    """
+    Answers of the nameserver. Old values are served for the first stale_queries queries.
+    """
+
+    def __init__(self, stale_queries=0):
+        self.stale_queries = stale_queries
+        self.queries = 0
+        self.lock = threading.Lock()
+
+    def resolve(self, name):
+        if name != NAME:
+            return None
+
+        with self.lock:
+            self.queries += 1
+            return OLD if self.queries <= self.stale_queries else NEW
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Route53(object):
+    """
+    Change is PENDING for the first pending_checks status checks.
+    """
+
+    def __init__(self, pending_checks):
+        self.pending_checks = pending_checks
+        self.checks = 0
+
+    def get_change(self, change_id):
+        self.checks += 1
+        status = 'PENDING' if self.checks <= self.pending_checks else 'INSYNC'
+
+        return {'GetChangeResponse': {'ChangeInfo': {'Id': change_id, 'Status': status}}}
+
+
+#####################################################################
+#      Tests
+#####################################################################
+
+
+class CheckNameserversTest(unittest.TestCase):
+
+    def start(self, zone):
+        server = fake_dns.start(zone.resolve)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        return '127.0.0.1:%s' % server.port
+
+    def test_propagated_answer(self):
+        nameservers = [self.start(Zone()), self.start(Zone())]
+
+        answered = propagation.check_nameservers(nameservers, NAME, NEW, timeout=5, interval=0.05)
+
+        self.assertEqual(set(nameservers), set(answered))
+        self.assertTrue(all(seconds is not None for seconds in answered.values()))
+
+    def test_stale_answer_is_asked_again(self):
+        zone = Zone(stale_queries=3)
+        nameserver = self.start(zone)
+
+        answered = propagation.check_nameservers([nameserver], NAME, NEW, timeout=5, interval=0.05)
+
+        self.assertIsNotNone(answered[nameserver])
+        self.assertEqual(4, zone.queries)
+
+    def test_timeout(self):
+        fresh, stale = self.start(Zone()), self.start(Zone(stale_queries=1000))
+
+        answered = propagation.check_nameservers([fresh, stale], NAME, NEW, timeout=0.3, interval=0.05)
+
+        self.assertIsNotNone(answered[fresh])
+        self.assertIsNone(answered[stale])
+
+    def test_unknown_name(self):
+        nameserver = self.start(Zone())
+
+        answered = propagation.check_nameservers([nameserver], 'other.example.com.', NEW, timeout=0.2, interval=0.05)
+
+        self.assertIsNone(answered[nameserver])
+
+
+class ParseResponseTest(unittest.TestCase):
+
+    def test_answers(self):
+        query = propagation.build_query(NAME, 4242)
+
+        code, answers = propagation.parse_response(fake_dns.build_response(query, lambda name: NEW), 4242)
+
+        self.assertEqual(0, code)
+        self.assertEqual(NEW, answers)
+
+    def test_nxdomain(self):
+        query = propagation.build_query(NAME, 4242)
+
+        self.assertEqual((3, []), propagation.parse_response(fake_dns.build_response(query, lambda name: None)))
+
+    def test_other_query(self):
+        query = propagation.build_query(NAME, 4242)
+
+        with self.assertRaises(ValueError):
+            propagation.parse_response(fake_dns.build_response(query, lambda name: NEW), 4243)
+
+
+class WaitForInsyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(propagation, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_insync(self):
+        route53_conn = Route53(pending_checks=3)
+
+        seconds = propagation.wait_for_insync(route53_conn, 'C1', timeout=300, sleep=self.clock.sleep)
+
+        self.assertEqual(4, route53_conn.checks)
+        self.assertAlmostEqual(sum(self.clock.sleeps), seconds)
+
+    def test_timeout(self):
+        seconds = propagation.wait_for_insync(Route53(pending_checks=1000), 'C1', timeout=60, sleep=self.clock.sleep)
+
+        self.assertIsNone(seconds)
+        self.assertAlmostEqual(60, sum(self.clock.sleeps))
+
+    def test_propagation_stops_when_change_is_not_insync(self):
+        result = propagation.wait_for_propagation(Route53(pending_checks=1000), ['127.0.0.1:1'], 'C1', NAME, NEW,
+                                                  timeout=30, sleep=self.clock.sleep)
+
+        self.assertFalse(result.propagated)
+        self.assertIsNone(result.insync_seconds)
+        self.assertEqual({}, result.nameservers)
+
+
+class WaitForPropagationTest(unittest.TestCase):
+
+    def test_insync_and_answered(self):
+        server = fake_dns.start(Zone().resolve)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        nameserver = '127.0.0.1:%s' % server.port
+
+        route53_conn = Route53(pending_checks=1)
+
+        result = propagation.wait_for_propagation(route53_conn, [nameserver], 'C1', NAME, NEW, timeout=5,
+                                                  sleep=lambda seconds: None)
+
+        self.assertTrue(result.propagated)
+        self.assertEqual(2, route53_conn.checks)
+        self.assertIsNotNone(result.nameservers[nameserver])
+
+
+if __name__ == '__main__':
+    unittest.main()
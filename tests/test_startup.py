@@ -0,0 +1,195 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Startup and logging budget of the command line:
+
+    - deployment.py --help, wrong --action and --action history don't import boto or requests, --daemon client
+      doesn't import aws_lib either
+    - median time of deployment.py --help over bare interpreter start is within STARTUP_BUDGET
+    - logging a record costs the caller less than LOG_BUDGET and log file is opened with the first record only
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import logs
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+STARTUP_BUDGET = 0.15       # seconds of deployment.py --help over "python -c pass"
+LOG_BUDGET = 50             # microseconds per record on the thread which logs
+RUNS = 5
+RECORDS = 5000
+
+HEAVY = ('boto', 'requests')
+
+# Runs deployment.py in-process and reports heavy libraries it tried to import (installed or not).
+SPY = """
+import json, runpy, sys
+attempts = []
+class Spy(object):
+    def find_spec(self, name, path=None, target=None):
+        if name.split('.')[0] in %r:
+            attempts.append(name)
+        return None
+sys.meta_path.insert(0, Spy())
+sys.argv = ['deployment.py'] + %r
+try:
+    runpy.run_path('deployment.py', run_name='__main__')
+except (SystemExit, OSError):
+    pass
+sys.stderr.write('\\nIMPORTED ' + json.dumps(sorted(set(attempts))) + '\\n')
+"""
+
+#####################################################################
+#      Helpers
+#####################################################################
+
+
+def median_time(command, runs=RUNS):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+
+    return sorted(timings)[len(timings) // 2]
+
+
+#####################################################################
+#      Tests
+#####################################################################
+
+
+class HeavyImportsTest(unittest.TestCase):
+
+    def heavy_imports(self, *arguments, **kwargs):
+        heavy = kwargs.get('heavy', HEAVY)
+        history_dir = tempfile.mkdtemp(prefix='blue-green-startup-')
+        self.addCleanup(shutil.rmtree, history_dir)
+
+        completed = subprocess.run([sys.executable, '-c', SPY % (heavy, list(arguments) + [
+            '--history-file', os.path.join(history_dir, 'history.sqlite3')])],
+            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        for line in completed.stderr.decode('utf-8').splitlines():
+            if line.startswith('IMPORTED '):
+                return json.loads(line[len('IMPORTED '):])
+
+        self.fail('deployment.py %s failed:\n%s' % (' '.join(arguments), completed.stderr.decode('utf-8')))
+
+    def test_help(self):
+        self.assertEqual([], self.heavy_imports('--help'))
+
+    def test_wrong_action(self):
+        self.assertEqual([], self.heavy_imports('--action', 'unknown', '--region', 'eu-west-1'))
+
+    def test_history(self):
+        self.assertEqual([], self.heavy_imports('--action', 'history'))
+
+    def test_daemon_client(self):
+        # Nothing listens on the socket, the client fails after it built the job.
+        socket_path = os.path.join(tempfile.mkdtemp(prefix='blue-green-daemon-'), 'missing.sock')
+        self.addCleanup(shutil.rmtree, os.path.dirname(socket_path))
+
+        self.assertEqual([], self.heavy_imports('--action', 'switch', '--region', 'eu-west-1', '--access-key', 'AKIA',
+                                                '--secret-key', 'secret', '--domain', 'example.com.', '--live-alias',
+                                                'www.example.com.', '--cutover', 'eip', '--elastic-ip', '10.0.0.1',
+                                                '--daemon', socket_path, heavy=HEAVY + ('aws_lib',)))
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_help_within_budget(self):
+        interpreter = median_time([sys.executable, '-c', 'pass'])
+        startup = median_time([sys.executable, 'deployment.py', '--help'])
+
+        self.assertLessEqual(startup - interpreter, STARTUP_BUDGET,
+                             'deployment.py --help %.3fs, interpreter %.3fs' % (startup, interpreter))
+
+
+class LoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp(prefix='blue-green-logs-')
+        root_logger = logging.getLogger()
+        handlers, level = list(root_logger.handlers), root_logger.level
+
+        # Root logger as the script finds it: not configured.
+        for handler in handlers:
+            root_logger.removeHandler(handler)
+
+        def restore():
+            logs.stop()
+            for handler in list(root_logger.handlers):
+                root_logger.removeHandler(handler)
+            for handler in handlers:
+                root_logger.addHandler(handler)
+            root_logger.setLevel(level)
+            shutil.rmtree(self.log_dir)
+
+        self.addCleanup(restore)
+        self.path = os.path.join(self.log_dir, 'deploy.log')
+
+    def read(self):
+        with open(self.path) as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_file_is_opened_with_first_record(self):
+        logs.install(self.log_dir, 'deploy')
+        logging.getLogger('test').info('Not logged, below %s.', logging.getLevelName(logs.LEVEL))
+
+        self.assertFalse(os.path.exists(self.path))
+
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            logging.getLogger('test').exception('Deploy %s failed.', 'blue')
+        logs.stop()
+
+        entry, = self.read()
+        self.assertEqual('ERROR', entry['level'])
+        self.assertEqual('test', entry['logger'])
+        self.assertEqual('Deploy blue failed.', entry['message'])
+        self.assertIn('ValueError: broken', entry['exception'])
+
+    def test_cost_per_record_within_budget(self):
+        # Logging configured by someone else, so nothing goes to the console.
+        logging.getLogger().addHandler(logging.NullHandler())
+        logging.getLogger().setLevel(logging.INFO)
+        logs.install(self.log_dir, 'deploy')
+        logger = logging.getLogger('test')
+
+        timings = []
+        for round_number in range(3):
+            start = time.perf_counter()
+            for number in range(RECORDS):
+                logger.info('Record %s of %s', number, RECORDS)
+            timings.append((time.perf_counter() - start) * 1e6 / RECORDS)
+        logs.stop()
+
+        self.assertEqual(3 * RECORDS, len(self.read()))
+        self.assertLessEqual(sorted(timings)[1], LOG_BUDGET, '%.1fus per record' % sorted(timings)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
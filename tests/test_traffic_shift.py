@@ -0,0 +1,99 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Progressive cutover against local stand-in of Route53 (benchmarks/fake_aws.py).
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_aws
+
+fake_aws.install()
+
+import traffic_shift
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+DOMAIN = 'example.com.'
+LIVE_ALIAS = 'www.' + DOMAIN
+BLUE_ALIAS = 'blue.' + DOMAIN
+GREEN_ALIAS = 'green.' + DOMAIN
+
+#####################################################################
+#      Tests
+#####################################################################
+
+
+class ShiftTrafficTest(unittest.TestCase):
+
+    def setUp(self):
+        self.world = fake_aws.World(fake_aws.VirtualClock())
+        self.world.add_zone(DOMAIN)
+        self.world.add_record(DOMAIN, BLUE_ALIAS, values=['10.0.0.1'])
+        self.world.add_record(DOMAIN, GREEN_ALIAS, values=['10.0.1.1'])
+        self.world.add_record(DOMAIN, LIVE_ALIAS, alias=BLUE_ALIAS)
+        self.route53_conn = fake_aws.Route53Connection(self.world)
+        self.slept = []
+        self.gates = []
+
+    def live_records(self):
+        """
+        :return: sorted list of (identifier, target, weight) of live alias records
+        """
+        return sorted(((record.identifier, record.alias_dns_name, record.weight)
+                       for record in self.world.zones[DOMAIN]['records'] if record.name == LIVE_ALIAS),
+                      key=lambda record: record[0] or '')
+
+    def gate(self, fail_at=None):
+        def check(percent):
+            self.gates.append((percent, self.live_records()))
+            return (False, 'p99 too high') if percent == fail_at else (True, 'ok')
+
+        return check
+
+    def shift(self, gate, steps):
+        return traffic_shift.shift_traffic(self.route53_conn, DOMAIN, LIVE_ALIAS, BLUE_ALIAS, GREEN_ALIAS, 'blue',
+                                           'green', gate, steps, step_wait=30, sleep=self.slept.append)
+
+    def test_weights_are_raised_step_by_step(self):
+        self.assertTrue(self.shift(self.gate(), [10, 50, 100]))
+
+        self.assertEqual([(10, [('blue', BLUE_ALIAS, 90), ('green', GREEN_ALIAS, 10)]),
+                          (50, [('blue', BLUE_ALIAS, 50), ('green', GREEN_ALIAS, 50)])], self.gates)
+        self.assertEqual([30, 30], self.slept)
+        self.assertEqual([(None, GREEN_ALIAS, None)], self.live_records())
+
+    def test_failed_gate_moves_traffic_back(self):
+        self.assertFalse(self.shift(self.gate(fail_at=50), [1, 50, 100]))
+
+        self.assertEqual([1, 50], [percent for percent, _ in self.gates])
+        self.assertEqual([(None, BLUE_ALIAS, None)], self.live_records())
+
+    def test_steps_without_100_end_on_new_color(self):
+        self.assertTrue(self.shift(self.gate(), [25]))
+
+        self.assertEqual([25], [percent for percent, _ in self.gates])
+        self.assertEqual([(None, GREEN_ALIAS, None)], self.live_records())
+
+    def test_one_change_batch_per_step(self):
+        self.shift(self.gate(), [10, 50, 100])
+
+        self.assertEqual(3, self.world.calls['route53']['ChangeResourceRecordSets'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Throttling-aware layer around every EC2 and Route53 call. Calls take a token from the bucket of their service, region
+and account (access key) first, so parallel regions and fleet operations don't run into API rate limits and separate
+accounts don't slow each other down. Throttled and transient errors are retried with jittered exponential backoff and
+the bucket slows down after every throttle (and speeds up again after successful calls). Other errors are raised
+straight away.
+
+Only calls of the connection itself go through the layer. Objects returned by boto (instances, zones) talk to AWS
+over the raw connection, so their methods are never called; everything is done with connection calls instead.
+
+Calls which are not idempotent (RunInstances) get client token which stays the same for all their retries, so retry
+of a launch whose response was lost returns the same instances instead of launching a second fleet.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import functools
+import hashlib
+import logging
+import threading
+import time
+import uuid
+
+# Local modules
+import lazy
+import metrics
+import waiters
+
+# AWS Boto library (imported on first use)
+exception = lazy.load('boto.exception')
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# Requests per second and burst per service. Route53 allows 5 requests per second per account.
+RATES = {'ec2': (20.0, 50), 'route53': (5.0, 5)}
+MIN_RATE = 0.5
+MIN_DELAY = 0.01
+
+# Retries of throttled and transient errors.
+MAX_ATTEMPTS = 6
+BASE_DELAY = 0.5
+MAX_DELAY = 20
+
+THROTTLING_CODES = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'RequestThrottled',
+                    'PriorRequestNotComplete', 'SlowDown', 'TooManyRequestsException')
+TRANSIENT_CODES = ('InternalError', 'InternalFailure', 'ServiceUnavailable', 'Unavailable', 'RequestTimeout')
+
+# Missing capacity comes as server error, but retrying in the same availability zone rarely helps. It is left to
+# hedged launch in another subnet (see placement module).
+CAPACITY_CODES = ('InsufficientInstanceCapacity', 'InsufficientAddressCapacity', 'InsufficientFreeAddressesInSubnet',
+                  'InsufficientCapacity')
+
+# Keyword argument with idempotency token of calls which would otherwise do the work twice when retried.
+CLIENT_TOKENS = {'run_instances': 'client_token'}
+
+# Tags of just created instances could fail before EC2 knows about them (eventual consistency).
+EVENTUALLY_CONSISTENT = {'create_tags': ('InvalidInstanceID.NotFound',)}
+
+_BUCKETS = {}
+_STATS = collections.defaultdict(lambda: {'calls': 0, 'throttled': 0, 'retries': 0, 'failed': 0, 'token_wait': 0.0})
+_LOCK = threading.Lock()
+
+#####################################################################
+#      Classes and functions
+#####################################################################
+
+
+class TokenBucket(object):
+    """
+    Token bucket with adaptive rate. Rate is halved after throttle and grows slowly back after successful calls.
+    """
+
+    def __init__(self, rate, capacity, min_rate=MIN_RATE):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        # Clock could step back (NTP), that mustn't take tokens away.
+        self.tokens = min(self.capacity, self.tokens + max(0, now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, sleep=None):
+        """
+        :description: Takes one token. Sleeps until there is one.
+        :param
+            sleep: Function used for sleeping (time.sleep by default)
+        :return: seconds spent waiting
+        """
+        sleep = sleep or time.sleep
+        waited = 0.0
+
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                # Tiny delays could be lost in clock resolution, so we never sleep less than MIN_DELAY.
+                delay = max(MIN_DELAY, (1 - self.tokens) / self.rate)
+
+            sleep(delay)
+            waited += delay
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+def get_bucket(service, region, account=None):
+    """
+    :description: Returns token bucket shared by all connections to given service and region of given account.
+    :param
+        service: ec2 or route53
+        region: AWS region (Route53 is global)
+        account: AWS Access Key (limits are per account) or None
+    :return: TokenBucket
+    """
+    with _LOCK:
+        if (service, region, account) not in _BUCKETS:
+            rate, capacity = RATES.get(service, RATES['ec2'])
+            _BUCKETS[(service, region, account)] = TokenBucket(rate, capacity)
+
+        return _BUCKETS[(service, region, account)]
+
+
+def classify(error, operation=None):
+    """
+    :description: Tells if AWS error is worth retrying.
+    :param
+        error: Exception raised by boto
+        operation: Name of connection method
+    :return: 'throttled', 'transient' or None
+    """
+    code = getattr(error, 'error_code', None)
+    status = getattr(error, 'status', None)
+
+    if code in THROTTLING_CODES or status == 429:
+        return 'throttled'
+    if code in CAPACITY_CODES:
+        return None
+    if code in TRANSIENT_CODES or (isinstance(status, int) and status >= 500):
+        return 'transient'
+    if code in EVENTUALLY_CONSISTENT.get(operation, ()):
+        return 'transient'
+
+    return None
+
+
+def call(bucket, stats, service, operation, function, args, kwargs, sleep=None):
+    """
+    :description: Calls AWS with token from the bucket. Retries throttled and transient errors.
+    :param
+        bucket: TokenBucket
+        stats: Dictionary with counters of service and region
+        service: ec2 or route53
+        operation: Name of connection method
+        function: Connection method
+        args: Positional arguments
+        kwargs: Keyword arguments
+        sleep: Function used for sleeping (time.sleep by default)
+    :return: Result of the call
+    """
+    sleep = sleep or time.sleep
+
+    token_argument = CLIENT_TOKENS.get(operation)
+    if token_argument and not kwargs.get(token_argument):
+        # One token for all attempts, AWS returns result of the first successful one.
+        kwargs = dict(kwargs)
+        kwargs[token_argument] = uuid.uuid4().hex
+
+    for attempt in range(MAX_ATTEMPTS):
+        waited = bucket.acquire(sleep)
+
+        with _LOCK:
+            stats['calls'] += 1
+            stats['token_wait'] += waited
+
+        try:
+            result = function(*args, **kwargs)
+        except exception.BotoServerError as ex:
+            kind = classify(ex, operation)
+            last_attempt = attempt == MAX_ATTEMPTS - 1
+
+            with _LOCK:
+                stats['throttled'] += 1 if kind == 'throttled' else 0
+                stats['retries'] += 1 if kind and not last_attempt else 0
+                stats['failed'] += 1 if not kind or last_attempt else 0
+
+            if kind == 'throttled':
+                bucket.throttled()
+
+            current = metrics.current_run()
+            if current is not None and kind and not last_attempt:
+                current.add_retry(service, operation, kind == 'throttled')
+
+            if not kind or last_attempt:
+                raise
+
+            delay = waiters.backoff_delay(attempt, BASE_DELAY, MAX_DELAY)
+            LOGGER.warning('%s.%s %s (%s). Retrying in %.1f seconds.' %
+                           (service, operation, kind, getattr(ex, 'error_code', ex), delay))
+            sleep(delay)
+        else:
+            bucket.succeeded()
+            return result
+
+
+class ThrottledConnection(object):
+    """
+    Proxy of boto connection which sends every method call through call().
+    """
+
+    def __init__(self, connection, service, region, account=None):
+        self._connection = connection
+        self._service = service
+        self._bucket = get_bucket(service, region, account)
+        self._stats = _STATS[(service, region, account)]
+
+    def __getattr__(self, name):
+        attribute = getattr(self._connection, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def throttled_call(*args, **kwargs):
+            return call(self._bucket, self._stats, self._service, name, attribute, args, kwargs)
+
+        return throttled_call
+
+
+def wrap(connection, service, region, account=None):
+    """
+    :description: Wraps boto connection so all its calls are rate limited and retried.
+    :param
+        connection: boto connection
+        service: ec2 or route53
+        region: AWS region ('global' for Route53)
+        account: AWS Access Key or None. Connections of different accounts have separate buckets.
+    :return: ThrottledConnection
+    """
+    return ThrottledConnection(connection, service, region, account)
+
+
+def mask(account):
+    """
+    :description: Stands in for access key in reports (e.g. daemon /health), same key always gets the same value.
+    :param
+        account: AWS Access Key or None
+    :return: "account-" and first 8 characters of SHA-256 of the key, or None
+    """
+    if account is None:
+        return None
+
+    return 'account-' + hashlib.sha256(account.encode('utf-8')).hexdigest()[:8]
+
+
+def stats():
+    """
+    :description: Returns counters of calls, throttles, retries and time waiting for tokens per service and region.
+    :return: dictionary ("service/region" or "service/region/account-XXXXXXXX" -> counters, account is masked)
+    """
+    with _LOCK:
+        return dict(('/'.join(part for part in (key[0], key[1], mask(key[2])) if part),
+                     dict(counters, rate=_BUCKETS[key].rate if key in _BUCKETS else None))
+                    for key, counters in _STATS.items())
@@ -0,0 +1,149 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Progressive cutover with Route53 weighted records. Live alias is split into two weighted alias records (one per
+color) and weight of the new color is raised step by step. Gate is checked after every step and traffic goes back
+to the old color as soon as it fails. When the new color got 100% we go back to single alias record.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import logging
+import time
+
+# Local modules
+import route53_cache
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+STEPS = [1, 10, 50, 100]    # percent of traffic on the new color
+STEP_WAIT = 60              # seconds of traffic between step and its gate
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def _add_alias(records, action, live_alias, target, zone_id, identifier=None, weight=None):
+    records.add_change(action=action,
+                       name=live_alias,
+                       type='A',
+                       alias_dns_name=target,
+                       alias_hosted_zone_id=zone_id,
+                       alias_evaluate_target_health=False,
+                       identifier=identifier,
+                       weight=weight)
+
+
+def _delete_record(records, record):
+    # DELETE has to match the existing record exactly.
+    change = records.add_change(action='DELETE',
+                                name=record.name,
+                                type=record.type,
+                                ttl=record.ttl,
+                                alias_dns_name=record.alias_dns_name,
+                                alias_hosted_zone_id=record.alias_hosted_zone_id,
+                                alias_evaluate_target_health=record.alias_evaluate_target_health,
+                                identifier=record.identifier,
+                                weight=record.weight)
+    if not record.alias_dns_name:
+        for value in record.resource_records:
+            change.add_value(value)
+
+
+def set_weights(route53_conn, domain, live_alias, weights):
+    """
+    :description: Replaces live alias with weighted alias records in one atomic change batch.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+        live_alias: Your external DNS record pointing to live web server.
+        weights: list of (identifier, target alias, weight) tuples
+    :return: Result of the change (AWS respond).
+    """
+    zone = route53_cache.get_zone(route53_conn, domain)
+    records = route53_cache.new_change_batch(route53_conn, domain)
+
+    for record in route53_cache.for_zone(route53_conn, domain).find(live_alias, 'A'):
+        if record.identifier is None:
+            # Plain record can't live next to weighted ones.
+            _delete_record(records, record)
+
+    for identifier, target, weight in weights:
+        _add_alias(records, 'UPSERT', live_alias, target, zone.id, identifier, weight)
+
+    return route53_cache.commit(route53_conn, domain, records)
+
+
+def set_single(route53_conn, domain, live_alias, target):
+    """
+    :description: Replaces weighted records of live alias with single alias record in one atomic change batch.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+        live_alias: Your external DNS record pointing to live web server.
+        target: blue.<domain> or green.<domain> which should get all the traffic.
+    :return: Result of the change (AWS respond).
+    """
+    zone = route53_cache.get_zone(route53_conn, domain)
+    records = route53_cache.new_change_batch(route53_conn, domain)
+
+    for record in route53_cache.for_zone(route53_conn, domain).find(live_alias, 'A'):
+        if record.identifier is not None:
+            _delete_record(records, record)
+
+    _add_alias(records, 'UPSERT', live_alias, target, zone.id)
+
+    return route53_cache.commit(route53_conn, domain, records)
+
+
+def shift_traffic(route53_conn, domain, live_alias, old_alias, new_alias, old_id, new_id, gate, steps=None,
+                  step_wait=STEP_WAIT, sleep=None):
+    """
+    :description: Moves live traffic from old to new color in steps. Rolls back when gate fails.
+    :param
+        route53_conn: Connection to AWS Route53 service
+        domain: Your Domain
+        live_alias: Your external DNS record pointing to live web server.
+        old_alias: blue.<domain> or green.<domain> which is live now.
+        new_alias: blue.<domain> or green.<domain> which is going to be live.
+        old_id: Set identifier of old color weighted record (blue or green).
+        new_id: Set identifier of new color weighted record (blue or green).
+        gate: Function which gets percent of traffic on new color and returns (passed, reason) tuple.
+        steps: Increasing list of percents of traffic on new color. Last one should be 100.
+        step_wait: Seconds of traffic between step and its gate.
+        sleep: Function used for sleeping (time.sleep by default)
+    :return: Boolean - True if new color is live, False if we rolled back.
+    """
+    sleep = sleep or time.sleep
+    steps = steps or STEPS
+
+    for percent in steps:
+        if percent >= 100:
+            break
+
+        LOGGER.warning('Shifting %s%% of %s traffic to %s' % (percent, live_alias, new_alias))
+        set_weights(route53_conn, domain, live_alias,
+                    [(old_id, old_alias, 100 - percent), (new_id, new_alias, percent)])
+
+        sleep(step_wait)
+
+        passed, reason = gate(percent)
+        if not passed:
+            LOGGER.error('Gate failed at %s%% (%s). Moving all traffic back to %s' % (percent, reason, old_alias))
+            set_single(route53_conn, domain, live_alias, old_alias)
+            return False
+
+    LOGGER.warning('Shifting 100%% of %s traffic to %s' % (live_alias, new_alias))
+    set_single(route53_conn, domain, live_alias, new_alias)
+
+    return True
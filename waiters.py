@@ -0,0 +1,199 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Waiters for many EC2 instances at once. Whole set is checked with one describe call per tick and ticks are
+spread with jittered exponential backoff.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import logging
+import random
+import time
+
+# Local modules
+import lazy
+
+# AWS Boto library (imported on first use)
+exception = lazy.load('boto.exception')
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# Default backoff (in seconds). First check is done straight away.
+BASE_DELAY = 2
+MAX_DELAY = 30
+
+# Default overall timeout (in seconds). Same 4 minutes we always waited for Public IP.
+TIMEOUT = 240
+
+# Checks made inside expected window (see poll_delay), but never more often than MIN_DENSE_DELAY.
+DENSE_CHECKS = 10
+MIN_DENSE_DELAY = 1
+
+WaitResult = collections.namedtuple('WaitResult', ['ready', 'timed_out'])
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def has_public_ip(instance):
+    """
+    :description: Ready condition - instance got its Public IP.
+    :param
+        instance: EC2 instance
+    :return: Boolean
+    """
+    return instance.ip_address is not None
+
+
+def is_running(instance):
+    """
+    :description: Ready condition - instance is in running state.
+    :param
+        instance: EC2 instance
+    :return: Boolean
+    """
+    return instance.state == 'running'
+
+
+def is_stopped(instance):
+    """
+    :description: Ready condition - instance is in stopped state.
+    :param
+        instance: EC2 instance
+    :return: Boolean
+    """
+    return instance.state == 'stopped'
+
+
+def backoff_delay(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """
+    :description: Exponential backoff with jitter. Half of the delay is fixed, the other half is random so many
+                  waiters do not hit the API at the same moment.
+    :param
+        attempt: Number of checks done so far (starting from 0).
+        base_delay: Delay after first check.
+        max_delay: Upper limit of the delay.
+    :return: delay in seconds
+    """
+    delay = min(max_delay, base_delay * (2 ** attempt))
+
+    return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+def poll_delay(attempt, elapsed, expected=None, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """
+    :description: Delay before next check. Without expected window it is backoff_delay. With window, the first
+                  check after the start waits until the window opens, checks are dense inside the window and back off
+                  after it.
+    :param
+        attempt: Number of backed off checks so far
+        elapsed: Seconds since the wait started
+        expected: Tuple with start and end (seconds since the wait started) of expected readiness or None
+        base_delay: Delay after first check
+        max_delay: Upper limit of the delay
+    :return: delay in seconds
+    """
+    if expected is not None:
+        start, end = expected
+        if elapsed < start:
+            return start - elapsed
+        if elapsed < end:
+            return max(MIN_DENSE_DELAY, (end - start) / float(DENSE_CHECKS))
+
+    return backoff_delay(attempt, base_delay, max_delay)
+
+
+def iter_ready_instances(ec2_conn, instance_ids, condition=has_public_ip, timeout=TIMEOUT, base_delay=BASE_DELAY,
+                         max_delay=MAX_DELAY, sleep=None, expected=None):
+    """
+    :description: Yields instances as soon as they meet the condition. All instances still pending are checked with
+                  one get_only_instances call per tick.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        instance_ids: IDs of instances to wait for
+        condition: Function which gets instance and returns True when it is ready
+        timeout: How long (in seconds) we wait in total
+        base_delay: Delay after first check
+        max_delay: Upper limit of the delay between checks
+        sleep: Function used for sleeping (time.sleep by default)
+        expected: Tuple with start and end (seconds from now) of expected readiness, checks are dense inside it
+    :return: generator of (instance_id, instance) pairs. Instance is None for instances which timed out.
+    """
+    sleep = sleep or time.sleep
+    pending = list(instance_ids)
+    start = time.time()
+    deadline = start + timeout
+    attempt = 0
+
+    while pending:
+        try:
+            instances = ec2_conn.get_only_instances(instance_ids=pending)
+        except exception.EC2ResponseError as ex:
+            # Freshly launched instances are not always visible straight away.
+            if ex.error_code != 'InvalidInstanceID.NotFound':
+                raise
+            LOGGER.debug('Instances %s are not visible yet.' % pending)
+            instances = []
+
+        for instance in instances:
+            if instance.id in pending and condition(instance):
+                pending.remove(instance.id)
+                yield instance.id, instance
+
+        remaining = deadline - time.time()
+        if not pending or remaining <= 0:
+            break
+
+        elapsed = time.time() - start
+        sleep(min(remaining, poll_delay(attempt, elapsed, expected, base_delay, max_delay)))
+        if expected is None or elapsed >= expected[1]:
+            attempt += 1
+
+    for instance_id in pending:
+        yield instance_id, None
+
+
+def wait_for_instances(ec2_conn, instance_ids, condition=has_public_ip, timeout=TIMEOUT, base_delay=BASE_DELAY,
+                       max_delay=MAX_DELAY, on_ready=None, sleep=None, expected=None):
+    """
+    :description: Waits until all instances meet the condition or timeout is reached.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        instance_ids: IDs of instances to wait for
+        condition: Function which gets instance and returns True when it is ready
+        timeout: How long (in seconds) we wait in total
+        base_delay: Delay after first check
+        max_delay: Upper limit of the delay between checks
+        on_ready: Optional function called with every instance as soon as it is ready
+        sleep: Function used for sleeping (time.sleep by default)
+        expected: Tuple with start and end (seconds from now) of expected readiness (see poll_delay)
+    :return: WaitResult with dictionary of ready instances (by ID) and list of IDs which timed out.
+    """
+    ready = {}
+    timed_out = []
+
+    for instance_id, instance in iter_ready_instances(ec2_conn, instance_ids, condition, timeout, base_delay,
+                                                      max_delay, sleep, expected):
+        if instance is None:
+            timed_out.append(instance_id)
+        else:
+            ready[instance_id] = instance
+            if on_ready is not None:
+                on_ready(instance)
+
+    if timed_out:
+        LOGGER.warning('Instances %s were not ready after %s seconds.' % (timed_out, timeout))
+
+    return WaitResult(ready, timed_out)
@@ -0,0 +1,203 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Warm pool of stopped, pre-baked instances for the next release. They were launched from the AMI and booted once, so
+starting them takes seconds instead of minutes of launching new ones. Deploy takes instances from the pool (only
+those of the same application with the same AMI, instance type and subnet) and the pool is refilled in the background.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import logging
+import threading
+import time
+
+# Local modules
+import inventory
+import lazy
+import placement
+import waiters
+
+# AWS Boto library (imported on first use)
+exception = lazy.load('boto.exception')
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+# Environment tag of pool members.
+TAG_VALUE = 'warm-pool'
+
+# States in which instance is still a member of the pool (it is being baked or stopped).
+MEMBER_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+# How long (in seconds) we wait for new pool members to boot before stopping them.
+BAKE_TIMEOUT = 600
+
+# One refill of the same pool at a time, otherwise parallel deploys would overfill it. Lock per pool (region,
+# application, AMI, instance type), so refills of other pools don't wait for each other.
+_REFILL_LOCKS = {}
+_LOCK = threading.Lock()
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def matches(instance, image_id, instance_size, subnet_id):
+    """
+    :description: Checks if pool member was baked from given AMI with given type in given subnet.
+    :param
+        instance: Pool member
+        image_id: Amazon Machine Image ID
+        instance_size: String with instance size
+        subnet_id: Subnet ID or list of them (member in any of them matches)
+    :return: boolean result
+    """
+    return instance.image_id == image_id and instance.instance_type == instance_size and \
+        instance.subnet_id in placement.subnet_list(subnet_id)
+
+
+def refill_lock(region, app, image_id, instance_size):
+    """
+    :description: Returns lock of the pool with given launch configuration.
+    :return: threading.Lock
+    """
+    with _LOCK:
+        return _REFILL_LOCKS.setdefault((region, app, image_id, instance_size), threading.Lock())
+
+
+def members(ec2_conn, image_id, instance_size, subnet_id, states=None, app=None):
+    """
+    :description: Returns pool members matching the launch configuration.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        image_id: Amazon Machine Image ID
+        instance_size: String with instance size
+        subnet_id: Subnet ID
+        states: List of states (all member states by default)
+        app: Application (App tag) or None
+    :return: list of instances
+    """
+    return [instance for instance in inventory.for_connection(ec2_conn).find(TAG_VALUE, states or MEMBER_STATES, app)
+            if matches(instance, image_id, instance_size, subnet_id)]
+
+
+def take(ec2_conn, count, image_id, instance_size, subnet_id, app=None):
+    """
+    :description: Takes up to count stopped instances from the pool and starts them. Caller has to tag them.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        count: Number of instances needed
+        image_id: Amazon Machine Image ID
+        instance_size: String with instance size
+        subnet_id: Subnet ID
+        app: Application (App tag) or None
+    :return: list of started instances (could be shorter than count or empty)
+    """
+    taken = members(ec2_conn, image_id, instance_size, subnet_id, ['stopped'], app)[:count]
+
+    if not taken:
+        LOGGER.warning('Warm pool is empty. New instances have to be launched.')
+        return []
+
+    ids = [instance.id for instance in taken]
+    try:
+        ec2_conn.start_instances(instance_ids=ids)
+    except exception.EC2ResponseError as ex:
+        LOGGER.error('Could not start warm pool instances %s: %s' % (ids, ex))
+        return []
+    finally:
+        inventory.invalidate(ec2_conn)
+
+    LOGGER.info('Took %s instance(s) from warm pool: %s' % (len(taken), ids))
+
+    return taken
+
+
+def fill(ec2_conn, size, image_id, ssh_key, sec_group, subnet_id, instance_name, instance_size, app=None,
+         sleep=None, region=None):
+    """
+    :description: Launches missing pool members, waits until they booted once and stops them. Members which did not
+                  boot in BAKE_TIMEOUT are terminated.
+    :param
+        ec2_conn: Connection to AWS EC2 service
+        size: Wanted number of pool members
+        image_id: Amazon Machine Image ID with all your software
+        ssh_key: AWS key pair name
+        sec_group: Security group ID that should be allocated
+        subnet_id: Subnet ID in which your instance should be created (the first one of list)
+        instance_name: Name tag value
+        instance_size: String with instance size
+        app: Application (App tag) the pool belongs to or None
+        sleep: Function used for sleeping (time.sleep by default)
+        region: AWS region of the connection (pools of other regions are filled at the same time)
+    :return: list of IDs of new pool members
+    """
+    with refill_lock(region, app, image_id, instance_size):
+        inventory.invalidate(ec2_conn)
+        missing = size - len(members(ec2_conn, image_id, instance_size, subnet_id, app=app))
+
+        if missing <= 0:
+            return []
+
+        LOGGER.info('Adding %s instance(s) to warm pool.' % missing)
+        reservation = ec2_conn.run_instances(image_id,
+                                             key_name=ssh_key,
+                                             instance_type=instance_size,
+                                             subnet_id=placement.subnet_list(subnet_id)[0],
+                                             security_group_ids=sec_group,
+                                             instance_initiated_shutdown_behavior='stop',
+                                             min_count=missing,
+                                             max_count=missing)
+        ids = [instance.id for instance in reservation.instances]
+        tags = {'Name': instance_name,
+                'Environment': TAG_VALUE,
+                'Deployment Date': time.strftime("%d-%m-%Y")}
+        if app is not None:
+            tags[inventory.APP_TAG_KEY] = app
+        ec2_conn.create_tags(ids, tags)
+        inventory.invalidate(ec2_conn)
+
+        # First boot does the slow part (cloud-init, caches), then the instance waits stopped.
+        result = waiters.wait_for_instances(ec2_conn, ids, waiters.is_running, BAKE_TIMEOUT, sleep=sleep)
+        if result.ready:
+            ec2_conn.stop_instances(instance_ids=list(result.ready))
+            inventory.invalidate(ec2_conn)
+
+        if result.timed_out:
+            # Otherwise they would be counted as members (pending / running) forever and never taken.
+            timed_out = list(result.timed_out)
+            LOGGER.error('Warm pool instances %s did not boot in %s seconds. Terminating them.'
+                         % (timed_out, BAKE_TIMEOUT))
+            ec2_conn.terminate_instances(instance_ids=timed_out)
+            inventory.invalidate(ec2_conn)
+
+        return [instance_id for instance_id in ids if instance_id in result.ready]
+
+
+def refill_in_background(ec2_conn, size, image_id, ssh_key, sec_group, subnet_id, instance_name, instance_size,
+                         app=None, region=None):
+    """
+    :description: Starts fill in separate thread. Script waits for it before exiting.
+    :param: See fill.
+    :return: Thread
+    """
+    def refill():
+        try:
+            fill(ec2_conn, size, image_id, ssh_key, sec_group, subnet_id, instance_name, instance_size, app,
+                 region=region)
+        except exception.EC2ResponseError as ex:
+            LOGGER.error('Could not refill warm pool: %s' % ex)
+
+    thread = threading.Thread(target=refill, name='warm-pool-refill')
+    thread.start()
+
+    return thread
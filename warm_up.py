@@ -0,0 +1,175 @@
+__author__ = 'jacek gruzewski'
+
+#!/user/bin/python3.4
+
+"""
+Warm-up of staging before switch. Freshly deployed color has cold application caches, JIT and page cache, so the first
+minutes of live traffic would see latency spike. Sample of recorded production requests (local access log in common
+or combined format) is replayed against every staging node at the same time at fixed rate, round after round, until
+latency of every node levels off: p50 and p95 of a round are within tolerance of the previous round for STABLE_ROUNDS
+rounds in a row (p95 alone can stay flat while many requests still miss cold caches). Only GET and HEAD requests are
+replayed by default, they are safe to send twice.
+
+Requests are sent with load_test.run_load, so they are open-loop and are picked from the sample with the weight of
+how often they were recorded.
+"""
+
+############################################################
+#      IMPORTS
+############################################################
+
+# Python's libraries
+import collections
+import logging
+import random
+import re
+import time
+
+# Local modules
+import load_test
+
+#####################################################################
+#      Static data and configuration
+#####################################################################
+
+LOGGER = logging.getLogger(__name__)
+
+SAMPLE_SIZE = 1000          # requests taken from access log
+METHODS = ('GET', 'HEAD')   # only requests which are safe to replay
+RPS = 20                    # requests per second sent to every node
+CONCURRENCY = 4             # connections per node
+ROUND = 10                  # seconds of one round
+TOLERANCE = 0.2             # percentile of round may differ from previous round by this fraction and still be level
+MIN_CHANGE = 0.005          # seconds, smaller change is always level (fast pages are noisy in relative terms)
+STABLE_ROUNDS = 3
+TIMEOUT = 300               # seconds, warm-up fails when latency doesn't level off sooner
+MAX_ERROR_RATE = load_test.MAX_ERROR_RATE
+
+# '... "GET /path?query HTTP/1.1" 200 ...' of common and combined log formats (nginx, Apache, ELB is similar).
+REQUEST_PATTERN = re.compile(r'"(?P<method>[A-Z]+) (?P<path>/\S*)(?: HTTP/[0-9.]+)?" (?P<status>\d{3}) ')
+
+WarmUp = collections.namedtuple('WarmUp', ['warm', 'reason', 'rounds', 'seconds', 'latencies'])
+
+#####################################################################
+#      Functions
+#####################################################################
+
+
+def read_access_log(path, sample_size=SAMPLE_SIZE, methods=METHODS):
+    """
+    :description: Takes random sample of successful requests from access log (reservoir sampling, file of any size
+                  is read once).
+    :param
+        path: Access log
+        sample_size: Number of requests in the sample
+        methods: Methods of requests which are replayed
+    :return: list of (method, path, weight) for load_test.run_load, weight is how often request is in the sample
+    """
+    sample = []
+    seen = 0
+
+    with open(path, errors='replace') as log_file:
+        for line in log_file:
+            match = REQUEST_PATTERN.search(line)
+            if match is None or match.group('method') not in methods or match.group('status')[0] not in '23':
+                continue
+
+            seen += 1
+            request = (match.group('method'), match.group('path'))
+            if len(sample) < sample_size:
+                sample.append(request)
+            else:
+                position = random.randrange(seen)
+                if position < sample_size:
+                    sample[position] = request
+
+    LOGGER.info('Sampled %s of %s requests from %s.' % (len(sample), seen, path))
+
+    return [(method, request_path, count) for (method, request_path), count
+            in sorted(collections.Counter(sample).items())]
+
+
+def levelled(latencies, tolerance=TOLERANCE, min_change=MIN_CHANGE):
+    """
+    :description: Tells whether the last round was as fast as the one before it.
+    :param
+        latencies: Percentile of every round so far (None when nothing succeeded)
+        tolerance: Accepted change as fraction of the previous round
+        min_change: Accepted change in seconds
+    :return: True or False
+    """
+    if len(latencies) < 2 or None in latencies[-2:]:
+        return False
+
+    previous, last = latencies[-2:]
+
+    return abs(last - previous) <= max(previous * tolerance, min_change)
+
+
+def warm_up(nodes, host_header, mix, rps=RPS, round_seconds=ROUND, tolerance=TOLERANCE, stable_rounds=STABLE_ROUNDS,
+            timeout=TIMEOUT, max_error_rate=MAX_ERROR_RATE, concurrency=CONCURRENCY, port=load_test.PORT,
+            request_timeout=load_test.REQUEST_TIMEOUT):
+    """
+    :description: Replays requests against all nodes at the same time until latency of every node levels off.
+    :param
+        nodes: list of IP addresses of staging nodes
+        host_header: Host header sent to nodes
+        mix: list of (method, path, weight), see read_access_log
+        rps: Requests per second sent to every node
+        round_seconds: Seconds of one round
+        tolerance: Accepted change of p50 and p95 between rounds (fraction)
+        stable_rounds: Number of level rounds in a row after which node is warm
+        timeout: Seconds after which warm-up gives up
+        max_error_rate: Round with more failed requests (fraction) is never level
+        concurrency: Connections per node
+        port: Port of web server
+        request_timeout: Seconds for single request
+    :return: WarmUp
+    """
+    started = time.time()
+    latencies = collections.OrderedDict((node, []) for node in nodes)
+    medians = dict((node, []) for node in nodes)
+    stable = dict((node, 0) for node in nodes)
+    options = {'mix': mix, 'rps': rps, 'duration': round_seconds, 'concurrency': concurrency, 'port': port,
+               'request_timeout': request_timeout}
+    rounds = 0
+
+    while True:
+        # Every node gets its own load, so slow node doesn't hide behind fast ones.
+        results = load_test.load_test([(node, ([node], host_header)) for node in nodes], **options)
+        rounds += 1
+
+        for result in results:
+            latencies[result.target].append(result.p95)
+            medians[result.target].append(result.p50)
+            error_rate = float(result.errors) / result.requests if result.requests else 1.0
+            if error_rate <= max_error_rate and levelled(latencies[result.target], tolerance) and \
+                    levelled(medians[result.target], tolerance):
+                stable[result.target] += 1
+            else:
+                stable[result.target] = 0
+
+        cold = [node for node in nodes if stable[node] < stable_rounds]
+        seconds = time.time() - started
+        LOGGER.info('Warm-up round %s: p95 %s, %s cold.' % (rounds, dict((node, values[-1]) for node, values
+                                                                          in latencies.items()), len(cold)))
+
+        if not cold:
+            return WarmUp(True, 'Latency of %s nodes levelled off after %s rounds (%.0fs).' % (len(nodes), rounds,
+                                                                                             seconds),
+                          rounds, seconds, dict(latencies))
+
+        if seconds + round_seconds > timeout:
+            return WarmUp(False, 'Latency of %s did not level off in %.0fs.' % (', '.join(cold), seconds),
+                          rounds, seconds, dict(latencies))
+
+
+def format_latencies(latencies):
+    """
+    :description: One line per node with p95 of every round, e.g. "10.0.0.1: 0.812 > 0.240 > 0.051 > 0.049".
+    :param
+        latencies: Dictionary with list of p95 by node (WarmUp.latencies)
+    :return: string
+    """
+    return '\n'.join('%s: %s' % (node, ' > '.join('-' if value is None else '%.3f' % value for value in values))
+                     for node, values in sorted(latencies.items()))